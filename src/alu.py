@@ -2,65 +2,242 @@ class ALU:
     def __init__(self):
         self.reset()
 
+        self.operations = {
+            "+":  self.add,
+            "-":  self.sub,
+            "*":  self.mult,
+            "/":  self.div,
+            "%":  self.mod,
+            "&":  self.bitAnd,
+            "|":  self.bitOr,
+            "^":  self.bitXor,
+            ">>": self.rshift,
+            "<<": self.lshift,
+            "~":  self.bitNot,
+        }
+
     def reset(self):
-        self.overflow = False
-        self.negative = False
-        self.zero = True
         self.result = 0
 
+    # Flags are only read by branches, so they are derived from the last result on demand
+    @property
+    def zero(self) -> bool:
+        return self.result == 0
+
+    @property
+    def negative(self) -> bool:
+        return self.result < 0
+
+    @property
+    def overflow(self) -> bool:
+        return self.result > 0xFFFF
+
     def convert2scompl(self, n):
         n &= 0xFFFF # Convert to 16 bit
         if n >= 0x8000 and n <= 0xFFFF:
             return ~n + 1
         return n
 
-    def setFlags(self):
-        if self.result > 0xFFFF:
-            self.overflow = True
+    def compute(self, op, val1, val2=0) -> None: # Return accumulator value and flags
+        if op not in self.operations:
+            self.reset()
+            raise Exception("Unknown operator \"{}\" given".format(op))
+        self.operations[op](val1, val2)
 
-        if self.result == 0:
-            self.zero = True
-            self.negative = False
-        elif self.result < 0:
-            self.zero = False
-            self.negative = True
-        else:
-            self.zero = False
-            self.negative = False
+    # Per-operation entry points, each one converts its operands the same way as
+    # convert2scompl, stores the result and returns it
 
-    def compute(self, op, val1, val2=0) -> None: # Return accumulator value and flags
-        self.reset()
+    def add(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        self.result = result = val1 + val2
+        return result
+
+    def sub(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        self.result = result = val1 - val2
+        return result
+
+    def mult(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        self.result = result = val1 * val2
+        return result
+
+    def div(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        if val2 == 0:
+            self.reset()
+            raise Exception("Divide by 0 Error")
+
+        self.result = result = int(val1 / val2)
+        return result
+
+    def mod(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        if val2 == 0:
+            self.reset()
+            raise Exception("Modulo by 0 Error")
+
+        self.result = result = val1 % val2
+        return result
+
+    def bitAnd(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        self.result = result = val1 & val2
+        return result
+
+    def bitOr(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        self.result = result = val1 | val2
+        return result
+
+    def bitXor(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        self.result = result = val1 ^ val2
+        return result
+
+    def rshift(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        if val2 < 0:
+            self.reset()
+        self.result = result = val1 >> val2
+        return result
+
+    def lshift(self, val1, val2) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+        val2 &= 0xFFFF
+        if val2 >= 0x8000: val2 = -val2
+
+        if val2 < 0:
+            self.reset()
+        self.result = result = val1 << val2
+        return result
+
+    def bitNot(self, val1, val2=0) -> int:
+        val1 &= 0xFFFF
+        if val1 >= 0x8000: val1 = -val1
+
+        self.result = result = ~val1
+        return result
+
+
+class WideALU(ALU): # 32 and 64-bit words, the same operand conversion with masks picked at construction
+    def __init__(self, bits):
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.sign = 1 << (bits - 1)
+        super().__init__()
+
+    @property
+    def overflow(self) -> bool:
+        return self.result > self.mask
+
+    def convert2scompl(self, n):
+        n &= self.mask
+        if n >= self.sign:
+            return ~n + 1
+        return n
+
+    def add(self, val1, val2) -> int:
+        self.result = result = self.convert2scompl(val1) + self.convert2scompl(val2)
+        return result
+
+    def sub(self, val1, val2) -> int:
+        self.result = result = self.convert2scompl(val1) - self.convert2scompl(val2)
+        return result
+
+    def mult(self, val1, val2) -> int:
+        self.result = result = self.convert2scompl(val1) * self.convert2scompl(val2)
+        return result
+
+    def div(self, val1, val2) -> int:
         val1 = self.convert2scompl(val1)
         val2 = self.convert2scompl(val2)
 
-        if op == "+":
-            self.result = val1 + val2
-        elif op == "-":
-            self.result = val1 - val2
-        elif op == "*":
-            self.result = val1 * val2
-        elif op == "/":
-            if val2 == 0:
-                raise Exception("Divide by 0 Error")
-            self.result = int(val1 / val2)
-        elif op == "%":
-            if val2 == 0:
-                raise Exception("Modulo by 0 Error")
-            self.result = val1 % val2
-        elif op == "&":
-            self.result = val1 & val2
-        elif op == "|":
-            self.result = val1 | val2
-        elif op == "^":
-            self.result = val1 ^ val2
-        elif op == ">>":
-            self.result = val1 >> val2
-        elif op == "<<":
-            self.result = val1 << val2
-        elif op == "~":
-            self.result = ~val1
-        else:
-            raise Exception("Unknown operator \"{}\" given".format(op))
+        if val2 == 0:
+            self.reset()
+            raise Exception("Divide by 0 Error")
+
+        self.result = result = int(val1 / val2)
+        return result
+
+    def mod(self, val1, val2) -> int:
+        val1 = self.convert2scompl(val1)
+        val2 = self.convert2scompl(val2)
+
+        if val2 == 0:
+            self.reset()
+            raise Exception("Modulo by 0 Error")
+
+        self.result = result = val1 % val2
+        return result
+
+    def bitAnd(self, val1, val2) -> int:
+        self.result = result = self.convert2scompl(val1) & self.convert2scompl(val2)
+        return result
+
+    def bitOr(self, val1, val2) -> int:
+        self.result = result = self.convert2scompl(val1) | self.convert2scompl(val2)
+        return result
+
+    def bitXor(self, val1, val2) -> int:
+        self.result = result = self.convert2scompl(val1) ^ self.convert2scompl(val2)
+        return result
+
+    def rshift(self, val1, val2) -> int:
+        val1 = self.convert2scompl(val1)
+        val2 = self.convert2scompl(val2)
+
+        if val2 < 0:
+            self.reset()
+        self.result = result = val1 >> min(val2, self.bits) # Same flags and masked value as the full shift, without huge ints
+        return result
+
+    def lshift(self, val1, val2) -> int:
+        val1 = self.convert2scompl(val1)
+        val2 = self.convert2scompl(val2)
 
-        self.setFlags()
+        if val2 < 0:
+            self.reset()
+        self.result = result = val1 << min(val2, self.bits)
+        return result
 
+    def bitNot(self, val1, val2=0) -> int:
+        self.result = result = ~self.convert2scompl(val1)
+        return result
@@ -0,0 +1,144 @@
+# Text assembler for PYVM, e.g.
+#
+#   sub:                    ; a label starts a new Program function
+#       .save r1            ; registers a call/callr to sub preserves, see Program.preserve
+#       pshi  0x0400
+#       pop   r1
+#       sub   r1, r2
+#       ret
+#   main:
+#       jali  sub
+#       bne   done          ; labels may be used before they are declared
+#   done: hlt
+#
+# Pass one lays out every statement and assigns label addresses, pass two encodes
+# operands and resolves label references.
+import hashlib
+
+from instruction import Instruction, Format, FORMATS, FUSED, lengths
+from program import Program, saveMask
+from registers import REGISTER_NAMES
+
+MNEMONICS = {instruction.name.lower(): instruction for instruction in Instruction if instruction not in FUSED} # Superinstructions come from peephole.fuse
+REGISTERS = {name: i * 2 for i, name in enumerate(REGISTER_NAMES)} # Same byte offsets as CPU.registerDict
+OPERAND_COUNTS = {Format.NONE: 0, Format.REG: 1, Format.REG_REG: 2, Format.WORD: 1}
+
+cache = {} # (sha256 of source, word size) -> (functions, labels, saves, byte_count)
+
+
+def assemble(source, word_size=16) -> Program:
+    key = (hashlib.sha256(source.encode("utf-8")).digest(), word_size)
+    if key not in cache:
+        cache[key] = assembleSource(source, word_size)
+    functions, labels, saves, byte_count = cache[key]
+
+    program = Program(word_size)
+    program.functions = {func: list(code) for func, code in functions.items()}
+    program.labels = dict(labels)
+    program.saves = dict(saves)
+    program.byte_count = byte_count
+    return program
+
+
+def assembleFile(path, word_size=16) -> Program:
+    with open(path, "r") as f:
+        return assemble(f.read(), word_size)
+
+
+def parseRegister(token, line_number) -> int:
+    if token not in REGISTERS:
+        raise Exception("Line {}: unknown register \"{}\"".format(line_number, token))
+    return REGISTERS[token]
+
+
+def parseImmediate(token, labels, line_number, word_size=16) -> int:
+    mask = (1 << word_size) - 1
+    if token in labels:
+        if labels[token] > mask:
+            raise Exception("Line {}: label \"{}\" is beyond the {}-bit address space".format(line_number, token, word_size))
+        return labels[token]
+    try:
+        value = int(token, 0)
+    except ValueError:
+        raise Exception("Line {}: unknown label or bad immediate \"{}\"".format(line_number, token))
+    if value < -(1 << (word_size - 1)) or value > mask:
+        raise Exception("Line {}: immediate {} does not fit in {} bits".format(line_number, token, word_size))
+    return value & mask
+
+
+def assembleSource(source, word_size=16) -> tuple:
+    word_bytes = word_size // 8
+    sizes = lengths(word_bytes)
+
+    # Pass one: layout
+    statements = []
+    labels = {}
+    saves = {}
+    order = []
+    func = None
+    address = 0
+
+    for line_number, line in enumerate(source.splitlines(), 1):
+        line = line.split(";", 1)[0].split("#", 1)[0].strip()
+        if not line:
+            continue
+
+        if ":" in line:
+            label, line = line.split(":", 1)
+            label = label.strip()
+            line = line.strip()
+            if not label.isidentifier():
+                raise Exception("Line {}: bad label \"{}\"".format(line_number, label))
+            if label in labels:
+                raise Exception("Line {}: label \"{}\" already declared".format(line_number, label))
+            labels[label] = address
+            order.append(label)
+            func = label
+            if not line:
+                continue
+
+        if func is None: # Statements before the first label belong to main, like Program.instruction
+            func = "main"
+            labels[func] = address
+            order.append(func)
+
+        parts = line.split(None, 1)
+        if parts[0].lower() == ".save": # Directive, the save mask of the current function
+            if func in saves:
+                raise Exception("Line {}: \"{}\" already has a .save".format(line_number, func))
+            operands = [operand.strip().lower() for operand in parts[1].split(",")] if len(parts) > 1 else []
+            registers = [parseRegister(operand, line_number) for operand in operands]
+            try:
+                saves[func] = saveMask(registers)
+            except Exception as e:
+                raise Exception("Line {}: {}".format(line_number, e))
+            continue
+
+        mnemonic = parts[0].lower()
+        if mnemonic not in MNEMONICS:
+            raise Exception("Line {}: unknown instruction \"{}\"".format(line_number, parts[0]))
+        instruction = MNEMONICS[mnemonic]
+        operands = [operand.strip() for operand in parts[1].split(",")] if len(parts) > 1 else []
+
+        operandFormat = FORMATS[instruction]
+        expected = OPERAND_COUNTS[operandFormat]
+        if len(operands) != expected:
+            raise Exception("Line {}: {} takes {} operand(s), got {}".format(line_number, mnemonic, expected, len(operands)))
+
+        statements.append((func, instruction, operandFormat, operands, line_number))
+        address += sizes[operandFormat]
+
+    # Pass two: encode and resolve label references
+    code = {func: bytearray() for func in order}
+    for func, instruction, operandFormat, operands, line_number in statements:
+        out = code[func]
+        out.append(instruction)
+        if operandFormat == Format.WORD:
+            value = parseImmediate(operands[0], labels, line_number, word_size)
+            out += value.to_bytes(word_bytes, "big")
+        else:
+            for operand in operands:
+                out.append(parseRegister(operand.lower(), line_number))
+
+    functions = {func: bytes(code[func]) for func in order}
+    return functions, labels, saves, address
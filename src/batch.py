@@ -0,0 +1,427 @@
+# Runs one program over many independent machines ("lanes") at once. Registers, the
+# stack, general memory and the ALU flags of all lanes live in NumPy arrays, and each
+# step executes the instruction at every distinct ip once, on all lanes sitting at it.
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("batch.py needs NumPy, install it with: pip install numpy")
+
+from cpu import CPU, SAVED_REGISTERS, RUNNING, HALTED, FAULT
+from instruction import Instruction
+from registers import MASK_REGISTERS, IP, AC, SP, FP
+
+
+class BatchCPU:
+    def __init__(self, lanes, memory_size=8192):
+        self.lanes = lanes
+        self.decoder = CPU(memory_size) # Holds the shared program segment and its decoded records
+
+        self.registerNames = self.decoder.registerNames
+        self.registerDict = self.decoder.registerDict
+        self.SP_MAX = self.decoder.SP_MAX
+
+        self.regs = np.zeros((len(self.registerNames), lanes), dtype=np.int64)
+        self.general = np.zeros((lanes, self.decoder.general.size), dtype=np.uint8)
+        self.stack = np.zeros((lanes, self.decoder.stack.size), dtype=np.uint8)
+        self.stack_frame_size = np.zeros(lanes, dtype=np.int64)
+
+        self.result = np.zeros(lanes, dtype=np.int64)
+        self.zero = np.ones(lanes, dtype=bool)
+        self.negative = np.zeros(lanes, dtype=bool)
+        self.overflow = np.zeros(lanes, dtype=bool)
+
+        self.status = np.full(lanes, RUNNING, dtype=np.int8)
+        self.errors = {} # Lane -> fault message
+
+        self.regs[SP] = self.SP_MAX & 0xFFFF
+        self.regs[FP] = self.SP_MAX & 0xFFFF
+
+        self.handlers = {instruction: getattr(self, "op" + instruction.name) for instruction in Instruction}
+
+    def loadProgram(self, functions, byte_count, saves=None) -> None:
+        self.decoder.loadProgram(functions, byte_count, saves)
+        self.regs[IP] = self.decoder.regs[IP]
+
+    def setRegister(self, name, values) -> None:
+        self.regs[self.registerDict[name] >> 1] = np.asarray(values, dtype=np.int64) & 0xFFFF
+
+    def fault(self, lanes, message) -> None:
+        self.status[lanes] = FAULT
+        for lane in lanes.tolist():
+            self.errors[lane] = message
+
+    def checked(self, lanes, bad, message) -> tuple: # Faults lanes where bad is set, returns the survivors and their mask
+        if bad.any():
+            self.fault(lanes[bad], message)
+            keep = ~bad
+            return lanes[keep], keep
+        return lanes, None
+
+    def step(self) -> bool:
+        active = np.flatnonzero(self.status == RUNNING)
+        if active.size == 0:
+            return False
+
+        ips, inverse = np.unique(self.regs[IP, active], return_inverse=True)
+        if ips.size == 1:
+            groups = [(int(ips[0]), active)]
+        else:
+            groups = [(int(ip), active[inverse == k]) for k, ip in enumerate(ips)]
+
+        decoded = self.decoder.decoded
+        for ip, lanes in groups:
+            try:
+                record = decoded[ip] if ip < len(decoded) else None
+                if record is None:
+                    record = self.decoder.decode(ip)
+            except Exception as e:
+                self.fault(lanes, str(e))
+                continue
+
+            instruction, a, b, next_ip = record
+            self.regs[IP, lanes] = next_ip # Before the unknown opcode check, a faulting lane stops past it like the scalar CPU
+            handler = self.handlers.get(instruction)
+            if handler is None:
+                self.fault(lanes, "Unknown instruction given: {}".format(instruction))
+                continue
+
+            handler(lanes, a, b)
+        return True
+
+    def run(self, max_steps=None) -> int:
+        steps = 0
+        while (max_steps is None or steps < max_steps) and self.step():
+            steps += 1
+        return steps
+
+    def laneState(self, lane) -> dict: # Same shape as differential.captureState for the scalar CPU
+        return {
+            "registers": {name: int(self.regs[i, lane]) for i, name in enumerate(self.registerNames)},
+            "stack": self.stack[lane].tobytes(),
+            "general": self.general[lane].tobytes(),
+            "stack_frame_size": int(self.stack_frame_size[lane]),
+            "flags": (bool(self.zero[lane]), bool(self.negative[lane]), bool(self.overflow[lane])),
+            "error": self.errors.get(lane),
+        }
+
+    # Stack, mirrors CPU.push/pop per lane
+
+    def push(self, lanes, values) -> tuple:
+        regs = self.regs
+        values = np.broadcast_to(values, lanes.shape)
+        sp = regs[SP, lanes]
+
+        lanes, keep = self.checked(lanes, sp + 1 >= self.stack.shape[1], "Address out of bounds")
+        if keep is not None:
+            sp = sp[keep]
+            values = values[keep]
+
+        self.stack[lanes, sp] = (values >> 8) & 0xFF
+        self.stack[lanes, sp + 1] = values & 0xFF
+
+        moves = sp > 0
+        regs[SP, lanes] = np.where(moves, (sp - 2) & 0xFFFF, sp)
+        self.stack_frame_size[lanes] += np.where(moves, 2, 0)
+        return lanes, keep
+
+    def pop(self, lanes) -> tuple:
+        regs = self.regs
+        sp = regs[SP, lanes]
+
+        moves = sp < self.SP_MAX
+        sp = np.where(moves, sp + 2, sp)
+        regs[SP, lanes] = sp
+        self.stack_frame_size[lanes] -= np.where(moves, 2, 0)
+
+        lanes, keep = self.checked(lanes, sp + 1 >= self.stack.shape[1], "Address out of bounds")
+        if keep is not None:
+            sp = sp[keep]
+
+        values = self.stack[lanes, sp].astype(np.int64) << 8 | self.stack[lanes, sp + 1]
+        return lanes, keep, values
+
+    def pushState(self, lanes) -> np.ndarray:
+        regs = self.regs
+        for register in SAVED_REGISTERS:
+            lanes, _ = self.push(lanes, regs[register, lanes])
+        lanes, _ = self.push(lanes, self.stack_frame_size[lanes] + 2)
+
+        regs[FP, lanes] = regs[SP, lanes]
+        self.stack_frame_size[lanes] = 0
+        return lanes
+
+    def popState(self, lanes) -> None:
+        regs = self.regs
+        stack_frame_address = regs[FP, lanes]
+        regs[SP, lanes] = stack_frame_address
+
+        lanes, keep, frame_size = self.pop(lanes)
+        if keep is not None:
+            stack_frame_address = stack_frame_address[keep]
+
+        for register in reversed(SAVED_REGISTERS):
+            lanes, keep, values = self.pop(lanes)
+            if keep is not None:
+                stack_frame_address = stack_frame_address[keep]
+                frame_size = frame_size[keep]
+            regs[register, lanes] = values
+
+        regs[FP, lanes] = (stack_frame_address + frame_size) & 0xFFFF
+        self.stack_frame_size[lanes] = frame_size - 2 * (len(SAVED_REGISTERS) + 1)
+
+    def pushFrame(self, lanes, mask) -> np.ndarray: # Mirrors CPU.pushFrame, mask is the same on every lane
+        regs = self.regs
+        for register in MASK_REGISTERS[mask]:
+            lanes, _ = self.push(lanes, regs[register, lanes])
+        lanes, _ = self.push(lanes, regs[IP, lanes])
+        lanes, _ = self.push(lanes, mask)
+        lanes, _ = self.push(lanes, self.stack_frame_size[lanes] + 2)
+
+        regs[FP, lanes] = regs[SP, lanes]
+        self.stack_frame_size[lanes] = 0
+        return lanes
+
+    def popFrame(self, lanes) -> None:
+        regs = self.regs
+        stack_frame_address = regs[FP, lanes]
+        regs[SP, lanes] = stack_frame_address
+
+        lanes, keep, frame_size = self.pop(lanes)
+        if keep is not None:
+            stack_frame_address = stack_frame_address[keep]
+        lanes, keep, masks = self.pop(lanes)
+        if keep is not None:
+            stack_frame_address = stack_frame_address[keep]
+            frame_size = frame_size[keep]
+        lanes, keep, ips = self.pop(lanes)
+        if keep is not None:
+            stack_frame_address = stack_frame_address[keep]
+            frame_size = frame_size[keep]
+            masks = masks[keep]
+        regs[IP, lanes] = ips
+
+        # Lanes may be returning from calls with different masks, restore each group on its own
+        masks &= 0xFF
+        for mask in np.unique(masks).tolist():
+            group = masks == mask
+            members, address, size = lanes[group], stack_frame_address[group], frame_size[group]
+
+            saved = MASK_REGISTERS[mask]
+            for register in reversed(saved):
+                members, keep, values = self.pop(members)
+                if keep is not None:
+                    address = address[keep]
+                    size = size[keep]
+                regs[register, members] = values
+
+            regs[FP, members] = (address + size) & 0xFFFF
+            self.stack_frame_size[members] = size - 2 * (len(saved) + 3)
+
+    # Register/Memory manipulation
+
+    def opLW(self, lanes, rd, rs) -> None:
+        address = self.regs[rs, lanes]
+        lanes, keep = self.checked(lanes, address + 1 >= self.general.shape[1], "Address out of bounds")
+        if keep is not None:
+            address = address[keep]
+        self.regs[rd, lanes] = self.general[lanes, address].astype(np.int64) << 8 | self.general[lanes, address + 1]
+
+    def opSW(self, lanes, rs, rd) -> None:
+        address = self.regs[rd, lanes]
+        value = self.regs[rs, lanes]
+        lanes, keep = self.checked(lanes, address + 1 >= self.general.shape[1], "Address out of bounds")
+        if keep is not None:
+            address = address[keep]
+            value = value[keep]
+        self.general[lanes, address] = (value >> 8) & 0xFF
+        self.general[lanes, address + 1] = value & 0xFF
+
+    def opSWP(self, lanes, r1, r2) -> None:
+        lanes, _ = self.push(lanes, self.regs[r1, lanes])
+        lanes, _ = self.push(lanes, self.regs[r2, lanes])
+        lanes, _, values = self.pop(lanes)
+        self.regs[r1, lanes] = values
+        lanes, _, values = self.pop(lanes)
+        self.regs[r2, lanes] = values
+
+    # Stack Operations
+
+    def opPSH(self, lanes, rs, _b) -> None:
+        self.push(lanes, self.regs[rs, lanes])
+
+    def opPSHI(self, lanes, value, _b) -> None:
+        self.push(lanes, value)
+
+    def opPOP(self, lanes, rd, _b) -> None:
+        lanes, _, values = self.pop(lanes)
+        self.regs[rd, lanes] = values
+
+    def opLI(self, lanes, rd, value) -> None:
+        lanes, _ = self.push(lanes, value)
+        self.opPOP(lanes, rd, 0)
+
+    def opMOV(self, lanes, rd, rs) -> None:
+        lanes, _ = self.push(lanes, self.regs[rs, lanes])
+        self.opPOP(lanes, rd, 0)
+
+    def opJAL(self, lanes, rs, _b) -> None:
+        address = self.regs[rs, lanes]
+        survivors = self.pushState(lanes)
+        if survivors.size != lanes.size:
+            address = address[np.isin(lanes, survivors)]
+        self.regs[IP, survivors] = address
+
+    def opJALI(self, lanes, address, _b) -> None:
+        lanes = self.pushState(lanes)
+        self.regs[IP, lanes] = address
+
+    def opRET(self, lanes, _a, _b) -> None:
+        self.popState(lanes)
+
+    def opCALL(self, lanes, address, _b) -> None:
+        lanes = self.pushFrame(lanes, self.decoder.saveMasks.get(address, 0))
+        self.regs[IP, lanes] = address
+
+    def opCALLR(self, lanes, rs, _b) -> None:
+        addresses = self.regs[rs, lanes]
+        for address in np.unique(addresses).tolist(): # The save mask follows the target
+            survivors = self.pushFrame(lanes[addresses == address], self.decoder.saveMasks.get(address, 0))
+            self.regs[IP, survivors] = address
+
+    def opRTN(self, lanes, _a, _b) -> None:
+        self.popFrame(lanes)
+
+    # Arithmetic and Logical Operands, same semantics as the ALU entry points
+
+    def operands(self, lanes, r1, r2) -> tuple:
+        a = self.regs[r1, lanes]
+        a = np.where(a >= 0x8000, -a, a) # Same conversion as ALU.convert2scompl
+        b = self.regs[r2, lanes]
+        b = np.where(b >= 0x8000, -b, b)
+        return a, b
+
+    def store(self, lanes, result) -> None:
+        self.result[lanes] = result
+        self.zero[lanes] = result == 0
+        self.negative[lanes] = result < 0
+        self.overflow[lanes] = result > 0xFFFF
+        self.regs[AC, lanes] = result & 0xFFFF
+
+    def opADD(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        self.store(lanes, a + b)
+
+    def opSUB(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        self.store(lanes, a - b)
+
+    def opMULT(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        self.store(lanes, a * b)
+
+    def opDIV(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        lanes, keep = self.checked(lanes, b == 0, "Divide by 0 Error")
+        if keep is not None:
+            a, b = a[keep], b[keep]
+        self.store(lanes, np.trunc(a / b).astype(np.int64)) # int(val1 / val2) also divides in double precision
+
+    def opMOD(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        lanes, keep = self.checked(lanes, b == 0, "Modulo by 0 Error")
+        if keep is not None:
+            a, b = a[keep], b[keep]
+        self.store(lanes, np.mod(a, b))
+
+    def opAND(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        self.store(lanes, a & b)
+
+    def opOR(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        self.store(lanes, a | b)
+
+    def opXOR(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        self.store(lanes, a ^ b)
+
+    def opLSHFT(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        lanes, keep = self.checked(lanes, b < 0, "negative shift count")
+        if keep is not None:
+            a, b = a[keep], b[keep]
+
+        # a fits in 17 signed bits, so shifts past 46 would leave int64. Their low 16 bits are
+        # zero and their flags follow the sign of a, which is all the VM can observe.
+        wide = b > 46
+        result = a << np.minimum(b, 46)
+        self.store(lanes, np.where(wide, 0, result))
+        if wide.any():
+            wideLanes = lanes[wide]
+            self.zero[wideLanes] = a[wide] == 0
+            self.negative[wideLanes] = a[wide] < 0
+            self.overflow[wideLanes] = a[wide] > 0
+
+    def opRSHFT(self, lanes, r1, r2) -> None:
+        a, b = self.operands(lanes, r1, r2)
+        lanes, keep = self.checked(lanes, b < 0, "negative shift count")
+        if keep is not None:
+            a, b = a[keep], b[keep]
+        self.store(lanes, a >> np.minimum(b, 63))
+
+    def opNOT(self, lanes, r1, _b) -> None:
+        a, _ = self.operands(lanes, r1, r1)
+        self.store(lanes, ~a)
+
+    # Instruction Pointer Manipulation
+
+    def opJR(self, lanes, rs, _b) -> None:
+        self.regs[IP, lanes] = self.regs[rs, lanes]
+
+    def opJI(self, lanes, address, _b) -> None:
+        self.regs[IP, lanes] = address
+
+    def branch(self, lanes, taken, address) -> None:
+        self.regs[IP, lanes[taken]] = address
+
+    def opBEQ(self, lanes, address, _b) -> None:
+        self.branch(lanes, self.zero[lanes], address)
+
+    def opBNE(self, lanes, address, _b) -> None:
+        self.branch(lanes, ~self.zero[lanes], address)
+
+    def opBLT(self, lanes, address, _b) -> None:
+        self.branch(lanes, self.negative[lanes], address)
+
+    def opBLE(self, lanes, address, _b) -> None:
+        self.branch(lanes, self.negative[lanes] | self.zero[lanes], address)
+
+    def opBGT(self, lanes, address, _b) -> None:
+        self.branch(lanes, ~self.negative[lanes], address)
+
+    def opBGE(self, lanes, address, _b) -> None:
+        self.branch(lanes, ~self.negative[lanes] | self.zero[lanes], address)
+
+    def opCMPB(self, lanes, operands, branch) -> None:
+        self.opSUB(lanes, *operands)
+        self.handlers[branch[0]](lanes, branch[1], 0)
+
+    def opTSTB(self, lanes, operands, branch) -> None:
+        self.opAND(lanes, *operands)
+        self.handlers[branch[0]](lanes, branch[1], 0)
+
+    # Lanes only hold general and stack, flat and port accesses are only serviced by the scalar CPU
+    def opLWA(self, lanes, _a, _b) -> None:
+        self.fault(lanes, "Flat memory access is not supported by the batch engine")
+
+    def opSWA(self, lanes, _a, _b) -> None:
+        self.fault(lanes, "Flat memory access is not supported by the batch engine")
+
+    def opIN(self, lanes, _a, _b) -> None:
+        self.fault(lanes, "I/O ports are not supported by the batch engine")
+
+    def opOUT(self, lanes, _a, _b) -> None:
+        self.fault(lanes, "I/O ports are not supported by the batch engine")
+
+    def opHLT(self, lanes, _a, _b) -> None:
+        self.status[lanes] = HALTED
@@ -0,0 +1,146 @@
+# VM benchmark suite, run from src/ with: python -m benchmarks [--json out.json] [--compare base.json] [--profile] [--optimize] [--fuse]
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+from cpu import CPU, HALTED
+from benchmarks.programs import BENCHMARKS
+from optimizer import optimize
+from peephole import fuse
+from profiler import Profiler
+
+ENGINES = ["run", "runCompiled"]
+
+
+def load(program) -> CPU:
+    cpu = CPU()
+    cpu.loadProgram(program.functions, program.byte_count, program.saves)
+    return cpu
+
+
+def countInstructions(program) -> int:
+    cpu = load(program)
+    if cpu.run() != HALTED:
+        raise Exception("Benchmark program did not halt: {}".format(cpu.error))
+    return cpu.steps
+
+
+def measure(program, engine, repeat) -> dict:
+    best = None
+    for _ in range(repeat):
+        cpu = load(program)
+        start = time.perf_counter()
+        getattr(cpu, engine)()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # tracemalloc only sees live blocks, so this is the peak Python heap growth during a run, not an allocation count
+    cpu = load(program)
+    tracemalloc.start()
+    getattr(cpu, engine)()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def runSuite(names, engines, repeat, fused=False, optimized=False) -> dict:
+    results = {}
+    for name in names:
+        program = BENCHMARKS[name]()
+        instructions = countInstructions(program) # Counted as written, so instr/s compares with and without --optimize and --fuse
+        if optimized:
+            program = optimize(program)
+        if fused:
+            program = fuse(program)
+        for engine in engines:
+            measurement = measure(program, engine, repeat)
+            results["{}/{}".format(name, engine)] = {
+                "instructions": instructions,
+                "seconds": measurement["seconds"],
+                "instructions_per_second": instructions / measurement["seconds"],
+                "peak_heap_bytes": measurement["peak_bytes"],
+            }
+    return results
+
+
+def printResults(results, baseline=None) -> None:
+    header = "{:<26}{:>12}{:>12}{:>14}{:>12}".format("benchmark", "instrs", "seconds", "instr/s", "peak heap")
+    if baseline is not None:
+        header += "{:>10}".format("speedup")
+    print(header)
+
+    for key, result in results.items():
+        line = "{:<26}{:>12}{:>12.4f}{:>14.0f}{:>12}".format(
+            key, result["instructions"], result["seconds"],
+            result["instructions_per_second"], result["peak_heap_bytes"])
+        if baseline is not None:
+            if key in baseline:
+                line += "{:>9.2f}x".format(result["instructions_per_second"] / baseline[key]["instructions_per_second"])
+            else:
+                line += "{:>10}".format("-")
+        print(line)
+
+
+def printOptimized(names) -> None: # Guest instructions each benchmark runs before and after optimizer.optimize
+    print("{:<26}{:>12}{:>12}{:>10}".format("benchmark", "instrs", "optimized", "ratio"))
+    for name in names:
+        program = BENCHMARKS[name]()
+        before = countInstructions(program)
+        after = countInstructions(optimize(program))
+        print("{:<26}{:>12}{:>12}{:>10.2f}".format(name, before, after, after / before))
+    print()
+
+
+def profile(names, fused=False, optimized=False) -> None: # Where each benchmark spends its time, by opcode, function and ip
+    for name in names:
+        program = BENCHMARKS[name]()
+        if optimized:
+            program = optimize(program)
+        cpu = load(fuse(program) if fused else program)
+        cpu.profiler = Profiler(cpu)
+        cpu.run()
+        print("== {} ==".format(name))
+        cpu.profiler.printReport(top=5)
+        print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("names", nargs="*", help="benchmarks to run ({}), default all".format(", ".join(BENCHMARKS)))
+    parser.add_argument("--engine", choices=ENGINES, action="append", help="execution engine, default all")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark, the best is kept")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--profile", action="store_true", help="print a profile of each benchmark instead of timing it")
+    parser.add_argument("--optimize", action="store_true", help="run the programs after the optimizer.optimize passes")
+    parser.add_argument("--fuse", action="store_true", help="run the programs after the peephole.fuse superinstruction pass")
+    args = parser.parse_args()
+
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark \"{}\"".format(name))
+
+    if args.profile:
+        profile(args.names or list(BENCHMARKS), args.fuse, args.optimize)
+        return
+
+    if args.optimize:
+        printOptimized(args.names or list(BENCHMARKS))
+    results = runSuite(args.names or list(BENCHMARKS), args.engine or ENGINES, args.repeat, args.fuse, args.optimize)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    printResults(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# Assembler throughput in source lines per second, run from src/ with: python -m benchmarks.assembler
+import time
+
+import assembler
+
+LINES = 24000
+
+
+def generateSource(lines) -> str:
+    body = []
+    blocks = lines // 8
+    for i in range(blocks):
+        body.append("block{}:".format(i))
+        body.append("    pshi  0x{:04x}        ; load a counter".format(i & 0xFFFF))
+        body.append("    pop   r1")
+        body.append("    add   r1, r2")
+        body.append("    psh   ac")
+        body.append("    pop   r3")
+        body.append("    bne   block{}".format((i + 1) % blocks)) # Forward reference
+        body.append("    jali  block{}".format(i // 2))
+    body.append("main: hlt")
+    return "\n".join(body) + "\n"
+
+
+def main() -> None:
+    source = generateSource(LINES)
+    lines = source.count("\n")
+
+    assembler.cache.clear()
+    start = time.perf_counter()
+    program = assembler.assemble(source)
+    cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assembler.assemble(source)
+    cached = time.perf_counter() - start
+
+    print("{} lines, {} bytes".format(lines, program.byte_count))
+    print("{:<10}{:>12.3f} s{:>14.0f} lines/s".format("assemble", cold, lines / cold))
+    print("{:<10}{:>12.3f} s{:>14.0f} lines/s".format("cached", cached, lines / cached))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Per-opcode cost of the handler table dispatch in CPU.run, run from src/ with: python -m benchmarks.dispatch
+#
+# Every handler is swapped for the same no-op method, so the only thing timed is the table lookup
+# and the bound method call run() does per instruction, and the numbers should stay flat from the
+# first opcode in the enum to the last.
+import time
+
+from cpu import CPU
+from instruction import Instruction
+
+ITERATIONS = 200000
+REPEAT = 5
+
+
+class NoOp:
+    def handler(self, _a, _b) -> int:
+        return 1
+
+
+def timeDispatch(dispatch, instruction, iterations) -> float: # The run() loop body around the handler
+    start = time.perf_counter()
+    for _ in range(iterations):
+        handler = dispatch[instruction]
+        if handler is None:
+            raise Exception("Unknown instruction given: {}".format(instruction))
+        handler(0, 0)
+    return time.perf_counter() - start
+
+
+def timeBaseline(iterations) -> float: # The bare loop, subtracted from every opcode
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    cpu = CPU()
+    noop = NoOp().handler
+    dispatch = [None if handler is None else noop for handler in cpu.dispatch]
+
+    opcodes = sorted(Instruction)
+
+    # Rounds over every opcode keep the best time of each, so a noisy moment hits one round, not one opcode
+    baseline = min(timeBaseline(ITERATIONS) for _ in range(REPEAT))
+    best = {}
+    for _ in range(REPEAT):
+        for instruction in opcodes:
+            elapsed = timeDispatch(dispatch, instruction, ITERATIONS)
+            best[instruction] = min(best.get(instruction, elapsed), elapsed)
+
+    print("{:<8}{:>8}{:>12}".format("opcode", "value", "ns/instr"))
+    costs = []
+    for instruction in opcodes:
+        costs.append((best[instruction] - baseline) / ITERATIONS * 1e9)
+        print("{:<8}{:>8}{:>12.1f}".format(instruction.name, hex(instruction), costs[-1]))
+    print("spread {:.1f} ns between the cheapest and the dearest opcode".format(max(costs) - min(costs)))
+
+
+if __name__ == "__main__":
+    main()
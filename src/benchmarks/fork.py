@@ -0,0 +1,39 @@
+# Cost of copying a CPU against memory_size, run from src/ with: python -m benchmarks.fork
+import time
+
+from cpu import CPU
+from benchmarks.programs import arithmeticLoop
+
+SIZES = [8192, 65536, 1 << 20, 8 << 20]
+ITERATIONS = 50
+
+
+def timeCall(function, iterations=ITERATIONS) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations
+
+
+def main() -> None:
+    program = arithmeticLoop()
+
+    print("{:<12}{:>14}{:>14}{:>14}{:>14}".format("memory", "copy us", "snapshot us", "fork us", "restore us"))
+    for size in SIZES:
+        cpu = CPU(size)
+        cpu.loadProgram(program.functions, program.byte_count)
+        cpu.run(max_steps=1000)
+
+        target = CPU(size)
+        with cpu.snapshot() as snapshot:
+            results = [
+                timeCall(lambda: snapshot.restore(CPU(size)), 5), # Fresh CPU plus a full copy of memory
+                timeCall(lambda: cpu.snapshot().close(), 5),
+                timeCall(snapshot.fork),
+                timeCall(lambda: snapshot.restore(target)),
+            ]
+        print("{:<12}".format(size) + "".join("{:>14.1f}".format(seconds * 1e6) for seconds in results))
+
+
+if __name__ == "__main__":
+    main()
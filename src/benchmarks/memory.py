@@ -0,0 +1,79 @@
+# Per-access cost of Memory word reads and writes, run from src/ with: python -m benchmarks.memory
+import os
+import tempfile
+import time
+
+from memory import Memory, MappedMemory
+
+ITERATIONS = 200000
+BULK_WORDS = 256
+IMAGE_SIZE = 64 << 20 # Data set for the startup comparison
+
+
+def legacyGetUint16(memory, address): # Memory.getUint16 before the fast path
+    if not memory.addressExists(address):
+        raise Exception("Address out of bounds")
+    if not memory.addressExists(address+1):
+        raise Exception("")
+    return int(memory.memory[address:(address + 1) + 1].hex(), 16)
+
+
+def timeLoop(function, iterations) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    memory = Memory(2048)
+    memory.writeWords(0, list(range(1024)))
+
+    results = [
+        ("legacy getUint16", timeLoop(lambda: legacyGetUint16(memory, 0x100), ITERATIONS), 1),
+        ("getUint16", timeLoop(lambda: memory.getUint16(0x100), ITERATIONS), 1),
+        ("setUint16", timeLoop(lambda: memory.setUint16(0x100, 0x1234), ITERATIONS), 1),
+    ]
+
+    words = list(range(BULK_WORDS))
+    bulkIterations = ITERATIONS // BULK_WORDS
+    results += [
+        ("getUint16 x{}".format(BULK_WORDS), timeLoop(lambda: [memory.getUint16(i * 2) for i in range(BULK_WORDS)], bulkIterations), BULK_WORDS),
+        ("readWords({})".format(BULK_WORDS), timeLoop(lambda: memory.readWords(0, BULK_WORDS), bulkIterations), BULK_WORDS),
+        ("writeWords({})".format(BULK_WORDS), timeLoop(lambda: memory.writeWords(0, words), bulkIterations), BULK_WORDS),
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.img")
+        with MappedMemory(path, 2048) as mapped:
+            mapped.writeWords(0, list(range(1024)))
+            results += [
+                ("mapped getUint16", timeLoop(lambda: mapped.getUint16(0x100), ITERATIONS), 1),
+                ("mapped setUint16", timeLoop(lambda: mapped.setUint16(0x100, 0x1234), ITERATIONS), 1),
+            ]
+
+        print("{:<20}{:>12}".format("access", "ns/word"))
+        for name, elapsed, words_per_call in results:
+            calls = ITERATIONS if words_per_call == 1 else bulkIterations
+            print("{:<20}{:>12.1f}".format(name, elapsed / (calls * words_per_call) * 1e9))
+
+        # Startup with a data set: copying it into a bytearray against mapping it and touching one word
+        with open(path, "wb") as file:
+            file.write(os.urandom(IMAGE_SIZE))
+
+        def copyImage():
+            with open(path, "rb") as file:
+                Memory(IMAGE_SIZE, bytearray(file.read())).getUint16(IMAGE_SIZE // 2)
+
+        def mapImage():
+            with MappedMemory(path, mode="c") as mapped:
+                mapped.getUint16(IMAGE_SIZE // 2)
+
+        print()
+        print("{:<20}{:>12}".format("{} MB data set".format(IMAGE_SIZE >> 20), "ms"))
+        print("{:<20}{:>12.2f}".format("copy", timeLoop(copyImage, 5) / 5 * 1e3))
+        print("{:<20}{:>12.2f}".format("map", timeLoop(mapImage, 5) / 5 * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# Throughput of pool.runMany against the number of worker processes, run from src/ with: python -m benchmarks.pool
+import os
+import time
+
+from benchmarks.programs import arithmeticLoop
+from pool import runMany
+
+JOBS = 16
+
+
+def main() -> None:
+    programs = [arithmeticLoop() for _ in range(JOBS)]
+    cores = os.cpu_count() or 1
+
+    print("{:<10}{:>12}{:>14}{:>10}".format("workers", "seconds", "programs/s", "speedup"))
+    baseline = None
+    for workers in range(1, cores + 1):
+        start = time.perf_counter()
+        results = runMany(programs, workers=workers)
+        elapsed = time.perf_counter() - start
+        if any(result["status"] != "halted" for result in results):
+            raise Exception("Benchmark program did not halt")
+
+        baseline = baseline or elapsed
+        print("{:<10}{:>12.3f}{:>14.1f}{:>10.2f}".format(workers, elapsed, JOBS / elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# Synthetic guest programs for the benchmark suite, each builder returns a Program
+import assembler
+
+
+def arithmeticLoop(iterations=20000):
+    return assembler.assemble("""
+    main:   pshi  {n}
+            pop   r1
+            pshi  1
+            pop   r2
+            pshi  3
+            pop   r3
+    loop:   add   r1, r3
+            mult  r3, r2
+            xor   r1, r3
+            sub   r1, r2
+            psh   ac
+            pop   r1
+            bne   loop
+            hlt
+    """.format(n=iterations))
+
+
+def recursion(depth=100, repeats=40):
+    # Every level is a JALI/RET pair, depth is bounded by the 3328 byte stack (20 bytes per frame)
+    return assembler.assemble("""
+    main:   pshi  {repeats}
+            pop   r5
+            pshi  1
+            pop   r2
+    outer:  pshi  {depth}
+            pop   r1
+            jali  rec
+            sub   r5, r2
+            psh   ac
+            pop   r5
+            bne   outer
+            hlt
+    rec:    sub   r1, r2
+            psh   ac
+            pop   r1
+            beq   leaf
+            jali  rec
+    leaf:   ret
+    """.format(depth=depth, repeats=repeats))
+
+
+def lightRecursion(depth=100, repeats=40):
+    # recursion() with CALL/RTN, each frame holds ip, the save mask, the frame size and the one register rec preserves
+    return assembler.assemble("""
+    main:   pshi  {repeats}
+            pop   r5
+            pshi  1
+            pop   r2
+    outer:  pshi  {depth}
+            pop   r1
+            call  rec
+            sub   r5, r2
+            psh   ac
+            pop   r5
+            bne   outer
+            hlt
+    rec:    .save r1
+            sub   r1, r2
+            psh   ac
+            pop   r1
+            beq   leaf
+            call  rec
+    leaf:   rtn
+    """.format(depth=depth, repeats=repeats))
+
+
+def stackLoop(iterations=10000):
+    return assembler.assemble("""
+    main:   pshi  {n}
+            pop   r1
+            pshi  1
+            pop   r2
+    loop:   psh   r1
+            psh   r2
+            pshi  7
+            pop   r4
+            pop   r5
+            pop   r6
+            swp   r4, r5
+            sub   r1, r2
+            psh   ac
+            pop   r1
+            bne   loop
+            hlt
+    """.format(n=iterations))
+
+
+def memorySweep(iterations=10000):
+    # Stores and reloads a word at an address that walks the general segment and wraps at 1 KiB
+    return assembler.assemble("""
+    main:   pshi  {n}
+            pop   r1
+            pshi  1
+            pop   r2
+            pshi  0
+            pop   r4
+            pshi  2
+            pop   r6
+            pshi  0x03FE
+            pop   r7
+    loop:   sw    r1, r4
+            lw    r5, r4
+            add   r4, r6
+            psh   ac
+            pop   r4
+            and   r4, r7
+            psh   ac
+            pop   r4
+            sub   r1, r2
+            psh   ac
+            pop   r1
+            bne   loop
+            hlt
+    """.format(n=iterations))
+
+
+def branchHeavy(iterations=10000):
+    return assembler.assemble("""
+    main:   pshi  {n}
+            pop   r1
+            pshi  1
+            pop   r2
+            pshi  0
+            pop   r3
+            pshi  3
+            pop   r7
+    loop:   and   r1, r7
+            beq   zero
+            blt   never
+            bgt   other
+    zero:   add   r3, r2
+            psh   ac
+            pop   r3
+    other:  sub   r1, r2
+            psh   ac
+            pop   r1
+            bne   loop
+            hlt
+    never:  hlt
+    """.format(n=iterations))
+
+
+BENCHMARKS = {
+    "arithmetic": arithmeticLoop,
+    "recursion": recursion,
+    "calls": lightRecursion,
+    "stack": stackLoop,
+    "memory": memorySweep,
+    "branch": branchHeavy,
+}
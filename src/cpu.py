@@ -1,447 +1,1139 @@
-from alu import ALU
+import time
+import weakref
+
+from alu import ALU, WideALU
 from memory import Memory
-from instruction import Instruction
+from instruction import Instruction, Format, FORMATS, FUSED, LENGTHS, lengths
+from registers import RegisterFile, REGISTER_NAMES, TYPECODES, MASK_REGISTERS, IP, AC, R1, R2, R3, R4, R5, R6, R7, R8, SP, FP
+from jit import BlockCompiler
+from program import layout
+from executable import Executable
+from verifier import verify
+
+SAVED_REGISTERS = (R1, R2, R3, R4, R5, R6, R7, R8, IP) # Pushed by pushState in this order
+
+SEGMENTS = ("general", "program", "io", "screen", "stack")
+
+# Run status, shared with batch.BatchCPU
+RUNNING = 0
+HALTED  = 1
+FAULT   = 2
+BUDGET  = 3 # max_steps used up, run() again to continue
+TIMEOUT = 4 # deadline passed, run() again to continue
+WAITING = 5 # an io read would block, run() again once the port has data
+
+STATUS_NAMES = {RUNNING: "running", HALTED: "halted", FAULT: "fault", BUDGET: "budget", TIMEOUT: "timeout", WAITING: "waiting"}
+
+RUN_SLICE = 1024 # Instructions between deadline checks
+
+
+def segmentSizes(memory_size) -> list: # In SEGMENTS order
+    return [
+        int(memory_size / 4),           # 2048 +
+        int(memory_size / 4),           # 2048 +
+        int(memory_size / 16),          # 512  +
+        int(memory_size / 32),          # 256  +
+        int(((memory_size / 32) * 13)), # 3328 = 8192 bytes
+    ]
+
+
+def weakHook(method): # Memory hook calling method while its object lives, a Memory shared by many CPUs doesn't keep them alive
+    reference = weakref.WeakMethod(method)
+
+    def hook(address, length):
+        target = reference()
+        if target is not None:
+            target(address, length)
+    return hook
+
+
+def detachHooks(memory, read, write) -> None:
+    memory.readHooks.remove(read)
+    memory.writeHooks.remove(write)
+
+
+class WouldBlock(Exception): # Raised by an io read hook when the port has nothing to read yet
+    pass
+
 
 class CPU:
-    def __init__(self, memory_size=8192):
+    def __new__(cls, memory_size=8192, buffer=None, word_size=16): # CPU(word_size=32) builds a WideCPU, the 16-bit handlers stay as they are
+        if cls is CPU and word_size != 16:
+            cls = WideCPU
+        return super().__new__(cls)
+
+    def __init__(self, memory_size=8192, buffer=None, word_size=16): # buffer replaces the flat bytearray (see snapshot.py), or is a Memory such as a MappedMemory
+        if word_size not in TYPECODES:
+            raise Exception("Unsupported word size: {}".format(word_size))
         self.memory_size = memory_size
 
-        self.general = Memory(int(self.memory_size / 4))            # 2048 +
-        self.program = Memory(int(self.memory_size / 4))            # 2048 +
-        self.io      = Memory(int(self.memory_size / 16))           # 512  +
-        self.screen  = Memory(int(self.memory_size / 32))           # 256  +
-        self.stack   = Memory(int(((self.memory_size / 32) * 13)))  # 3328 = 8192 bytes
+        self.wordBits = word_size
+        self.wordBytes = word_size // 8
+        self.wordMask = (1 << word_size) - 1
+        self.lengths = lengths(self.wordBytes) # Instruction length per format
+        self.maxLength = max(self.lengths.values())
+
+        # One flat address space, each segment is a Memory over a zero-copy view of its range
+        sizes = segmentSizes(self.memory_size)
+        if isinstance(buffer, Memory):
+            if buffer.size != sum(sizes):
+                raise Exception("Memory must be {} bytes".format(sum(sizes)))
+            self.memory = buffer
+        else:
+            self.memory = Memory(sum(sizes), buffer)
+        view = memoryview(self.memory.memory)
+
+        self.segments = {} # Segment name -> (base, size)
+        base = 0
+        for name, size in zip(SEGMENTS, sizes):
+            self.segments[name] = (base, size)
+            setattr(self, name, Memory(size, view[base:base + size]))
+            base += size
+
+        # Flat accesses (LWA/SWA) run the hooks of the segment they land in
+        if self.memory is buffer: # Shared with other CPUs and outlives this one, its hooks go when the CPU does
+            read, write = weakHook(self.forwardRead), weakHook(self.forwardWrite)
+            weakref.finalize(self, detachHooks, self.memory, read, write)
+        else:
+            read, write = self.forwardRead, self.forwardWrite
+        self.memory.onRead(read)
+        self.memory.onWrite(write)
 
         self.labels = {}
+        self.saveMasks = {} # Function address -> save mask used by CALL/CALLR
 
-        self.alu = ALU()
+        self.alu = ALU() if word_size == 16 else WideALU(word_size)
 
-        self.registerNames = [
-            'ip', 'ac',
-            'r1', 'r2', 'r3', 'r4',
-            'r5', 'r6', 'r7', 'r8',
-            'sp', 'fp',
-        ]
+        self.registerNames = list(REGISTER_NAMES)
 
-        self.registers = Memory(len(self.registerNames) * 2) # Create memory for 16-bit registers
+        self.registers = RegisterFile(self.registerNames, word_size)
+        self.regs = self.registers.values # Hot paths index this array directly with the constants from registers.py
 
         self.registerDict = {self.registerNames[i]: i * 2 for i in range(len(self.registerNames))}
 
-        self.SP_MAX = ((self.stack.size - 1) - 1)
+        self.SP_MAX = self.stack.size - self.wordBytes # Last word of the stack
         self.stack_frame_size = 0
 
-        self.setRegisterValue(self.getRegisterIndex('sp'), self.SP_MAX) # Stack pointer starts at last address, set address to 1 less than max, and subtract 1 for 0 indexing
-        self.setRegisterValue(self.getRegisterIndex('fp'), self.SP_MAX)
+        self.regs[SP] = self.SP_MAX & self.wordMask # Stack pointer starts at last address, set address to 1 less than max, and subtract 1 for 0 indexing
+        self.regs[FP] = self.SP_MAX & self.wordMask
+
+        self.dispatch = self.buildDispatchTable() # Opcode byte -> bound handler
+
+        self.decoded = [] # Program address -> (opcode, operand1, operand2, next_ip), grows up to the highest ip decoded
+        self.bound = [] # Program address -> (bound handler, operand1, operand2, next_ip), read by runVerified
+        self.verified = False # Set by loadProgram when the program passes verifier.verify
+        self.verifyErrors = [] # Why it didn't
+        self.program.onWrite(self.invalidateDecoded)
+
+        self.compiler = None # Created on the first runCompiled()
+
+        self.tracer = None # Optional callable(ip, opcode, operand1, operand2), see tracing.py
+        self.profiler = None # Optional profiler.Profiler, run() then times every handler
 
-    def loadProgram(self, functions, byte_count):
+        self.status = RUNNING
+        self.error = None # Exception that faulted the last run
+        self.steps = 0    # Instructions executed since the program was loaded
+
+    def loadProgram(self, functions, byte_count, saves=None): # saves is Program.saves
         if (byte_count + len(functions)) >= self.program.size:
             raise Exception("Program size too large")
 
         if "main" not in functions:
             raise Exception("Program requires main function")
 
-        program_index = 0
-        for func in functions:
-            self.labels[func] = program_index
-            for byte in functions[func]:
-                self.program.setUint8(program_index, int(byte))
-                program_index += 1
-        self.setRegisterValue(self.getRegisterIndex('ip'), self.labels["main"])
+        image, labels = layout(functions)
+        self.loadImage(image, labels["main"], labels, saves)
+        self.verifyImage(len(image))
+
+    def load(self, path) -> None: # Load an executable written by Program.save
+        with Executable(path) as executable:
+            if executable.word_size != self.wordBits:
+                raise Exception("{} is built for a {}-bit CPU".format(path, executable.word_size))
+            self.loadImage(executable.code, executable.entry, executable.labels, executable.saves)
+            self.verifyImage(len(executable.code))
+
+    def verifyImage(self, length) -> None: # Verified images run through runVerified, see verifier.py
+        # Decodes the whole image once, bad operands still only fault when (and if) they are executed
+        self.verifyErrors = verify(self, length)
+        if not self.verifyErrors:
+            dispatch = self.dispatch
+            self.bound = [None if record is None else (dispatch[record[0]],) + record[1:] for record in self.decoded]
+            self.verified = True
+
+    def loadImage(self, image, entry=0, labels=None, saves=None) -> None: # Instructions are decoded lazily as they first execute
+        with memoryview(image) as view:
+            if view.nbytes >= self.program.size:
+                raise Exception("Program size too large")
+            self.program.writeBytes(0, view)
+            if len(self.decoded) < view.nbytes:
+                self.decoded.extend([None] * (view.nbytes - len(self.decoded)))
+
+        self.labels = dict(labels) if labels is not None else {}
+        self.saveMasks = {}
+        self.bound = []
+        self.verified = False
+        self.verifyErrors = []
+        for name, mask in (saves or {}).items():
+            if name not in self.labels:
+                raise Exception("Save mask for unknown label \"{}\"".format(name))
+            self.saveMasks[self.labels[name]] = mask
+
+        if isinstance(entry, str):
+            if entry not in self.labels:
+                raise Exception("Entry label \"{}\" not found".format(entry))
+            entry = self.labels[entry]
+        self.regs[IP] = entry
+
+        self.status = RUNNING
+        self.error = None
+        self.steps = 0
+
+    def snapshot(self):
+        from snapshot import Snapshot # snapshot.py imports this module
+        return Snapshot(self)
+
+    def restore(self, snapshot) -> None:
+        snapshot.restore(self)
+
+    def fork(self): # Copy-on-write copy of this CPU, take a snapshot() once instead to fork many times
+        with self.snapshot() as snapshot:
+            return snapshot.fork()
+
+    def segmentsIn(self, address, length): # Flat range -> (segment Memory, offset, length) for each segment it touches
+        for name, (base, size) in self.segments.items():
+            start = max(address, base)
+            end = min(address + length, base + size)
+            if start < end:
+                yield getattr(self, name), start - base, end - start
+
+    def forwardRead(self, address, length) -> None:
+        for segment, offset, count in self.segmentsIn(address, length):
+            for hook in segment.readHooks:
+                hook(offset, count)
+
+    def forwardWrite(self, address, length) -> None:
+        for segment, offset, count in self.segmentsIn(address, length):
+            for hook in segment.writeHooks:
+                hook(offset, count)
 
     def getRegisterIndex(self, name) -> int:
-        if name not in self.registerNames:
+        if name not in self.registerDict:
             raise Exception("Register name: {} not found".format(name))
         return self.registerDict[name]
 
     def getRegisterValue(self, index) -> int:
-        if not self.registers.addressExists(index):
-            raise Exception("Register index: {} not found".format(index))
-        return self.registers.getUint16(index)
+        return self.regs[self.registers.index(index)]
 
     def setRegisterValue(self, index, value) -> None:
-        if not self.registers.addressExists(index):
-            raise Exception("Register index: {} not found".format(index))
-        self.registers.setUint16(index, value)
+        self.regs[self.registers.index(index)] = value & self.wordMask
 
     def printCPUState(self) -> None:
         for name in self.registerDict:
-            print("{} : {}".format(name, hex(self.getRegisterValue(self.getRegisterIndex(name)))[2:].zfill(4)))
+            print("{} : {}".format(name, hex(self.getRegisterValue(self.getRegisterIndex(name)))[2:].zfill(self.wordBytes * 2)))
 
     def push(self, value) -> None:
-        stack_pointer = self.getRegisterIndex('sp')
-        address = self.getRegisterValue(stack_pointer)
+        regs = self.regs
+        address = regs[SP]
 
         self.stack.setUint16(address, value)
 
         if address > 0: # Prevent the stack pointer from going out of bounds
-            address -= 2
-            self.setRegisterValue(stack_pointer, address) # Stack grows upwards
+            regs[SP] = (address - 2) & 0xFFFF # Stack grows upwards, an odd sp wraps around like any register write
             self.stack_frame_size += 2
 
     def pop(self) -> int:
-        stack_pointer = self.getRegisterIndex('sp')
-        address = self.getRegisterValue(stack_pointer)
+        regs = self.regs
+        address = regs[SP]
 
         if address < self.SP_MAX: # Prevent the stack pointer from going out of bounds
             address += 2
-            self.setRegisterValue(stack_pointer, address)
+            regs[SP] = address
             self.stack_frame_size -=2
 
         return self.stack.getUint16(address)
 
     def pushState(self) -> None:
-        self.push(self.getRegisterValue(self.getRegisterIndex('r1')))
-        self.push(self.getRegisterValue(self.getRegisterIndex('r2')))
-        self.push(self.getRegisterValue(self.getRegisterIndex('r3')))
-        self.push(self.getRegisterValue(self.getRegisterIndex('r4')))
-        self.push(self.getRegisterValue(self.getRegisterIndex('r5')))
-        self.push(self.getRegisterValue(self.getRegisterIndex('r6')))
-        self.push(self.getRegisterValue(self.getRegisterIndex('r7')))
-        self.push(self.getRegisterValue(self.getRegisterIndex('r8')))
-        self.push(self.getRegisterValue(self.getRegisterIndex('ip')))
-        self.push(self.stack_frame_size + 2)
-
-        self.setRegisterValue(self.getRegisterIndex('fp'), self.getRegisterValue(self.getRegisterIndex('sp')))
+        regs = self.regs
+        push = self.push
+
+        for register in SAVED_REGISTERS:
+            push(regs[register])
+        push(self.stack_frame_size + 2)
+
+        regs[FP] = regs[SP]
         self.stack_frame_size = 0
 
     def popState(self) -> None:
-        stack_frame_address = self.getRegisterValue(self.getRegisterIndex('fp'))
-        self.setRegisterValue(self.getRegisterIndex('sp'), stack_frame_address)
+        regs = self.regs
+        pop = self.pop
 
-        self.stack_frame_size = self.pop()
+        stack_frame_address = regs[FP]
+        regs[SP] = stack_frame_address
 
-        self.setRegisterValue(self.getRegisterIndex('ip'), self.pop())
-        self.setRegisterValue(self.getRegisterIndex('r8'), self.pop())
-        self.setRegisterValue(self.getRegisterIndex('r7'), self.pop())
-        self.setRegisterValue(self.getRegisterIndex('r6'), self.pop())
-        self.setRegisterValue(self.getRegisterIndex('r5'), self.pop())
-        self.setRegisterValue(self.getRegisterIndex('r4'), self.pop())
-        self.setRegisterValue(self.getRegisterIndex('r3'), self.pop())
-        self.setRegisterValue(self.getRegisterIndex('r2'), self.pop())
-        self.setRegisterValue(self.getRegisterIndex('r1'), self.pop())
+        frame_size = pop() # Caller's frame plus the saved state, i.e. the distance back to the caller's frame pointer
 
-        self.setRegisterValue(self.getRegisterIndex('fp'), (stack_frame_address - self.stack_frame_size))
+        for register in reversed(SAVED_REGISTERS):
+            regs[register] = pop()
 
-    def jump(self, address) -> None:
-        ip_index = self.getRegisterIndex('ip')
+        regs[FP] = (stack_frame_address + frame_size) & 0xFFFF
+        self.stack_frame_size = frame_size - 2 * (len(SAVED_REGISTERS) + 1)
 
-        print("Jumping to address: {}".format(address))
+    def pushFrame(self, mask) -> None: # CALL/CALLR frame: the registers in mask, ip, mask, frame size
+        regs = self.regs
+        saved = MASK_REGISTERS[mask]
+        address = regs[SP]
+        count = len(saved) + 3
 
-        self.setRegisterValue(ip_index, address)
+        if address > 2 * (count - 1): # Every push would move sp, so write the whole frame at once
+            words = [regs[register] for register in saved]
+            words += (regs[IP], mask, self.stack_frame_size + 2 * count)
+            words.reverse()
+            self.stack.writeWords(address - 2 * (count - 1), words)
+            regs[SP] = (address - 2 * count) & 0xFFFF
+        else:
+            push = self.push
+            for register in saved:
+                push(regs[register])
+            push(regs[IP])
+            push(mask)
+            push(self.stack_frame_size + 2)
+
+        regs[FP] = regs[SP]
+        self.stack_frame_size = 0
+
+    def popFrame(self) -> None:
+        regs = self.regs
+        stack = self.stack
+
+        stack_frame_address = regs[FP]
+        regs[SP] = stack_frame_address
+
+        if stack_frame_address + 4 < self.SP_MAX: # Every pop of the fixed part would move sp, read it at once
+            frame_size, mask, ip = stack.readWords(stack_frame_address + 2, 3)
+            saved = MASK_REGISTERS[mask & 0xFF]
+            count = len(saved)
+            if stack_frame_address + 2 * (count + 2) < self.SP_MAX:
+                regs[IP] = ip
+                for register, value in zip(reversed(saved), stack.readWords(stack_frame_address + 8, count)):
+                    regs[register] = value
+                regs[SP] = stack_frame_address + 2 * (count + 3)
+                regs[FP] = (stack_frame_address + frame_size) & 0xFFFF
+                self.stack_frame_size = frame_size - 2 * (count + 3)
+                return
+
+        pop = self.pop
+        frame_size = pop()
+        saved = MASK_REGISTERS[pop() & 0xFF]
+        regs[IP] = pop()
+
+        for register in reversed(saved):
+            regs[register] = pop()
+
+        regs[FP] = (stack_frame_address + frame_size) & 0xFFFF
+        self.stack_frame_size = frame_size - 2 * (len(saved) + 3)
+
+    def jump(self, address) -> None:
+        self.regs[IP] = address & 0xFFFF
 
     def fetch(self) -> int:
-        ip_reg = self.getRegisterIndex('ip')
-        ip_value = self.getRegisterValue(ip_reg)
-        instruction = self.program.getUint8(ip_value)
-        ip_value += 1
-        self.setRegisterValue(ip_reg, ip_value)
+        regs = self.regs
+        instruction = self.program.getUint8(regs[IP])
+        regs[IP] += 1
         return instruction
 
     def fetchWord(self) -> int:
-        ip_reg = self.getRegisterIndex('ip')
-        ip_value = self.getRegisterValue(ip_reg)
-        instruction = self.program.getUint16(ip_value)
-        ip_value += 2
-        self.setRegisterValue(ip_reg, ip_value)
+        regs = self.regs
+        instruction = self.program.getUint16(regs[IP])
+        regs[IP] += 2
         return instruction
 
+    def buildDispatchTable(self) -> list:
+        table = [None] * 256
+        for instruction in Instruction:
+            table[instruction] = getattr(self, "op" + instruction.name)
+        return table
+
+    def decode(self, address) -> tuple:
+        instruction = self.program.getUint8(address)
+
+        if instruction in FUSED:
+            head, tail = self.decodeParts(address, instruction)
+            if tail is None:
+                record = head
+            elif instruction in (Instruction.LI, Instruction.MOV):
+                record = (instruction, tail[1], head[1], tail[3]) # Destination, then the immediate or source
+            else:
+                record = (instruction, (head[1], head[2]), (tail[0], tail[1]), tail[3]) # ALU operands, then branch and target
+        else:
+            record = self.decodeOperands(address, instruction)
+
+        decoded = self.decoded
+        if address >= len(decoded): # Sized by use, a large program segment costs nothing until it runs
+            decoded.extend([None] * (address + 1 - len(decoded)))
+        decoded[address] = record
+        return record
+
+    def decodeOperands(self, address, instruction) -> tuple: # Record of a plain instruction, not cached
+        operandFormat = FORMATS.get(instruction, Format.NONE)
+        register = self.registers.index
+
+        if operandFormat == Format.WORD:
+            return (instruction, self.program.getUint16(address + 1), 0, address + 3)
+        elif operandFormat == Format.REG_REG:
+            return (instruction, register(self.program.getUint8(address + 1)), register(self.program.getUint8(address + 2)), address + 3)
+        elif operandFormat == Format.REG:
+            return (instruction, register(self.program.getUint8(address + 1)), 0, address + 2)
+        return (instruction, 0, 0, address + 1)
+
+    def decodeParts(self, address, instruction) -> tuple: # A superinstruction's (head, tail) records, tail is None if the sequence was broken since
+        first, following = FUSED[instruction]
+        head = self.decodeOperands(address, first)
+
+        next_ip = head[3]
+        if next_ip < self.program.size and self.program.getUint8(next_ip) in following:
+            try:
+                return head, self.decodeOperands(next_ip, self.program.getUint8(next_ip))
+            except Exception: # A bad tail faults after the head runs, as it would unfused
+                pass
+        return head, None # Runs as the instruction it replaced
+
+    def invalidateDecoded(self, address, length) -> None:
+        start = max(0, address - self.maxLength + 1)
+        end = min(address + length, len(self.decoded))
+        self.decoded[start:end] = [None] * (end - start)
+        end = min(address + length, len(self.bound))
+        if start < end:
+            self.bound[start:end] = [None] * (end - start)
+
     def execute(self, instruction) -> int:
-        # Register/Memory manipulation
-        if instruction == Instruction.LW:
-            rd = self.fetch()
-            rs = self.fetch()
+        handler = self.dispatch[instruction]
+        if handler is None:
+            raise Exception("Unknown instruction given: {}".format(instruction))
+        if instruction in FUSED:
+            return self.executeFused(instruction, handler)
+        return handler(*self.fetchOperands(instruction))
+
+    def fetchOperands(self, instruction) -> tuple:
+        operandFormat = FORMATS[instruction]
+        a = b = 0
+        if operandFormat == Format.WORD:
+            a = self.fetchWord()
+        elif operandFormat != Format.NONE:
+            a = self.registers.index(self.fetch())
+            if operandFormat == Format.REG_REG:
+                b = self.registers.index(self.fetch())
+        return a, b
+
+    def executeFused(self, instruction, handler) -> int: # Fetches the pair peephole.fuse replaced, as decode() reads it
+        regs = self.regs
+        first, following = FUSED[instruction]
+        head = self.fetchOperands(first)
+
+        tail_ip = regs[IP]
+        if tail_ip < self.program.size and self.program.getUint8(tail_ip) in following:
+            try:
+                branch = self.fetch()
+                tail = self.fetchOperands(branch)
+            except Exception: # A bad tail faults after the head runs, as it would unfused
+                regs[IP] = tail_ip
+            else:
+                if instruction in (Instruction.LI, Instruction.MOV):
+                    return handler(tail[0], head[0]) # Destination, then the immediate or source
+                return handler(head, (branch, tail[0]))
+        return self.dispatch[first](*head) # Runs as the instruction it replaced
+
+    # Register/Memory manipulation
+    def opLW(self, rd, rs) -> int:
+        regs = self.regs
+        regs[rd] = self.general.getUint16(regs[rs])
+        return 1
+
+    def opSW(self, rs, rd) -> int:
+        regs = self.regs
+        self.general.setUint16(regs[rd], regs[rs])
+        return 1
+
+    def opLWA(self, rd, rs) -> int: # Flat address, reaches any segment
+        regs = self.regs
+        try:
+            regs[rd] = self.memory.getUint16(regs[rs])
+        except WouldBlock: # An io port read through the flat address space blocks like opIN
+            regs[IP] = (regs[IP] - LENGTHS[Format.REG_REG]) & 0xFFFF
+            raise
+        return 1
+
+    def opSWA(self, rs, rd) -> int:
+        regs = self.regs
+        self.memory.setUint16(regs[rd], regs[rs])
+        return 1
+
+    def opSWP(self, r1, r2) -> int:
+        regs = self.regs
+
+        self.push(regs[r1])
+        self.push(regs[r2])
+
+        regs[r1] = self.pop()
+        regs[r2] = self.pop()
+
+        return 1
+
+    # Stack Operations
+    def opPSH(self, rs, _b) -> int:
+        self.push(self.regs[rs])
+
+        return 1
+
+    def opPSHI(self, value, _b) -> int:
+        self.push(value)
+
+        return 1
+
+    def opPOP(self, rd, _b) -> int:
+        self.regs[rd] = self.pop()
+
+        return 1
+
+    # Superinstructions, see peephole.py. The stack word the pair left behind is still written
+    def opLI(self, rd, value) -> int:
+        regs = self.regs
+        address = regs[SP]
+        if 1 < address < self.SP_MAX + 2 and not self.stack.readHooks: # The push and the pop both move SP, and the push doesn't wrap it
+            self.stack.setUint16(address, value)
+            regs[rd] = value & 0xFFFF
+            return 1
 
-            address = self.getRegisterValue(rs)
-            word_from_memory = self.general.getUint16(address)
+        self.opPSHI(value, 0)
+        return self.opPOP(rd, 0)
 
-            self.setRegisterValue(rd, word_from_memory)
+    def opMOV(self, rd, rs) -> int: # opLI inlined, moves are the most common pair in a loop body
+        regs = self.regs
+        address = regs[SP]
+        value = regs[rs]
+        if 1 < address < self.SP_MAX + 2 and not self.stack.readHooks:
+            self.stack.setUint16(address, value)
+            regs[rd] = value
             return 1
-        elif instruction == Instruction.SW:
-            rs = self.fetch()
-            rd = self.fetch()
 
-            address = self.getRegisterValue(rd)
-            word_to_memory = self.getRegisterValue(rs)
+        self.opPSH(rs, 0)
+        return self.opPOP(rd, 0)
 
-            self.general.setUint16(address, word_to_memory)
-            return 1
-        elif instruction == Instruction.SWP:
-            r1 = self.fetch()
-            r2 = self.fetch()
+    def opCMPB(self, operands, branch) -> int:
+        self.opSUB(*operands)
+        return self.dispatch[branch[0]](branch[1], 0)
 
-            self.push(self.getRegisterValue(r1))
-            self.push(self.getRegisterValue(r2))
+    def opTSTB(self, operands, branch) -> int:
+        self.opAND(*operands)
+        return self.dispatch[branch[0]](branch[1], 0)
 
-            self.setRegisterValue(r1, self.pop())
-            self.setRegisterValue(r2, self.pop())
+    def opJAL(self, rs, _b) -> int:
+        address = self.regs[rs]
 
-            return 1
+        self.pushState()
 
-        # Stack Operations
-        elif instruction == Instruction.PSH:
-            rs = self.fetch()
-            value = self.getRegisterValue(rs)
+        self.jump(address)
 
-            self.push(value)
+        return 1
 
-            return 1
-        elif instruction == Instruction.PSHI:
-            value = self.fetchWord()
+    def opJALI(self, address, _b) -> int:
+        self.pushState()
 
-            self.push(value)
+        self.jump(address)
 
-            return 1
-        elif instruction == Instruction.POP:
-            rd = self.fetch()
+        return 1
 
-            value = self.pop()
+    def opRET(self, _a, _b) -> int:
+        self.popState()
 
-            self.setRegisterValue(rd, value)
-            
-            return 1
-        elif instruction == Instruction.JAL:
-            rs = self.fetch()
-            address = self.getRegisterValue(rs)
+        return 1
 
-            self.pushState()
+    def opCALL(self, address, _b) -> int:
+        self.pushFrame(self.saveMasks.get(address, 0))
 
-            self.jump(address)
+        self.jump(address)
 
-            return 1
-        elif instruction == Instruction.JALI:
-            address = self.fetchWord()
+        return 1
 
-            self.pushState()
+    def opCALLR(self, rs, _b) -> int:
+        address = self.regs[rs]
 
-            self.jump(address)
+        self.pushFrame(self.saveMasks.get(address, 0))
 
-            return 1
+        self.jump(address)
 
-        elif instruction == Instruction.RET:
+        return 1
 
-            self.popState()
+    def opRTN(self, _a, _b) -> int:
+        self.popFrame()
 
-            return 1
+        return 1
 
-        # Arithmetic
-        elif instruction == Instruction.ADD:
-            r1 = self.fetch()
-            r2 = self.fetch()
+    # Arithmetic and Logical Operands, each bound straight to its ALU entry point
+    def opADD(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.add(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+    def opSUB(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.sub(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            self.alu.compute('+', r1Val, r2Val)
+    def opMULT(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.mult(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+    def opDIV(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.div(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        elif instruction == Instruction.SUB:
-            r1 = self.fetch()
-            r2 = self.fetch()
+    def opMOD(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.mod(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+    def opAND(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.bitAnd(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            self.alu.compute('-', r1Val, r2Val)
+    def opOR(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.bitOr(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+    def opXOR(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.bitXor(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        elif instruction == Instruction.MULT:
-            r1 = self.fetch()
-            r2 = self.fetch()
+    def opLSHFT(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.lshift(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+    def opRSHFT(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.rshift(regs[r1], regs[r2]) & 0xFFFF
+        return 1
 
-            self.alu.compute('*', r1Val, r2Val)
+    def opNOT(self, r1, _b) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.bitNot(regs[r1]) & 0xFFFF
+        return 1
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+    # Instruction Pointer Manipulation
+    def opJR(self, rs, _b) -> int:
+        self.jump(self.regs[rs])
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        elif instruction == Instruction.DIV:
-            r1 = self.fetch()
-            r2 = self.fetch()
+        return 1
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+    def opJI(self, address, _b) -> int:
+        self.jump(address)
 
-            self.alu.compute('/', r1Val, r2Val)
+        return 1
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+    def opBEQ(self, address, _b) -> int:
+        if self.alu.zero:
+            self.jump(address)
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        elif instruction == Instruction.MOD:
-            r1 = self.fetch()
-            r2 = self.fetch()
+        return 1
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+    def opBNE(self, address, _b) -> int:
+        if not self.alu.zero:
+            self.jump(address)
 
-            self.alu.compute('%', r1Val, r2Val)
+        return 1
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+    def opBLT(self, address, _b) -> int:
+        if self.alu.negative:
+            self.jump(address)
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        
-        # Logical Operands
-        elif instruction == Instruction.AND:
-            r1 = self.fetch()
-            r2 = self.fetch()
+        return 1
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+    def opBLE(self, address, _b) -> int:
+        if self.alu.negative or self.alu.zero:
+            self.jump(address)
 
-            self.alu.compute('&', r1Val, r2Val)
+        return 1
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+    def opBGT(self, address, _b) -> int:
+        if not self.alu.negative:
+            self.jump(address)
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        elif instruction == Instruction.OR:
-            r1 = self.fetch()
-            r2 = self.fetch()
+        return 1
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+    def opBGE(self, address, _b) -> int:
+        if not self.alu.negative or self.alu.zero:
+            self.jump(address)
 
-            self.alu.compute('|', r1Val, r2Val)
+        return 1
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+    # I/O ports, reads and writes go through the io segment's hooks, see ports.py
+    def opIN(self, rd, rs) -> int:
+        regs = self.regs
+        try:
+            regs[rd] = self.io.getUint16(regs[rs])
+        except WouldBlock: # Point ip back at this instruction so it retries on resume
+            regs[IP] = (regs[IP] - LENGTHS[Format.REG_REG]) & 0xFFFF
+            raise
+        return 1
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        elif instruction == Instruction.XOR:
-            r1 = self.fetch()
-            r2 = self.fetch()
+    def opOUT(self, rs, rd) -> int:
+        regs = self.regs
+        self.io.setUint16(regs[rd], regs[rs])
+        return 1
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+    def opHLT(self, _a, _b) -> int:
+        return 0
 
-            self.alu.compute('^', r1Val, r2Val)
+    def step(self) -> int:
+        regs = self.regs
+        ip_value = regs[IP]
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+        record = self.decoded[ip_value] if ip_value < len(self.decoded) else None
+        if record is None:
+            record = self.decode(ip_value)
+        instruction, a, b, next_ip = record
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        elif instruction == Instruction.LSHFT:
-            r1 = self.fetch()
-            r2 = self.fetch()
+        if self.tracer is not None:
+            self.tracer(ip_value, instruction, a, b)
+        regs[IP] = next_ip
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+        handler = self.dispatch[instruction]
+        if handler is None:
+            raise Exception("Unknown instruction given: {}".format(instruction))
+        return handler(a, b)
+
+    def run(self, max_steps=None, deadline=None) -> int: # Returns HALTED, BUDGET, TIMEOUT or FAULT, run() again to resume
+        if self.tracer is not None:
+            return self.runTraced(max_steps, deadline)
+        if self.profiler is not None:
+            return self.runProfiled(max_steps, deadline)
+        if self.verified:
+            return self.runVerified(max_steps, deadline)
+
+        regs = self.regs
+        decoded = self.decoded
+        dispatch = self.dispatch
+
+        # Instructions run in slices of at most RUN_SLICE, limits are only checked between slices
+        steps = 0
+        status = RUNNING
+        i = 0
+        try:
+            while status == RUNNING:
+                count = RUN_SLICE if max_steps is None else min(RUN_SLICE, max_steps - steps)
+                for i in range(count):
+                    ip_value = regs[IP]
+
+                    record = decoded[ip_value] if ip_value < len(decoded) else None
+                    if record is None:
+                        record = self.decode(ip_value)
+                    instruction, a, b, next_ip = record
+
+                    regs[IP] = next_ip
+
+                    handler = dispatch[instruction]
+                    if handler is None:
+                        raise Exception("Unknown instruction given: {}".format(instruction))
+                    if handler(a, b) == 0:
+                        steps += i + 1
+                        status = HALTED
+                        break
+                else:
+                    steps += count
+                    if max_steps is not None and steps >= max_steps:
+                        status = BUDGET
+                    elif deadline is not None and time.monotonic() >= deadline:
+                        status = TIMEOUT
+        except WouldBlock: # The blocked instruction rewound ip and runs again on the next run()
+            steps += i
+            status = WAITING
+        except Exception as e:
+            steps += i + 1
+            status = FAULT
+            self.error = e
+
+        self.steps += steps
+        self.status = status
+        return status
+
+    def runVerified(self, max_steps=None, deadline=None) -> int: # run() without the per-step checks, verifier.py proves them at load
+        regs = self.regs
+        bound = self.bound
+
+        steps = 0
+        status = RUNNING
+        i = 0
+        try:
+            while status == RUNNING:
+                count = RUN_SLICE if max_steps is None else min(RUN_SLICE, max_steps - steps)
+                for i in range(count):
+                    try:
+                        handler, a, b, next_ip = bound[regs[IP]]
+                    except (IndexError, TypeError): # Reached through a register or written since loading, checked on first use
+                        handler, a, b, next_ip = self.bind(regs[IP])
+
+                    regs[IP] = next_ip
+
+                    if handler(a, b) == 0:
+                        steps += i + 1
+                        status = HALTED
+                        break
+                else:
+                    steps += count
+                    if max_steps is not None and steps >= max_steps:
+                        status = BUDGET
+                    elif deadline is not None and time.monotonic() >= deadline:
+                        status = TIMEOUT
+        except WouldBlock: # The blocked instruction rewound ip and runs again on the next run()
+            steps += i
+            status = WAITING
+        except Exception as e:
+            steps += i + 1
+            status = FAULT
+            self.error = e
+
+        self.steps += steps
+        self.status = status
+        return status
+
+    def bind(self, address) -> tuple: # Decodes and checks one instruction into self.bound
+        record = self.decoded[address] if address < len(self.decoded) else None
+        if record is None:
+            record = self.decode(address)
+        handler = self.dispatch[record[0]]
+        if handler is None:
+            self.regs[IP] = record[3] # Past it, as run() leaves ip when it faults
+            raise Exception("Unknown instruction given: {}".format(record[0]))
+
+        entry = (handler,) + record[1:]
+        bound = self.bound
+        if address >= len(bound):
+            bound.extend([None] * (address + 1 - len(bound)))
+        bound[address] = entry
+        return entry
+
+    def runTraced(self, max_steps=None, deadline=None) -> int:
+        regs = self.regs
+        decoded = self.decoded
+        dispatch = self.dispatch
+        tracer = self.tracer
+
+        steps = 0
+        status = RUNNING
+        i = 0
+        try:
+            while status == RUNNING:
+                count = RUN_SLICE if max_steps is None else min(RUN_SLICE, max_steps - steps)
+                for i in range(count):
+                    ip_value = regs[IP]
+
+                    record = decoded[ip_value] if ip_value < len(decoded) else None
+                    if record is None:
+                        record = self.decode(ip_value)
+                    instruction, a, b, next_ip = record
+
+                    tracer(ip_value, instruction, a, b)
+                    regs[IP] = next_ip
+
+                    handler = dispatch[instruction]
+                    if handler is None:
+                        raise Exception("Unknown instruction given: {}".format(instruction))
+                    if handler(a, b) == 0:
+                        steps += i + 1
+                        status = HALTED
+                        break
+                else:
+                    steps += count
+                    if max_steps is not None and steps >= max_steps:
+                        status = BUDGET
+                    elif deadline is not None and time.monotonic() >= deadline:
+                        status = TIMEOUT
+        except WouldBlock: # The blocked instruction rewound ip and runs again on the next run()
+            steps += i
+            status = WAITING
+        except Exception as e:
+            steps += i + 1
+            status = FAULT
+            self.error = e
+
+        self.steps += steps
+        self.status = status
+        return status
+
+    def runProfiled(self, max_steps=None, deadline=None) -> int: # run() with every handler timed into self.profiler
+        regs = self.regs
+        decoded = self.decoded
+        dispatch = self.dispatch
+        record = self.profiler.record
+        clock = time.perf_counter_ns
+
+        steps = 0
+        status = RUNNING
+        i = 0
+        try:
+            while status == RUNNING:
+                count = RUN_SLICE if max_steps is None else min(RUN_SLICE, max_steps - steps)
+                for i in range(count):
+                    ip_value = regs[IP]
+
+                    entry = decoded[ip_value] if ip_value < len(decoded) else None
+                    if entry is None:
+                        entry = self.decode(ip_value)
+                    instruction, a, b, next_ip = entry
+
+                    regs[IP] = next_ip
+
+                    handler = dispatch[instruction]
+                    if handler is None:
+                        raise Exception("Unknown instruction given: {}".format(instruction))
+                    start = clock()
+                    result = handler(a, b)
+                    record(ip_value, instruction, clock() - start)
+                    if result == 0:
+                        steps += i + 1
+                        status = HALTED
+                        break
+                else:
+                    steps += count
+                    if max_steps is not None and steps >= max_steps:
+                        status = BUDGET
+                    elif deadline is not None and time.monotonic() >= deadline:
+                        status = TIMEOUT
+        except WouldBlock: # The blocked instruction rewound ip and runs again on the next run()
+            steps += i
+            status = WAITING
+        except Exception as e:
+            steps += i + 1
+            status = FAULT
+            self.error = e
+
+        self.steps += steps
+        self.status = status
+        return status
+
+    def runCompiled(self) -> int: # No step limits, compiled blocks don't stop between instructions
+        if self.tracer is not None:
+            return self.runTraced()
+        if self.profiler is not None: # Compiled blocks can't be timed per instruction
+            return self.runProfiled()
+
+        if self.compiler is None:
+            self.compiler = BlockCompiler(self)
+
+        try:
+            self.compiler.run()
+            self.status = HALTED
+        except WouldBlock:
+            self.status = WAITING
+        except Exception as e:
+            self.status = FAULT
+            self.error = e
+        return self.status
+
+
+class WideCPU(CPU): # 32 and 64-bit words, only the handlers whose width matters are replaced
+    def push(self, value) -> None:
+        regs = self.regs
+        address = regs[SP]
+        size = self.wordBytes
 
-            self.alu.compute('<<', r1Val, r2Val)
+        self.stack.setUint(address, value, size)
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+        if address > 0:
+            regs[SP] = (address - size) & self.wordMask
+            self.stack_frame_size += size
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        elif instruction == Instruction.RSHFT:
-            r1 = self.fetch()
-            r2 = self.fetch()
+    def pop(self) -> int:
+        regs = self.regs
+        address = regs[SP]
+        size = self.wordBytes
 
-            r1Val = self.getRegisterValue(r1)
-            r2Val = self.getRegisterValue(r2)
+        if address < self.SP_MAX:
+            address += size
+            regs[SP] = address
+            self.stack_frame_size -= size
 
-            self.alu.compute('>>', r1Val, r2Val)
+        return self.stack.getUint(address, size)
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+    def pushState(self) -> None:
+        regs = self.regs
+        push = self.push
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
-        elif instruction == Instruction.NOT:
-            r1 = self.fetch()
+        for register in SAVED_REGISTERS:
+            push(regs[register])
+        push(self.stack_frame_size + self.wordBytes)
 
-            r1Val = self.getRegisterValue(r1)
+        regs[FP] = regs[SP]
+        self.stack_frame_size = 0
 
-            self.alu.compute('~', r1Val)
+    def popState(self) -> None:
+        regs = self.regs
+        pop = self.pop
 
-            ac_reg = self.getRegisterIndex('ac')
-            val = self.alu.result
+        stack_frame_address = regs[FP]
+        regs[SP] = stack_frame_address
 
-            self.setRegisterValue(ac_reg, val)
-            return 1
+        frame_size = pop()
 
-        # Instruction Pointer Manipulation
-        elif instruction == Instruction.JR:
-            rs = self.fetch()
-            address = self.getRegisterValue(rs)
+        for register in reversed(SAVED_REGISTERS):
+            regs[register] = pop()
 
-            self.jump(address)
+        regs[FP] = (stack_frame_address + frame_size) & self.wordMask
+        self.stack_frame_size = frame_size - self.wordBytes * (len(SAVED_REGISTERS) + 1)
 
-            return 1
-        elif instruction == Instruction.JI:
-            address = self.fetchWord()
+    def pushFrame(self, mask) -> None:
+        regs = self.regs
+        push = self.push
 
-            self.jump(address)
+        for register in MASK_REGISTERS[mask]:
+            push(regs[register])
+        push(regs[IP])
+        push(mask)
+        push(self.stack_frame_size + self.wordBytes)
 
-            return 1
-        elif instruction == Instruction.BEQ:
-            address = self.fetchWord()
-            if self.alu.zero:
-                self.jump(address)
+        regs[FP] = regs[SP]
+        self.stack_frame_size = 0
 
-            return 1
-        elif instruction == Instruction.BNE:
-            address = self.fetchWord()
-            if not self.alu.zero:
-                self.jump(address)
+    def popFrame(self) -> None:
+        regs = self.regs
+        pop = self.pop
 
-            return 1
-        elif instruction == Instruction.BLT:
-            address = self.fetchWord()
-            if self.alu.negative:
-                self.jump(address)
+        stack_frame_address = regs[FP]
+        regs[SP] = stack_frame_address
 
-            return 1
-        elif instruction == Instruction.BLE:
-            address = self.fetchWord()
-            if self.alu.negative or self.alu.zero:
-                self.jump(address)
+        frame_size = pop()
+        saved = MASK_REGISTERS[pop() & 0xFF]
+        regs[IP] = pop()
 
-            return 1
-        elif instruction == Instruction.BGT:
-            address = self.fetchWord()
-            if not self.alu.negative:
-                self.jump(address)
+        for register in reversed(saved):
+            regs[register] = pop()
 
-            return 1
-        elif instruction == Instruction.BGE:
-            address = self.fetchWord()
-            if not self.alu.negative or self.alu.zero:
-                self.jump(address)
+        regs[FP] = (stack_frame_address + frame_size) & self.wordMask
+        self.stack_frame_size = frame_size - self.wordBytes * (len(saved) + 3)
 
-            return 1
-        elif instruction == Instruction.HLT:
-            return 0
+    def jump(self, address) -> None:
+        self.regs[IP] = address & self.wordMask
 
-        # Default
-        else:
-            raise Exception("Unknown instruction given: {}".format(instruction))
+    def fetchWord(self) -> int:
+        regs = self.regs
+        word = self.program.getUint(regs[IP], self.wordBytes)
+        regs[IP] += self.wordBytes
+        return word
+
+    def decodeOperands(self, address, instruction) -> tuple:
+        if FORMATS.get(instruction) != Format.WORD:
+            return super().decodeOperands(address, instruction) # Register operands are one byte at every width
+
+        return (instruction, self.program.getUint(address + 1, self.wordBytes), 0, address + self.lengths[Format.WORD])
+
+    def opLW(self, rd, rs) -> int:
+        regs = self.regs
+        regs[rd] = self.general.getUint(regs[rs], self.wordBytes)
+        return 1
+
+    def opSW(self, rs, rd) -> int:
+        regs = self.regs
+        self.general.setUint(regs[rd], regs[rs], self.wordBytes)
+        return 1
+
+    def opLWA(self, rd, rs) -> int:
+        regs = self.regs
+        try:
+            regs[rd] = self.memory.getUint(regs[rs], self.wordBytes)
+        except WouldBlock:
+            regs[IP] = (regs[IP] - self.lengths[Format.REG_REG]) & self.wordMask
+            raise
+        return 1
+
+    def opSWA(self, rs, rd) -> int:
+        regs = self.regs
+        self.memory.setUint(regs[rd], regs[rs], self.wordBytes)
+        return 1
+
+    def opLI(self, rd, value) -> int:
+        regs = self.regs
+        address = regs[SP]
+        if self.wordBytes <= address < self.SP_MAX + self.wordBytes and not self.stack.readHooks:
+            self.stack.setUint(address, value, self.wordBytes)
+            regs[rd] = value & self.wordMask
+            return 1
 
-    def step(self) -> int:
-        instruction = self.fetch()
-        print("Executing instruction: {}".format(instruction))
-        return self.execute(instruction)
-
-    def run(self) -> None:
-        halt = 1
-        while halt != 0:
-            halt = self.step()
+        self.opPSHI(value, 0)
+        return self.opPOP(rd, 0)
+
+    def opMOV(self, rd, rs) -> int:
+        return self.opLI(rd, self.regs[rs])
+
+    def opIN(self, rd, rs) -> int:
+        regs = self.regs
+        try:
+            regs[rd] = self.io.getUint(regs[rs], self.wordBytes)
+        except WouldBlock:
+            regs[IP] = (regs[IP] - self.lengths[Format.REG_REG]) & self.wordMask
+            raise
+        return 1
+
+    def opOUT(self, rs, rd) -> int:
+        regs = self.regs
+        self.io.setUint(regs[rd], regs[rs], self.wordBytes)
+        return 1
+
+    def opADD(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.add(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opSUB(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.sub(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opMULT(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.mult(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opDIV(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.div(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opMOD(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.mod(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opAND(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.bitAnd(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opOR(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.bitOr(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opXOR(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.bitXor(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opLSHFT(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.lshift(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opRSHFT(self, r1, r2) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.rshift(regs[r1], regs[r2]) & self.wordMask
+        return 1
+
+    def opNOT(self, r1, _b) -> int:
+        regs = self.regs
+        regs[AC] = self.alu.bitNot(regs[r1]) & self.wordMask
+        return 1
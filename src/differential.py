@@ -0,0 +1,1498 @@
+# Differential harness: runs the same program through several execution engines and
+# reports any difference in the final machine state, faulting runs included. Run from src/
+# with: python differential.py, which exits with status 1 when any check fails.
+import asyncio
+import contextlib
+import gc
+import io
+import itertools
+import mmap
+import os
+import random
+import sys
+import tempfile
+import time
+
+from assembler import assemble
+from benchmarks.programs import recursion, lightRecursion
+from cpu import CPU, WideCPU, BUDGET, FAULT, HALTED, TIMEOUT, WAITING, STATUS_NAMES
+from executable import HEADER, SYMBOL
+from instruction import Instruction, Format, FORMATS, lengths
+from memory import MappedMemory
+from optimizer import optimize
+from peephole import fuse
+from pool import runMany, jobFault
+from ports import AsyncPorts, runAsync, INPUT, OUTPUT, AVAILABLE
+from profiler import Profiler
+from program import Program, layout
+from registers import REGISTER_NAMES, IP, SP, FP, R1, R2, R5, R6, R7, R8, MASK_REGISTERS
+from scheduler import Scheduler
+from snapshot import Snapshot
+from tracing import RingTracer, PrintTracer, JUMPS
+from verifier import JUMP_IMMEDIATES
+
+ALU_OPERATIONS = [
+    Instruction.ADD, Instruction.SUB, Instruction.MULT, Instruction.DIV, Instruction.MOD,
+    Instruction.AND, Instruction.OR, Instruction.XOR, Instruction.LSHFT, Instruction.RSHFT,
+]
+
+BRANCHES = {
+    Instruction.BEQ: lambda zero, negative: zero,
+    Instruction.BNE: lambda zero, negative: not zero,
+    Instruction.BLT: lambda zero, negative: negative,
+    Instruction.BLE: lambda zero, negative: negative or zero,
+    Instruction.BGT: lambda zero, negative: not negative,
+    Instruction.BGE: lambda zero, negative: not negative or zero,
+}
+
+FLAG_VALUES = [0, 1, 2, 3, 0x0F, 0x1234, 0x7FFF, 0x8000, 0x8001, 0xFFFE, 0xFFFF]
+
+
+def referenceCompute(instruction, val1, val2) -> tuple: # The original eager ALU.compute and setFlags
+    def convert2scompl(n):
+        n &= 0xFFFF
+        if n >= 0x8000 and n <= 0xFFFF:
+            return ~n + 1
+        return n
+
+    val1 = convert2scompl(val1)
+    val2 = convert2scompl(val2)
+    result = {
+        Instruction.ADD:    lambda: val1 + val2,
+        Instruction.SUB:    lambda: val1 - val2,
+        Instruction.MULT:   lambda: val1 * val2,
+        Instruction.DIV:    lambda: int(val1 / val2),
+        Instruction.MOD:    lambda: val1 % val2,
+        Instruction.AND:    lambda: val1 & val2,
+        Instruction.OR:     lambda: val1 | val2,
+        Instruction.XOR:    lambda: val1 ^ val2,
+        Instruction.LSHFT:  lambda: val1 << val2,
+        Instruction.RSHFT:  lambda: val1 >> val2,
+        Instruction.NOT:    lambda: ~val1,
+    }[instruction]()
+    return result, result > 0xFFFF, result == 0, result < 0
+
+
+def checkFlagMatrix(cpuClass=CPU) -> list:
+    cpu = cpuClass()
+    regs = cpu.regs
+    mismatches = []
+
+    for instruction in ALU_OPERATIONS + [Instruction.NOT]:
+        for val1 in FLAG_VALUES:
+            for val2 in FLAG_VALUES:
+                try:
+                    result, overflow, zero, negative = referenceCompute(instruction, val1, val2)
+                except (ZeroDivisionError, ValueError):
+                    continue # Faulting operands, both ALUs raise
+
+                regs[R1] = val1
+                regs[R2] = val2
+                cpu.dispatch[instruction](R1, R2)
+
+                alu = cpu.alu
+                if (alu.result, alu.overflow, alu.zero, alu.negative) != (result, overflow, zero, negative):
+                    mismatches.append("{} {:04x} {:04x}: flags differ".format(instruction.name, val1, val2))
+
+                for branch, taken in BRANCHES.items():
+                    regs[IP] = 0
+                    cpu.dispatch[branch](0x100, 0)
+                    if (regs[IP] == 0x100) != taken(zero, negative):
+                        mismatches.append("{} after {} {:04x} {:04x}: branch differs".format(branch.name, instruction.name, val1, val2))
+
+    return mismatches
+
+
+def captureState(cpu) -> dict:
+    return {
+        "registers": {name: cpu.getRegisterValue(cpu.getRegisterIndex(name)) for name in cpu.registerNames},
+        "stack": bytes(cpu.stack.memory),
+        "general": bytes(cpu.general.memory),
+        "stack_frame_size": cpu.stack_frame_size,
+        "alu": (cpu.alu.result, cpu.alu.zero, cpu.alu.negative, cpu.alu.overflow),
+    }
+
+
+def differences(state, reference, keys=None) -> list: # Keys of reference whose values differ in state, a fault's state included
+    return [key for key in (reference.keys() if keys is None else keys) if state[key] != reference[key]]
+
+
+def runEngine(program, engine, cpuClass=CPU, word_size=16, buffer=None, checked=False) -> dict:
+    cpu = cpuClass(buffer=buffer, word_size=word_size)
+    cpu.loadProgram(program.functions, program.byte_count, program.saves)
+    if checked: # Run verified programs through the checked loop too
+        cpu.verified = False
+    return runLoaded(cpu, engine)
+
+
+def runLoaded(cpu, engine, *limits) -> dict: # Runs a CPU that already holds its program, returns its final state
+    run = getattr(cpu, engine)
+    with contextlib.redirect_stdout(io.StringIO()):
+        status = run(*limits)
+        while status in (BUDGET, TIMEOUT): # Only when limits are given, resumed until the program ends
+            status = run(*limits)
+    error = repr(cpu.error) if status == FAULT else None
+
+    state = captureState(cpu)
+    state["error"] = error
+    return state
+
+
+def compare(program, engines=("run", "runCompiled"), word_size=16) -> list:
+    reference = runEngine(program, engines[0], word_size=word_size)
+    mismatches = []
+
+    for engine in engines[1:]:
+        state = runEngine(program, engine, word_size=word_size)
+        mismatches += ["{}: {} differs from {}".format(engine, key, engines[0]) for key in differences(state, reference)]
+
+    return mismatches
+
+
+def compareWide(program, engines=("run", "runCompiled")) -> list: # WideCPU at 16 bits must behave exactly like CPU
+    reference = runEngine(program, "run")
+    mismatches = []
+
+    for engine in engines:
+        state = runEngine(program, engine, WideCPU)
+        mismatches += ["WideCPU {}: {} differs from CPU".format(engine, key) for key in differences(state, reference)]
+
+    return mismatches
+
+
+def compareChecked(program, word_size=16) -> list: # runVerified must behave exactly like the checked run() loop
+    reference = runEngine(program, "run", word_size=word_size, checked=True)
+    state = runEngine(program, "run", word_size=word_size)
+    return ["verified run: {} differs from checked".format(key) for key in differences(state, reference)]
+
+
+def compareResumed(program, word_size=16, checked=False) -> list: # run() resumed after BUDGET and TIMEOUT must end like one uninterrupted run
+    cpus = []
+    for _ in range(3):
+        cpu = CPU(word_size=word_size)
+        cpu.loadProgram(program.functions, program.byte_count, program.saves)
+        if checked:
+            cpu.verified = False
+        cpus.append(cpu)
+
+    reference = runLoaded(cpus[0], "run")
+    mismatches = []
+    for cpu, limits, name in ((cpus[1], (7, None), "budget"), (cpus[2], (None, 0), "deadline")): # A passed deadline stops every slice
+        state = runLoaded(cpu, "run", *limits)
+        mismatches += ["resumed after {}: {} differs".format(name, key) for key in differences(state, reference)]
+        if cpu.steps != cpus[0].steps:
+            mismatches.append("resumed after {}: steps differ".format(name))
+
+    return mismatches
+
+
+def compareForked(program, word_size=16, checked=False) -> list: # Forks and restores taken mid-run must end exactly like the uninterrupted run
+    reference = runEngine(program, "run", word_size=word_size, checked=checked)
+    mismatches = []
+
+    for at in (1, 5, 50):
+        cpu = CPU(word_size=word_size)
+        cpu.loadProgram(program.functions, program.byte_count, program.saves)
+        if checked:
+            cpu.verified = False
+        with contextlib.redirect_stdout(io.StringIO()):
+            if cpu.run(at) != BUDGET: # Ended before this fork point
+                continue
+
+        with Snapshot(cpu) as snapshot:
+            states = [("fork {} at {}".format(engine, at), runLoaded(snapshot.fork(), engine)) for engine in ("run", "runCompiled")]
+            states.append(("original at {}".format(at), runLoaded(cpu, "run")))
+            snapshot.restore(cpu)
+            states.append(("restored at {}".format(at), runLoaded(cpu, "run")))
+
+        for name, state in states:
+            mismatches += ["{}: {} differs".format(name, key) for key in differences(state, reference)]
+
+    return mismatches
+
+
+def compareProfiled(program, word_size=16) -> list: # A profiled run must end like run(), with every step counted once
+    cpu = CPU(word_size=word_size)
+    cpu.loadProgram(program.functions, program.byte_count, program.saves)
+    reference = runLoaded(cpu, "run")
+    steps = cpu.steps
+    mismatches = []
+
+    for engine in ("run", "runCompiled"): # Both hand a profiled CPU to runProfiled
+        cpu = CPU(word_size=word_size)
+        cpu.loadProgram(program.functions, program.byte_count, program.saves)
+        cpu.profiler = Profiler(cpu)
+        state = runLoaded(cpu, engine)
+        mismatches += ["profiled {}: {} differs from run".format(engine, key) for key in differences(state, reference)]
+        if cpu.steps != steps:
+            mismatches.append("profiled {}: {} steps, run took {}".format(engine, cpu.steps, steps))
+
+        executions = sum(count for count, _ in cpu.profiler.opcodes().values())
+        if executions != cpu.steps - (state["error"] is not None): # A faulting instruction never returns to be timed
+            mismatches.append("profiled {}: {} executions counted in {} steps".format(engine, executions, cpu.steps))
+
+    return mismatches
+
+
+def traceReference(program, word_size=16) -> list: # (ip, opcode, a, b, next ip) of each instruction run() executes, stepped one run(1) at a time
+    cpu = CPU(word_size=word_size)
+    cpu.loadProgram(program.functions, program.byte_count, program.saves)
+    trace = []
+    status = BUDGET
+    with contextlib.redirect_stdout(io.StringIO()):
+        while status == BUDGET:
+            ip = cpu.regs[IP]
+            try:
+                trace.append((ip,) + tuple(cpu.decode(ip)))
+            except Exception: # run() faults decoding it, before any tracer sees it
+                pass
+            status = cpu.run(1)
+    return trace
+
+
+def compareTraced(program, word_size=16) -> list: # Traced runs must end like run() and see every instruction it executes, in order
+    reference = runEngine(program, "run", word_size=word_size)
+    trace = traceReference(program, word_size)
+    records = [record[:4] for record in trace]
+    mismatches = []
+
+    for engine, size in (("run", len(trace) + 1), ("runCompiled", len(trace) + 1), ("run", 16)): # Both hand a traced CPU to runTraced
+        cpu = CPU(word_size=word_size)
+        cpu.loadProgram(program.functions, program.byte_count, program.saves)
+        cpu.tracer = RingTracer(size)
+        state = runLoaded(cpu, engine)
+        mismatches += ["traced {}: {} differs from run".format(engine, key) for key in differences(state, reference)]
+        if list(cpu.tracer.records) != records[-size:]:
+            mismatches.append("RingTracer({}) {}: records differ from the instructions run".format(size, engine))
+
+    cpu = CPU(word_size=word_size)
+    cpu.loadProgram(program.functions, program.byte_count, program.saves)
+    cpu.tracer = PrintTracer(cpu.lengths)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        cpu.run()
+
+    expected = []
+    for k, (ip, instruction, _, _, _) in enumerate(trace):
+        if k > 0 and trace[k - 1][1] in JUMPS and ip != trace[k - 1][4]: # Announced only when the jump was taken
+            expected.append("Jumping to address: {}".format(ip))
+        expected.append("Executing instruction: {}".format(instruction))
+    lines = [line for line in output.getvalue().splitlines() if line.startswith(("Jumping to address: ", "Executing instruction: "))] # Guest output aside
+    if lines != expected:
+        mismatches.append("PrintTracer: printed {} lines, expected {}".format(len(lines), len(expected)))
+
+    return mismatches
+
+
+def compareImages(program, word_size=16) -> list: # loadImage from any buffer must run like loadProgram, verified or not
+    reference = runEngine(program, "run", word_size=word_size)
+    image, labels = layout(program.functions)
+    other = randomProgram(len(image), word_size=word_size) # Loaded first, its decoded instructions must not survive the image
+    mismatches = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "image.bin")
+        with open(path, "wb") as file:
+            file.write(b"\xff" * 5 + image)
+
+        with open(path, "r+b") as file, mmap.mmap(file.fileno(), 0) as mapped, contextlib.ExitStack() as views: # Views go before the map closes
+            buffers = [
+                ("bytes", bytes(image)),
+                ("memoryview slice", views.enter_context(memoryview(b"\xff" * 3 + bytes(image))[3:])),
+                ("mmap slice", views.enter_context(memoryview(mapped)[5:])),
+            ]
+            for (name, buffer), verified, preloaded in itertools.product(buffers, (True, False), (False, True)):
+                cpu = CPU(word_size=word_size)
+                if preloaded:
+                    cpu.loadProgram(other.functions, other.byte_count, other.saves)
+                cpu.loadImage(buffer, labels["main"], labels, program.saves)
+                if verified:
+                    cpu.verifyImage(len(image))
+                state = runLoaded(cpu, "run")
+                label = "{}{}{}".format(name, ", verified" if verified else "", " over another program" if preloaded else "")
+                mismatches += ["loadImage from {}: {} differs from loadProgram".format(label, key) for key in differences(state, reference)]
+
+    return mismatches
+
+
+def verifies(program, word_size=16) -> bool:
+    cpu = CPU(word_size=word_size)
+    cpu.loadProgram(program.functions, program.byte_count, program.saves)
+    return cpu.verified
+
+
+def compareSaved(program, word_size=16) -> list: # Program.save then CPU.load must run exactly like loadProgram
+    reference = runEngine(program, "run", word_size=word_size)
+    mismatches = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.pyvm")
+        program.save(path)
+        for engine in ("run", "runCompiled"):
+            cpu = CPU(word_size=word_size)
+            cpu.load(path)
+            if cpu.verified != verifies(program, word_size):
+                mismatches.append("loaded {}: verifier differs from loadProgram".format(engine))
+            state = runLoaded(cpu, engine)
+            mismatches += ["loaded {}: {} differs from loadProgram".format(engine, key) for key in differences(state, reference)]
+
+    return mismatches
+
+
+def sameProgram(program, other) -> list: # Fields where two Programs differ
+    fields = []
+    code = lambda p: {func: [int(byte) & 0xff for byte in body] for func, body in p.functions.items()}
+    if code(program) != code(other) or list(program.functions) != list(other.functions):
+        fields.append("functions")
+    for field in ("labels", "saves", "byte_count", "word_size"):
+        if getattr(program, field) != getattr(other, field):
+            fields.append(field)
+    return fields
+
+
+def compareAssembled(program) -> list: # Assembling the program's own source must give back the same Program
+    assembled = assemble(programSource(program), program.word_size)
+    return ["assembled: {} differs from the Program".format(field) for field in sameProgram(assembled, program)]
+
+
+def compareMapped(program, engines=("run", "runCompiled")) -> list: # File-backed memory must behave exactly like the bytearray
+    reference = runEngine(program, "run")
+    size = CPU().memory.size
+    mismatches = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "guest.img")
+        with open(path, "wb") as file:
+            file.write(bytes(size))
+
+        for mode in ("r+", "c"):
+            for engine in engines:
+                memory = MappedMemory(path, size, mode)
+                state = runEngine(program, engine, buffer=memory)
+                mismatches += ["{} mapping {}: {} differs from bytearray".format(mode, engine, key) for key in differences(state, reference)]
+
+                memory.flush()
+                with open(path, "rb") as file:
+                    image = file.read()
+                # A shared mapping leaves the file equal to the address space, a private one leaves it untouched
+                expected = bytes(memory.memory) if mode == "r+" else bytes(size)
+                if image != expected:
+                    mismatches.append("{} mapping {}: file contents differ".format(mode, engine))
+
+                with open(path, "wb") as file: # Every run starts from a zeroed file
+                    file.write(bytes(size))
+
+    return mismatches
+
+
+def compareFused(program, engines=("run", "runCompiled"), word_size=16) -> list: # The fused program must end exactly like the original
+    reference = runEngine(program, "run", word_size=word_size)
+    fused = fuse(program)
+    mismatches = []
+
+    cpuClasses = [CPU, WideCPU] if word_size == 16 else [CPU]
+    for cpuClass in cpuClasses:
+        for engine in engines:
+            state = runEngine(fused, engine, cpuClass, word_size)
+            mismatches += ["fused {} {}: {} differs from unfused".format(cpuClass.__name__, engine, key) for key in differences(state, reference)]
+
+    return mismatches
+
+
+def runExecuted(program, word_size=16) -> dict: # Drives the CPU by hand with fetch() and execute(), as an embedder would
+    cpu = CPU(word_size=word_size)
+    cpu.loadProgram(program.functions, program.byte_count, program.saves)
+    error = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            while cpu.execute(cpu.fetch()):
+                pass
+        except Exception as e:
+            error = repr(e)
+
+    state = captureState(cpu)
+    state["error"] = error
+    return state
+
+
+def compareExecuted(program, word_size=16) -> list: # execute() must run the fused program like run() runs the original
+    reference = runEngine(program, "run", word_size=word_size)
+    mismatches = []
+
+    for name, candidate in (("unfused", program), ("fused", fuse(program))):
+        state = runExecuted(candidate, word_size)
+        mismatches += ["execute() {}: {} differs from run()".format(name, key) for key in differences(state, reference)]
+
+    return mismatches
+
+
+def fusedPairs(program) -> int:
+    fused = fuse(program)
+    return sum(a != b for func in program.functions for a, b in zip(program.functions[func], fused.functions[func]))
+
+
+def compareOptimized(program, word_size=16) -> list: # The optimized program must end like the original, code addresses aside
+    reference = runEngine(program, "run", word_size=word_size)
+    optimized = optimize(program)
+    mismatches = []
+
+    reference["registers"].pop("ip")
+    for engine in ("run", "runCompiled"):
+        state = runEngine(optimized, engine, word_size=word_size)
+        state["registers"].pop("ip") # ip and the stale words below sp move with the code
+        keys = ["registers", "general", "stack_frame_size", "alu", "error"]
+        mismatches += ["optimized {}: {} differs from the original".format(engine, key) for key in differences(state, reference, keys)]
+
+    return mismatches
+
+
+def steps(program, word_size=16) -> int: # Guest instructions run to the end
+    cpu = CPU(word_size=word_size)
+    cpu.loadProgram(program.functions, program.byte_count, program.saves)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cpu.run()
+    return cpu.steps
+
+
+def compareBatch(program, lanes=32, seed=0) -> list: # Runs every lane of a BatchCPU against its own scalar CPU
+    from batch import BatchCPU # Needs NumPy
+
+    rng = random.Random(seed)
+    names = ['r1', 'r2', 'r3', 'r4', 'r5', 'r6', 'r7', 'r8']
+    inputs = [{name: rng.choice([0, 1, 2, 0x8000, 0xFFFF, rng.randrange(0x10000)]) for name in names} for _ in range(lanes)]
+    data = [bytes(rng.randrange(0x100) for _ in range(64)) for _ in range(lanes)]
+
+    batch = BatchCPU(lanes)
+    batch.loadProgram(program.functions, program.byte_count, program.saves)
+    for name in names:
+        batch.setRegister(name, [lane[name] for lane in inputs])
+    for lane in range(lanes):
+        batch.general[lane, :64] = list(data[lane])
+    batch.run()
+
+    mismatches = []
+    for lane in range(lanes):
+        cpu = CPU()
+        cpu.loadProgram(program.functions, program.byte_count, program.saves)
+        for name in names:
+            cpu.setRegisterValue(cpu.getRegisterIndex(name), inputs[lane][name])
+        cpu.general.writeBytes(0, data[lane])
+
+        error = str(cpu.error) if cpu.run() == FAULT else None
+
+        expected = captureState(cpu)
+        expected["flags"] = (cpu.alu.zero, cpu.alu.negative, cpu.alu.overflow)
+        del expected["alu"]
+        expected["error"] = error
+
+        state = batch.laneState(lane)
+        mismatches += ["lane {}: {} differs from the scalar CPU".format(lane, key) for key in differences(state, expected)]
+
+    return mismatches
+
+
+def demoProgram() -> Program:
+    cpu = CPU()
+    r1 = cpu.registerDict['r1']
+    r2 = cpu.registerDict['r2']
+    ac = cpu.registerDict['ac']
+
+    program = Program()
+    program.instruction(Instruction.PSHI, 0x04, 0x00, func="sub")
+    program.instruction(Instruction.POP, r1, func="sub")
+    program.instruction(Instruction.PSHI, 0x02, 0x00, func="sub")
+    program.instruction(Instruction.POP, r2, func="sub")
+    program.instruction(Instruction.SUB, r1, r2, func="sub")
+    program.instruction(Instruction.RET, func="sub")
+
+    program.instruction(Instruction.PSHI, 0x01, 0x12)
+    program.instruction(Instruction.POP, r1)
+    program.instruction(Instruction.PSHI, 0x21, 0x10)
+    program.instruction(Instruction.POP, r2)
+    program.instruction(Instruction.PSH, r1)
+    program.instruction(Instruction.PSH, r2)
+    program.instruction(Instruction.POP, r1)
+    program.instruction(Instruction.POP, r2)
+    program.instruction(Instruction.JALI, label="sub")
+    program.instruction(Instruction.PSH, ac)
+    program.instruction(Instruction.POP, r2)
+    program.instruction(Instruction.DIV, r1, r2)
+    program.instruction(Instruction.HLT)
+    return program
+
+
+def loopProgram(count=200) -> Program:
+    cpu = CPU()
+    r1 = cpu.registerDict['r1']
+    r2 = cpu.registerDict['r2']
+    r3 = cpu.registerDict['r3']
+    r4 = cpu.registerDict['r4']
+    ac = cpu.registerDict['ac']
+
+    program = Program()
+    program.instruction(Instruction.PSHI, count >> 8, count & 0xFF)
+    program.instruction(Instruction.POP, r1)
+    program.instruction(Instruction.PSHI, 0x00, 0x01)
+    program.instruction(Instruction.POP, r2)
+    program.instruction(Instruction.PSHI, 0x00, 0x00)
+    program.instruction(Instruction.POP, r3)
+
+    program.instruction(Instruction.ADD, r3, r1, func="loop")
+    program.instruction(Instruction.PSH, ac, func="loop")
+    program.instruction(Instruction.POP, r3, func="loop")
+    program.instruction(Instruction.PSHI, 0x00, 0x10, func="loop")
+    program.instruction(Instruction.POP, r4, func="loop")
+    program.instruction(Instruction.SW, r3, r4, func="loop")
+    program.instruction(Instruction.LW, r4, r4, func="loop")
+    program.instruction(Instruction.SUB, r1, r2, func="loop")
+    program.instruction(Instruction.PSH, ac, func="loop")
+    program.instruction(Instruction.POP, r1, func="loop")
+    program.instruction(Instruction.BGT, label="loop", func="loop")
+
+    program.instruction(Instruction.HLT, func="done")
+    return program
+
+
+def inputLoopProgram() -> Program: # Loop count and memory address come from the lane's r1 and r4
+    cpu = CPU()
+    r1 = cpu.registerDict['r1']
+    r2 = cpu.registerDict['r2']
+    r3 = cpu.registerDict['r3']
+    r4 = cpu.registerDict['r4']
+    r5 = cpu.registerDict['r5']
+    r7 = cpu.registerDict['r7']
+    ac = cpu.registerDict['ac']
+
+    program = Program()
+    program.instruction(Instruction.PSHI, 0x00, 0x3F)
+    program.instruction(Instruction.POP, r7)
+    program.instruction(Instruction.AND, r1, r7)
+    program.instruction(Instruction.PSH, ac)
+    program.instruction(Instruction.POP, r1)
+    program.instruction(Instruction.PSHI, 0x00, 0x01)
+    program.instruction(Instruction.POP, r2)
+    program.instruction(Instruction.LW, r5, r4) # Faults on lanes whose r4 is past general memory
+
+    program.instruction(Instruction.ADD, r3, r1, func="loop")
+    program.instruction(Instruction.PSH, ac, func="loop")
+    program.instruction(Instruction.POP, r3, func="loop")
+    program.instruction(Instruction.SUB, r1, r2, func="loop")
+    program.instruction(Instruction.PSH, ac, func="loop")
+    program.instruction(Instruction.POP, r1, func="loop")
+    program.instruction(Instruction.BGT, label="loop", func="loop")
+
+    program.instruction(Instruction.HLT, func="done")
+    return program
+
+
+def randomProgram(seed, length=64, word_size=16) -> Program:
+    rng = random.Random(seed)
+    cpu = CPU()
+    registers = [cpu.registerDict[name] for name in ('ac', 'r1', 'r2', 'r3', 'r4', 'r5', 'r6', 'r7', 'r8')]
+    mask = (1 << word_size) - 1
+
+    program = Program(word_size)
+    for _ in range(length):
+        choice = rng.random()
+        if choice < 0.3:
+            value = rng.choice([0, 1, 2, mask >> 1, (mask >> 1) + 1, mask, rng.randrange(mask + 1)])
+            program.instruction(Instruction.PSHI, value=value)
+            program.instruction(Instruction.POP, rng.choice(registers))
+        elif choice < 0.8:
+            operation = rng.choice(ALU_OPERATIONS)
+            r2 = rng.choice(registers)
+            if operation in (Instruction.DIV, Instruction.MOD, Instruction.LSHFT, Instruction.RSHFT):
+                program.instruction(Instruction.PSHI, value=rng.randrange(1, 16)) # Keep divisors and shift counts valid
+                program.instruction(Instruction.POP, r2)
+            program.instruction(operation, rng.choice(registers), r2)
+        elif choice < 0.85:
+            program.instruction(Instruction.NOT, rng.choice(registers))
+        elif choice < 0.9:
+            program.instruction(Instruction.SWP, rng.choice(registers), rng.choice(registers))
+        else:
+            program.instruction(Instruction.PSH, rng.choice(registers))
+    program.instruction(Instruction.HLT)
+    return program
+
+
+def callProgram(seed, word_size=16) -> Program: # Random functions calling each other through CALL/CALLR with random save masks
+    rng = random.Random(seed)
+    cpu = CPU()
+    r = {name: cpu.registerDict[name] for name in cpu.registerNames}
+    work = [r[name] for name in ('r1', 'r2', 'r3', 'r4', 'r5', 'r6')] # r7 holds 1, r8 counts the calls left
+    mask = (1 << word_size) - 1
+
+    program = Program(word_size)
+
+    def body(func, length):
+        for _ in range(length):
+            choice = rng.random()
+            if choice < 0.4:
+                program.instruction(Instruction.PSHI, value=rng.randrange(mask + 1), func=func)
+                program.instruction(Instruction.POP, rng.choice(work), func=func)
+            elif choice < 0.8:
+                program.instruction(rng.choice([Instruction.ADD, Instruction.SUB, Instruction.XOR]), rng.choice(work), rng.choice(work), func=func)
+                program.instruction(Instruction.PSH, r['ac'], func=func)
+                program.instruction(Instruction.POP, rng.choice(work), func=func)
+            else:
+                program.instruction(Instruction.SWP, rng.choice(work), rng.choice(work), func=func)
+
+    def call(func, target):
+        if rng.random() < 0.5:
+            program.instruction(Instruction.CALL, label=target, func=func)
+        else:
+            program.instruction(Instruction.PSHI, label=target, func=func)
+            program.instruction(Instruction.POP, r['r6'], func=func)
+            program.instruction(Instruction.CALLR, r['r6'], func=func)
+
+    functions = []
+    for k in range(4):
+        done = "done{}".format(k)
+        name = "f{}".format(k)
+        program.instruction(Instruction.RTN, func=done) # Early return, shared by the frame that branched here
+        functions.append(name)
+
+        body(name, rng.randrange(1, 6))
+        program.instruction(Instruction.SUB, r['r8'], r['r7'], func=name)
+        program.instruction(Instruction.PSH, r['ac'], func=name)
+        program.instruction(Instruction.POP, r['r8'], func=name)
+        program.instruction(Instruction.BLE, label=done, func=name)
+        call(name, rng.choice(functions))
+        body(name, rng.randrange(0, 4))
+        program.instruction(Instruction.RTN, func=name)
+        program.preserve(name, rng.sample(work, rng.randrange(len(work) + 1)))
+
+    program.instruction(Instruction.PSHI, value=1, func="main")
+    program.instruction(Instruction.POP, r['r7'], func="main")
+    program.instruction(Instruction.PSHI, value=rng.randrange(1, 60), func="main")
+    program.instruction(Instruction.POP, r['r8'], func="main")
+    if rng.random() < 0.4: # Start near either end of the stack, where pushes and pops stop moving sp
+        program.instruction(Instruction.PSHI, value=rng.choice([0, 2, 5, 9, 16, cpu.SP_MAX - 1, cpu.SP_MAX - 6]), func="main")
+        program.instruction(Instruction.POP, r['sp'], func="main")
+    for _ in range(rng.randrange(1, 4)):
+        body("main", rng.randrange(0, 4))
+        call("main", rng.choice(functions))
+    program.instruction(Instruction.HLT, func="main")
+    return program
+
+
+def branchProgram(seed, word_size=16) -> Program: # Counted loop full of compare-and-branch and test-and-branch pairs
+    rng = random.Random(seed)
+    cpu = CPU()
+    r = {name: cpu.registerDict[name] for name in cpu.registerNames}
+    work = [r[name] for name in ('r1', 'r2', 'r3', 'r4', 'r5')] # r6 holds 0, r7 holds 1, r8 counts the iterations left
+    mask = (1 << word_size) - 1
+    branches = [Instruction.BEQ, Instruction.BNE, Instruction.BLT, Instruction.BLE, Instruction.BGT, Instruction.BGE]
+
+    program = Program(word_size)
+    program.instruction(Instruction.HLT, func="exit") # Early exit, declared first so the loop can branch forward to it
+
+    program.instruction(Instruction.PSHI, value=0, func="main")
+    program.instruction(Instruction.POP, r['r6'], func="main")
+    program.instruction(Instruction.PSHI, value=1, func="main")
+    program.instruction(Instruction.POP, r['r7'], func="main")
+    program.instruction(Instruction.PSHI, value=rng.randrange(1, 40), func="main")
+    program.instruction(Instruction.POP, r['r8'], func="main")
+    for reg in work:
+        program.instruction(Instruction.PSHI, value=rng.randrange(mask + 1), func="main")
+        program.instruction(Instruction.POP, reg, func="main")
+
+    for _ in range(rng.randrange(2, 8)):
+        choice = rng.random()
+        if choice < 0.3:
+            program.instruction(Instruction.PSHI, value=rng.randrange(mask + 1), func="loop")
+            program.instruction(Instruction.POP, rng.choice(work), func="loop")
+        elif choice < 0.6:
+            program.instruction(rng.choice([Instruction.ADD, Instruction.XOR]), rng.choice(work), rng.choice(work), func="loop")
+            program.instruction(Instruction.PSH, r['ac'], func="loop")
+            program.instruction(Instruction.POP, rng.choice(work), func="loop")
+        else:
+            program.instruction(rng.choice([Instruction.SUB, Instruction.AND]), rng.choice(work), rng.choice(work), func="loop")
+            program.instruction(rng.choice(branches), label="exit", func="loop")
+
+    program.instruction(Instruction.SUB, r['r8'], r['r7'], func="loop")
+    program.instruction(Instruction.PSH, r['ac'], func="loop")
+    program.instruction(Instruction.POP, r['r8'], func="loop")
+    program.instruction(Instruction.SUB, r['r8'], r['r6'], func="loop")
+    program.instruction(Instruction.BGT, label="loop", func="loop")
+    program.instruction(Instruction.HLT, func="loop")
+    return program
+
+
+def optimizerProgram(seed, word_size=16) -> Program: # Counted loop of stack pairs split across other ops, swaps and chained branches
+    rng = random.Random(seed)
+    cpu = CPU()
+    r = {name: cpu.registerDict[name] for name in cpu.registerNames}
+    work = [r[name] for name in ('ac', 'r1', 'r2', 'r3', 'r4', 'r5')] # r6 holds 0, r7 holds 1, r8 counts the iterations left
+    sources = work + [r['r6'], r['r7'], r['r8']] # The counter makes flags change from one iteration to the next
+    mask = (1 << word_size) - 1
+    values = [0, 1, 3, mask >> 1, (mask >> 1) + 1, mask]
+    branches = [Instruction.BEQ, Instruction.BNE, Instruction.BLT, Instruction.BLE, Instruction.BGT, Instruction.BGE]
+
+    program = Program(word_size)
+    exits = []
+    for k in range(3): # Declared first so the loop can branch forward to them
+        name = "exit{}".format(k)
+        program.instruction(Instruction.PSHI, value=100 + k, func=name) # Tells the exits apart
+        program.instruction(Instruction.POP, r['r6'], func=name)
+        for _ in range(rng.randrange(3)):
+            program.instruction(rng.choice([Instruction.ADD, Instruction.SUB, Instruction.XOR]), rng.choice(work), rng.choice(work), func=name)
+        program.instruction(Instruction.HLT, func=name)
+        exits.append(name)
+
+    for reg, value in ((r['r6'], 0), (r['r7'], 1), (r['r8'], rng.randrange(1, 20))):
+        program.instruction(Instruction.PSHI, value=value, func="main")
+        program.instruction(Instruction.POP, reg, func="main")
+    for reg in work[1:]:
+        program.instruction(Instruction.PSHI, value=rng.choice(values + [rng.randrange(mask + 1)]), func="main")
+        program.instruction(Instruction.POP, reg, func="main")
+
+    depth = 0
+    for _ in range(rng.randrange(4, 16)):
+        choice = rng.random()
+        if choice < 0.2 and depth < 4:
+            if rng.random() < 0.5:
+                program.instruction(Instruction.PSHI, value=rng.choice(values), func="loop")
+            else:
+                program.instruction(Instruction.PSH, rng.choice(sources), func="loop")
+            depth += 1
+        elif choice < 0.4 and depth > 0:
+            program.instruction(Instruction.POP, rng.choice(work), func="loop")
+            depth -= 1
+        elif choice < 0.45:
+            program.instruction(Instruction.SWP, rng.choice(work), rng.choice(work), func="loop")
+        elif choice < 0.5: # Swap of two registers just set, maybe with their sources changed in between
+            first, second = rng.sample(work, 2)
+            program.instruction(Instruction.PSHI, value=rng.choice(values), func="loop")
+            program.instruction(Instruction.POP, first, func="loop")
+            program.instruction(Instruction.PSH, rng.choice([r['ac'], rng.choice(sources)]), func="loop")
+            program.instruction(Instruction.POP, second, func="loop")
+            if rng.random() < 0.5:
+                program.instruction(rng.choice([Instruction.ADD, Instruction.XOR]), rng.choice(sources), rng.choice(sources), func="loop")
+            program.instruction(Instruction.SWP, first, second, func="loop")
+        elif choice < 0.6:
+            program.instruction(Instruction.PSHI, value=rng.choice(values), func="loop")
+            program.instruction(Instruction.POP, rng.choice(work), func="loop")
+        else:
+            operation = rng.choice([Instruction.ADD, Instruction.SUB, Instruction.AND, Instruction.OR, Instruction.XOR, Instruction.NOT])
+            if operation == Instruction.NOT:
+                program.instruction(operation, rng.choice(sources), func="loop")
+            else:
+                program.instruction(operation, rng.choice(sources), rng.choice(sources), func="loop")
+            for _ in range(rng.randrange(3)):
+                program.instruction(rng.choice(branches), label=rng.choice(exits), func="loop")
+    for _ in range(depth):
+        program.instruction(Instruction.POP, rng.choice(work), func="loop")
+
+    program.instruction(Instruction.SUB, r['r8'], r['r7'], func="loop")
+    program.instruction(Instruction.PSH, r['ac'], func="loop")
+    program.instruction(Instruction.POP, r['r8'], func="loop")
+    program.instruction(Instruction.SUB, r['r8'], r['r6'], func="loop")
+    program.instruction(Instruction.BGT, label="loop", func="loop")
+    program.instruction(Instruction.HLT, func="loop")
+    return program
+
+
+def branchPairPrograms(word_size=16) -> list: # Every pair of branches after a result of -1, 0 and 1 the optimizer can't know
+    cpu = CPU()
+    r = {name: cpu.registerDict[name] for name in cpu.registerNames}
+    mask = (1 << word_size) - 1
+    branches = [Instruction.BEQ, Instruction.BNE, Instruction.BLT, Instruction.BLE, Instruction.BGT, Instruction.BGE]
+
+    programs = []
+    for first in branches:
+        for second in branches:
+            for value in (-1, 0, 1):
+                program = Program(word_size)
+                for k in range(2):
+                    program.instruction(Instruction.PSHI, value=100 + k, func="exit{}".format(k))
+                    program.instruction(Instruction.POP, r['r6'], func="exit{}".format(k))
+                    program.instruction(Instruction.HLT, func="exit{}".format(k))
+                program.instruction(Instruction.PSHI, value=value & mask, func="main")
+                program.instruction(Instruction.POP, r['r1'], func="main")
+                program.instruction(Instruction.SW, r['r1'], r['r2'], func="main") # Loaded back from memory, which isn't tracked
+                program.instruction(Instruction.LW, r['r3'], r['r2'], func="main")
+                program.instruction(Instruction.ADD, r['r3'], r['r2'], func="main")
+                program.instruction(first, label="exit0", func="main")
+                program.instruction(second, label="exit1", func="main")
+                program.instruction(Instruction.HLT, func="main")
+                programs.append(("{} {} after {}".format(first.name.lower(), second.name.lower(), value), program))
+    return programs
+
+
+ODD_STACK_SOURCES = { # Guests can point sp at an odd address, every push then straddles two stack words
+    "odd sp": """
+main:   pshi  5
+        pop   sp
+        pshi  0x1234
+        pop   r1
+        psh   r1
+        pshi  0x5678
+        pop   r2
+        pop   r3
+        hlt
+""",
+    "odd sp wrapping": """
+main:   pshi  3
+        pop   sp
+        pshi  0x1234        ; sp goes to 1
+        pshi  0x5678        ; sp wraps around to 0xffff
+        pop   r1            ; past the end of the stack
+        hlt
+""",
+    "odd sp pair": """
+main:   pshi  1
+        pop   sp
+        pshi  7             ; fused with the pop, the push still wraps sp
+        pop   r1
+        hlt
+""",
+    "odd sp at the top": """
+main:   pshi  0x0cff        ; last byte of the default stack
+        pop   sp
+        pshi  0x1234        ; straddles the end of the stack, faults without writing either byte
+        hlt
+""",
+    "odd sp call": """
+main:   pshi  5
+        pop   sp
+        call  leaf          ; the frame's last word lands at 1, sp wraps
+        hlt
+leaf:   rtn
+""",
+}
+
+
+EDGE_SOURCES = { # Stack ends and faults midway, where a naive optimizer changes the end state
+    "pops past the pushes": """
+main:   pshi  0x7fff
+        pshi  0x1234
+        pop   r4
+        pop   r5
+        pop   r5            ; nothing left, sp stays at the top and reads 0x7fff again
+        pop   r2
+        hlt
+""",
+    "pops into the caller's frame": """
+main:   pshi  1
+        pop   r1
+        pshi  2             ; dead store, removing it moves the call's return address
+        pop   r1
+        call  peek
+        hlt
+peek:   pshi  0x7fff
+        pop   r4
+        pop   r2            ; frame size
+        pop   r3            ; save mask
+        pop   r5            ; return address
+        rtn
+""",
+    "pushes past the bottom": """
+main:   pshi  1700
+        pop   ac
+        pshi  1
+        pop   r7
+fill:   pshi  0x1111        ; never popped, sp stops at the bottom of the stack
+        sub   ac, r7        ; counts in ac, a pair down there would read 0x1111 back
+        bgt   fill
+        pshi  7             ; both land on the bottom word, r1 reads 8 back
+        pshi  8
+        pop   r5
+        pop   r1
+        hlt
+""",
+    "fault between a pair": """
+main:   pshi  3
+        pshi  0
+        pop   r2
+        div   r2, r2        ; faults with 3 still pushed
+        pop   r1
+        hlt
+""",
+    "dead store before a fault": """
+main:   pshi  5
+        pop   r1            ; overwritten below, but the fault ends the run with it
+        div   r2, r2
+        pshi  6
+        pop   r1
+        hlt
+""",
+    "swap across a fault": """
+main:   pshi  5
+        pop   r1
+        pshi  6
+        pop   r2
+        mod   r3, r3        ; faults before the swap, with r1 and r2 as set
+        swp   r1, r2
+        hlt
+""",
+}
+
+
+def programSource(program) -> str: # Assembler text for a Program, jump and call targets by label name
+    size = lengths(program.word_size // 8)
+    names = {}
+    for func in program.functions:
+        names.setdefault(program.labels[func], func)
+
+    lines = []
+    for func, code in program.functions.items():
+        lines.append("{}:".format(func))
+        if func in program.saves:
+            lines.append("    .save {}".format(", ".join(REGISTER_NAMES[index] for index in MASK_REGISTERS[program.saves[func]])))
+        code = [int(byte) & 0xff for byte in code]
+        offset = 0
+        while offset < len(code):
+            instruction = Instruction(code[offset])
+            operandFormat = FORMATS[instruction]
+            operands = code[offset + 1:offset + size[operandFormat]]
+            if operandFormat == Format.WORD:
+                value = int.from_bytes(bytes(operands), "big")
+                operands = [names[value] if instruction in JUMP_IMMEDIATES and value in names else hex(value)]
+            else:
+                operands = [REGISTER_NAMES[operand >> 1] for operand in operands]
+            lines.append("    {} {}".format(instruction.name.lower(), ", ".join(operands)).rstrip())
+            offset += size[operandFormat]
+    return "\n".join(lines) + "\n"
+
+
+FORWARD_SOURCE = """
+main:   pshi  5
+        pop   r1
+        pshi  1
+        pop   r2
+        call  count         ; every jump and call in main goes to a label declared further down
+        beq   done
+        ji    done
+count:  .save r2
+        sub   r1, r2
+        psh   ac
+        pop   r1
+        bgt   more
+        rtn
+more:   call  count
+        rtn
+done:   hlt
+"""
+
+
+def forwardProgram(labels) -> Program: # FORWARD_SOURCE built with Program.instruction, forward targets come from labels
+    cpu = CPU()
+    r = {name: cpu.registerDict[name] for name in cpu.registerNames}
+
+    program = Program()
+    program.instruction(Instruction.PSHI, value=5)
+    program.instruction(Instruction.POP, r['r1'])
+    program.instruction(Instruction.PSHI, value=1)
+    program.instruction(Instruction.POP, r['r2'])
+    program.instruction(Instruction.CALL, value=labels.get("count", 0))
+    program.instruction(Instruction.BEQ, value=labels.get("done", 0))
+    program.instruction(Instruction.JI, value=labels.get("done", 0))
+    program.preserve("count", [r['r2']])
+    program.instruction(Instruction.SUB, r['r1'], r['r2'], func="count")
+    program.instruction(Instruction.PSH, r['ac'], func="count")
+    program.instruction(Instruction.POP, r['r1'], func="count")
+    program.instruction(Instruction.BGT, value=labels.get("more", 0), func="count")
+    program.instruction(Instruction.RTN, func="count")
+    program.instruction(Instruction.CALL, label="count", func="more")
+    program.instruction(Instruction.RTN, func="more")
+    program.instruction(Instruction.HLT, func="done")
+    return program
+
+
+def unverifiedPrograms() -> list: # Programs the verifier must reject, each still has to run the same on both loops
+    cpu = CPU()
+    r1 = cpu.registerDict['r1']
+
+    register = Program()
+    register.instruction(Instruction.PSHI, value=1)
+    register.instruction(Instruction.POP, 0x31) # Not a register offset
+    register.instruction(Instruction.HLT)
+
+    target = Program()
+    target.instruction(Instruction.JI, value=1) # Into its own operand, 0x00 is no instruction
+    target.instruction(Instruction.HLT)
+
+    unknown = Program()
+    unknown.instruction(Instruction.PSHI, value=7)
+    unknown.instruction(Instruction.POP, r1)
+    unknown.instruction(0x07)
+    unknown.instruction(Instruction.HLT)
+
+    skipped = Program() # The bad operand is never executed, so the program halts
+    skipped.instruction(Instruction.HLT, func="exit")
+    skipped.instruction(Instruction.JI, label="exit")
+    skipped.instruction(Instruction.NOT, 0x40)
+    skipped.instruction(Instruction.HLT)
+    return [("bad register", register), ("bad jump target", target), ("unknown opcode", unknown), ("unreached bad operand", skipped)]
+
+
+def dynamicPrograms() -> list: # Verified programs that still reach code the verifier never saw, runVerified binds it on first use
+    cpu = CPU()
+    r1 = cpu.registerDict['r1']
+    r2 = cpu.registerDict['r2']
+    r3 = cpu.registerDict['r3']
+
+    operand = Program()
+    operand.instruction(Instruction.PSHI, value=1)
+    operand.instruction(Instruction.POP, r1)
+    operand.instruction(Instruction.JR, r1) # Into the operand of the first pshi
+    operand.instruction(Instruction.HLT)
+
+    outside = Program()
+    outside.instruction(Instruction.PSHI, value=0xFFF0)
+    outside.instruction(Instruction.POP, r1)
+    outside.instruction(Instruction.JR, r1) # Past the end of the program segment
+    outside.instruction(Instruction.HLT)
+
+    patched = Program() # Overwrites patch's first instruction with hlt through a flat store, then runs it
+    patched.instruction(Instruction.PSHI, value=0x1234, func="patch")
+    patched.instruction(Instruction.POP, r1, func="patch")
+    patched.instruction(Instruction.HLT, func="patch")
+    patched.instruction(Instruction.PSHI, value=0xFF00)
+    patched.instruction(Instruction.POP, r2)
+    patched.instruction(Instruction.PSHI, value=cpu.segments["program"][0])
+    patched.instruction(Instruction.POP, r3)
+    patched.instruction(Instruction.SWA, r2, r3)
+    patched.instruction(Instruction.JI, label="patch")
+    return [("register jump into an operand", operand), ("register jump out of the program", outside), ("self-modifying", patched)]
+
+
+class QueuedReader: # Stands in for an asyncio.StreamReader, hands out the chunks it was given then EOF
+    def __init__(self, chunks=()):
+        self.chunks = list(chunks)
+
+    async def read(self, _n) -> bytes:
+        return self.chunks.pop(0) if self.chunks else b""
+
+
+class RecordingWriter: # Stands in for an asyncio.StreamWriter, keeps every chunk it is given
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> None:
+        self.chunks.append(bytes(data))
+
+    async def drain(self) -> None:
+        pass
+
+
+ECHO_SOURCE = """
+main:   pshi  {input}
+        pop   r2
+        pshi  {output}
+        pop   r3
+        pshi  -1            ; the input port reads all ones once closed
+        pop   r4
+loop:   in    r1, r2
+        sub   r1, r4
+        beq   done
+        out   r1, r3
+        ji    loop
+done:   hlt
+"""
+
+PORTS_SOURCE = """
+main:   pshi  {input}
+        pop   r2
+        pshi  {available}
+        pop   r3
+        in    r5, r3        ; bytes queued
+        in    r1, r2
+        in    r6, r3        ; one fewer
+        in    r7, r2
+        in    r8, r2        ; past the end of the input
+        hlt
+"""
+
+READ_SOURCE = """
+main:   pshi  {address}
+        pop   r2
+        {opcode}   r1, r2        ; blocks while the input port is empty
+        hlt
+"""
+
+
+def portSource(source, word_size=16) -> str: # Port addresses move apart with the word size, see ports.py
+    scale = word_size // 16
+    return source.format(input=INPUT * scale, output=OUTPUT * scale, available=AVAILABLE * scale)
+
+
+def checkPorts() -> list: # AsyncPorts must block, batch output and report EOF and the queued count the same at every word size
+    mismatches = []
+    for word_size in (16, 32, 64):
+        cpu = CPU(word_size=word_size)
+        program = assemble(portSource(PORTS_SOURCE, word_size), word_size)
+        cpu.loadProgram(program.functions, program.byte_count, program.saves)
+        ports = AsyncPorts(cpu) # No reader, so the input is closed once the fed bytes run out
+        ports.feed(b"AB")
+        if cpu.run() != HALTED:
+            mismatches.append("{}-bit ports: {}".format(word_size, cpu.error))
+        elif [cpu.regs[r] for r in (R5, R1, R6, R7, R8)] != [2, 0x41, 1, 0x42, cpu.wordMask]:
+            mismatches.append("{}-bit ports: read {}".format(word_size, [hex(cpu.regs[r]) for r in (R5, R1, R6, R7, R8)]))
+
+    # in and lwa on an empty port leave ip on themselves, so the read is retried once input arrives
+    for word_size in (16, 32, 64):
+        for opcode, base in (("in", 0), ("lwa", CPU(word_size=word_size).segments["io"][0])):
+            for engine in ("run", "runCompiled"):
+                cpu = CPU(word_size=word_size)
+                program = assemble(READ_SOURCE.format(address=base + INPUT * word_size // 16, opcode=opcode), word_size)
+                cpu.loadProgram(program.functions, program.byte_count, program.saves)
+                ports = AsyncPorts(cpu, QueuedReader())
+                blocked = getattr(cpu, engine)()
+                ports.feed(b"A")
+                if blocked != WAITING or getattr(cpu, engine)() != HALTED or cpu.regs[R1] != 0x41:
+                    mismatches.append("{}-bit {} {} of an empty port: read {:#x}".format(word_size, engine, opcode, cpu.regs[R1]))
+
+    async def echo(chunks, word_size):
+        cpu = CPU(word_size=word_size)
+        program = assemble(portSource(ECHO_SOURCE, word_size), word_size)
+        cpu.loadProgram(program.functions, program.byte_count, program.saves)
+        writer = RecordingWriter()
+        ports = AsyncPorts(cpu, QueuedReader(chunks), writer)
+        status = await runAsync(cpu, ports, quantum=50)
+        return status, ports, writer
+
+    async def echoAll():
+        inputs = [[b"hello", b" ", b"world"], [b"x" * 300], [], [b"pyvm"]]
+        return inputs, await asyncio.gather(*(echo(chunks, word_size) for chunks in inputs for word_size in (16, 32)))
+
+    inputs, results = asyncio.run(echoAll())
+    for index, (status, ports, writer) in enumerate(results):
+        expected = b"".join(inputs[index // 2])
+        name = "echo guest {}".format(index)
+        if status != HALTED:
+            mismatches.append("{}: status {}".format(name, status))
+        if bytes(ports.written) != expected or b"".join(writer.chunks) != expected:
+            mismatches.append("{}: wrote {!r}".format(name, bytes(ports.written)))
+        if len(expected) > 1 and len(writer.chunks) >= len(expected):
+            mismatches.append("{}: {} bytes written in {} chunks".format(name, len(expected), len(writer.chunks)))
+    return mismatches
+
+
+def inputProgram() -> Program: # Reads one byte from the io input port into r1
+    cpu = CPU()
+    r1 = cpu.registerDict['r1']
+    r2 = cpu.registerDict['r2']
+
+    program = Program()
+    program.instruction(Instruction.PSHI, value=INPUT)
+    program.instruction(Instruction.POP, r2)
+    program.instruction(Instruction.IN, r1, r2)
+    program.instruction(Instruction.HLT)
+    return program
+
+
+FRAME_SOURCE = """
+main:   pshi  0x11
+        pshi  0x22          ; still on the stack across the call
+        jali  outer
+        pop   r1
+        pop   r2
+        hlt
+outer:  pshi  0x33          ; left behind, ret drops it with the frame
+        jali  inner
+        pshi  0x44
+        call  light
+        ret
+inner:  pshi  0x55
+        pshi  0x66
+        ret
+light:  .save r3
+        pshi  0x77
+        jali  inner
+        rtn
+"""
+
+
+def checkFrames(programs) -> list: # Every ret and rtn must give the caller back its fp, sp and frame size, and go on after the call
+    mismatches = []
+    for name, program in programs:
+        cpu = CPU()
+        cpu.loadProgram(program.functions, program.byte_count, program.saves)
+        regs = cpu.regs
+        steps = [] # (ip, opcode, next ip, fp, sp, frame size) before each instruction
+        cpu.tracer = lambda ip, instruction, a, b: steps.append((ip, instruction, cpu.decoded[ip][3], regs[FP], regs[SP], cpu.stack_frame_size))
+        with contextlib.redirect_stdout(io.StringIO()):
+            status = cpu.run(100000) # A return into a wrong frame may never halt
+        if status != HALTED:
+            mismatches.append("{}: ended {} instead of halting".format(name, STATUS_NAMES[status]))
+
+        calls = []
+        for k, (ip, instruction, next_ip, fp, sp, size) in enumerate(steps):
+            if instruction in (Instruction.JAL, Instruction.JALI, Instruction.CALL, Instruction.CALLR):
+                calls.append((next_ip, fp, sp, size))
+            elif instruction in (Instruction.RET, Instruction.RTN) and calls and k + 1 < len(steps):
+                expected = calls.pop()
+                returned = (steps[k + 1][0],) + steps[k + 1][3:]
+                if returned != expected:
+                    mismatches.append("{}: {} at {:04x} returned to (ip, fp, sp, frame size) {}, the call left {}".format(name, Instruction(instruction).name.lower(), ip, returned, expected))
+    return mismatches
+
+
+def checkExecutables() -> list: # Executables with a corrupt symbol table must be rejected with the format error, not whatever parsing hit
+    mismatches = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "demo.exe")
+        demoProgram().save(path)
+        with open(path, "rb") as file:
+            image = file.read()
+        magic, version, word_size, entry, count, code_offset, code_length = HEADER.unpack_from(image, 0)
+        header = lambda count=count, code_offset=code_offset: HEADER.pack(magic, version, word_size, entry, count, code_offset, code_length)
+        name = HEADER.size + SYMBOL.size - 1 # First symbol's name length
+
+        corrupt = {
+            "more symbols than the table holds": header(count + 50) + image[HEADER.size:],
+            "a name running into the code": image[:name] + b"\xff" + image[name + 1:],
+            "a name that isn't utf-8": image[:name + 1] + b"\xff" + image[name + 2:],
+            "code starting inside the table": header(code_offset=HEADER.size + 2) + image[HEADER.size:],
+        }
+        for problem, data in corrupt.items():
+            with open(path, "wb") as file:
+                file.write(data)
+            try:
+                CPU().load(path)
+                error = None
+            except Exception as e:
+                error = e
+            if type(error) is not Exception or "corrupt symbol table" not in str(error):
+                mismatches.append("executable with {}: loading raised {!r}".format(problem, error))
+    return mismatches
+
+
+def checkSharedMemory() -> list: # CPUs dropped from a shared MappedMemory must take their hooks with them, the live ones keep theirs
+    mismatches = []
+    size = CPU().memory.size
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "guest.img")
+        with open(path, "wb") as file:
+            file.write(bytes(size))
+
+        with MappedMemory(path) as memory:
+            kept = CPU(buffer=memory)
+            program = demoProgram()
+            kept.loadProgram(program.functions, program.byte_count, program.saves)
+            for _ in range(20):
+                runEngine(loopProgram(), "run", buffer=memory)
+            gc.collect()
+
+            if (len(memory.readHooks), len(memory.writeHooks)) != (1, 1):
+                mismatches.append("{} read and {} write hooks left for one live CPU".format(len(memory.readHooks), len(memory.writeHooks)))
+
+            base = kept.segments["program"][0]
+            memory.setUint16(base, memory.getUint16(base)) # Any flat write to code must still reach the live CPU's decode cache
+            if kept.decoded[0] is not None:
+                mismatches.append("a flat write to the program segment left its decoded instruction cached")
+            del kept
+            gc.collect()
+    return mismatches
+
+
+def checkScheduler() -> list: # Guests sharing a Scheduler must end as they do alone, a spinning one is retired at its budget, a blocked one waits
+    guests = [demoProgram(), loopProgram()] + [randomProgram(seed) for seed in range(10)]
+    spin = Program()
+    spin.instruction(Instruction.JI, value=0) # main starts at 0, so this jumps to itself forever
+
+    scheduler = Scheduler(quantum=100)
+    cpus = []
+    for program in guests + [spin, inputProgram()]:
+        cpu = CPU()
+        cpu.loadProgram(program.functions, program.byte_count, program.saves)
+        scheduler.add(cpu, 5000 if program is spin else None)
+        cpus.append(cpu)
+    spinning, reading = cpus[-2:]
+    ports = AsyncPorts(reading, QueuedReader())
+
+    mismatches = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.run()
+    if [cpu for cpu, _ in scheduler.waiting] != [reading] or reading in scheduler.finished:
+        return ["scheduler: blocked guest is not kept waiting"]
+    ports.feed(b"A")
+    scheduler.wake(reading)
+    scheduler.run()
+
+    if len(scheduler.finished) != len(cpus) or scheduler.waiting:
+        mismatches.append("scheduler: {} of {} guests finished".format(len(scheduler.finished), len(cpus)))
+    if spinning.status != BUDGET or spinning.steps != 5000:
+        mismatches.append("scheduler: spinning guest ran {} steps, status {}".format(spinning.steps, spinning.status))
+    if reading.regs[R1] != 0x41:
+        mismatches.append("scheduler: woken guest read {:#x}".format(reading.regs[R1]))
+    for index, (cpu, program) in enumerate(zip(cpus, guests)):
+        state = captureState(cpu)
+        state["error"] = repr(cpu.error) if cpu.status == FAULT else None
+        reference = runEngine(program, "run")
+        mismatches += ["scheduler guest {}: {} differs from a solo run".format(index, key) for key in differences(state, reference)]
+    return mismatches
+
+
+def stops(program, max_steps=100000, word_size=16) -> bool: # Frames clobbered at the bottom of the stack can return to ip 0 forever
+    cpu = CPU(word_size=word_size)
+    cpu.loadProgram(program.functions, program.byte_count, program.saves)
+    return cpu.run(max_steps) != BUDGET
+
+
+def runChecks(title, cases, check) -> int: # Runs check(program) on every (name, program) case, returns how many differ
+    failures = 0
+    for name, program in cases:
+        mismatches = check(program)
+        if mismatches:
+            failures += 1
+            print("{}: {}".format(name, ", ".join(mismatches)))
+    print("{}: {} of {} programs match".format(title, len(cases) - failures, len(cases)))
+    return failures
+
+
+def report(title, mismatches) -> int: # Prints the mismatches of a check over the whole VM, returns how many
+    for mismatch in mismatches:
+        print(mismatch)
+    print("{}: {} mismatches".format(title, len(mismatches)))
+    return len(mismatches)
+
+
+def checkForward() -> list: # FORWARD_SOURCE must assemble to its Program.instruction twin and run the same on every engine
+    forward = assemble(FORWARD_SOURCE)
+    mismatches = ["forward references: {} differs from the Program".format(field) for field in sameProgram(forward, forwardProgram(forwardProgram({}).labels))]
+    return mismatches + compare(forward)
+
+
+def checkVerifier(programs) -> list: # programs must all verify, unverifiedPrograms() must all be rejected
+    wrong = [name for name, program in programs + dynamicPrograms() if not verifies(program)]
+    wrong += [name for name, program in unverifiedPrograms() if verifies(program)]
+    return ["{}: verifier gave the wrong answer".format(name) for name in wrong]
+
+
+def poolReference(job, max_steps=None, timeout=None) -> dict: # The runMany result for job, from a CPU run in this process
+    cpu = CPU()
+    try:
+        if isinstance(job, Program):
+            cpu.loadProgram(job.functions, job.byte_count, job.saves)
+        else:
+            cpu.load(job)
+    except Exception as e:
+        return jobFault(e)
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    with contextlib.redirect_stdout(io.StringIO()):
+        status = cpu.run(max_steps, deadline)
+    return {
+        "status": STATUS_NAMES[status],
+        "steps": cpu.steps,
+        "error": str(cpu.error) if status == FAULT else None,
+        "registers": {name: cpu.getRegisterValue(cpu.getRegisterIndex(name)) for name in cpu.registerNames},
+        "stack_frame_size": cpu.stack_frame_size,
+        "alu_result": cpu.alu.result,
+        "stack": bytes(cpu.stack.memory),
+        "general": bytes(cpu.general.memory),
+    }
+
+
+def checkPool(programs) -> list: # runMany must return what each job ends with run alone, at its budget and deadline too
+    names = [name for name, _ in programs]
+    jobs = [program for _, program in programs]
+    mismatches = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        names += ["path job", "missing path"] # Mapped by the worker, the missing one faults on its own
+        jobs += [os.path.join(directory, "job.exe"), os.path.join(directory, "missing.exe")]
+        programs[0][1].save(jobs[-2])
+
+        for limits, label in (({}, "to the end"), ({"max_steps": 7}, "budget"), ({"timeout": 0}, "timeout")):
+            references = [poolReference(job, **limits) for job in jobs]
+            for threshold, path in ((0, "shared memory"), (1 << 30, "pickled")): # How general memory comes back
+                with contextlib.redirect_stdout(io.StringIO()): # Forked workers print into it too
+                    results = runMany(jobs, workers=2, shared_threshold=threshold, **limits)
+                for name, result, reference in zip(names, results, references):
+                    mismatches += ["runMany {} {} {}: {} differs".format(label, path, name, key) for key in differences(result, reference)]
+    return mismatches
+
+
+def wideCases(word_size, calls=0, branches=0, randoms=20) -> list: # Random, call and branch programs for a wide word size
+    cases = [("random {}".format(seed), randomProgram(seed, word_size=word_size)) for seed in range(randoms)]
+    cases += [("calls {}".format(seed), program) for seed, program in ((seed, callProgram(seed, word_size)) for seed in range(calls)) if stops(program, word_size=word_size)]
+    cases += [("branches {}".format(seed), branchProgram(seed, word_size)) for seed in range(branches)]
+    return cases
+
+
+def main() -> int: # Returns how many checks failed
+    programs = [("demo", demoProgram()), ("loop", loopProgram())]
+    programs += [("random {}".format(seed), randomProgram(seed)) for seed in range(50)]
+    programs += [("calls {}".format(seed), program) for seed, program in ((seed, callProgram(seed)) for seed in range(40)) if stops(program)]
+    programs += [(name, assemble(source)) for name, source in ODD_STACK_SOURCES.items()]
+
+    saved = programs + unverifiedPrograms()
+    sources = programs + [("branches {}".format(seed), branchProgram(seed)) for seed in range(10)]
+    for word_size in (32, 64):
+        saved += [("{}-bit random {}".format(word_size, seed), randomProgram(seed, word_size=word_size)) for seed in range(10)]
+        sources += [("{}-bit calls {}".format(word_size, seed), callProgram(seed, word_size)) for seed in range(10)]
+    checked = programs + dynamicPrograms() + unverifiedPrograms()
+    fusedPrograms = programs + [("branches {}".format(seed), branchProgram(seed)) for seed in range(30)]
+    optimized = fusedPrograms + branchPairPrograms()
+    optimized += [("optimizer {}".format(seed), optimizerProgram(seed)) for seed in range(60)]
+    optimized += [(name, assemble(source)) for name, source in EDGE_SOURCES.items()]
+    optimized += [("calls {}".format(seed), program) for seed, program in ((seed, callProgram(seed)) for seed in range(40, 60)) if stops(program)]
+
+    sections = [
+        ("Engines", programs, compare),
+        ("WideCPU at 16 bits", programs, compareWide),
+        ("File-backed memory", programs[:12], compareMapped),
+        ("Loaded images", programs, compareImages),
+        ("Saved executables", saved, lambda program: compareSaved(program, program.word_size)),
+        ("Assembler", sources, compareAssembled),
+    ]
+    for word_size in (32, 64):
+        sections.append(("{}-bit engines".format(word_size), wideCases(word_size, calls=20, randoms=50), lambda program, word_size=word_size: compare(program, word_size=word_size)))
+    sections += [
+        ("Verified run loop", checked, compareChecked),
+        ("Resumed runs", checked, lambda program: compareResumed(program) + compareResumed(program, checked=True)),
+        ("Snapshots", checked, lambda program: compareForked(program) + compareForked(program, checked=True)),
+        ("Profiler", checked, compareProfiled),
+        ("Tracers", checked + [("fused " + name, fuse(program)) for name, program in fusedPrograms], compareTraced),
+        ("Superinstructions", fusedPrograms, lambda program: compareFused(program) + compareExecuted(program)),
+    ]
+    sections.append(("Optimizer", optimized, compareOptimized))
+    for word_size in (32, 64):
+        wide = wideCases(word_size, branches=10)
+        sections.append(("{}-bit superinstructions".format(word_size), wide, lambda program, word_size=word_size: compareFused(program, word_size=word_size) + compareExecuted(program, word_size)))
+        sections.append(("{}-bit optimizer".format(word_size), wide, lambda program, word_size=word_size: compareOptimized(program, word_size)))
+
+    framePrograms = [("frames", assemble(FRAME_SOURCE)), ("forward references", assemble(FORWARD_SOURCE)), ("demo", demoProgram())]
+    framePrograms += [("recursion", recursion(30, 2)), ("light recursion", lightRecursion(30, 2))]
+    checks = [
+        ("ALU flag and branch matrix", checkFlagMatrix),
+        ("WideCPU flag and branch matrix", lambda: checkFlagMatrix(WideCPU)),
+        ("Assembler forward references", checkForward),
+        ("Verifier", lambda: checkVerifier(programs)),
+        ("Call frames", lambda: checkFrames(framePrograms)),
+        ("Corrupt executables", checkExecutables),
+        ("Shared memory hooks", checkSharedMemory),
+        ("Scheduler", checkScheduler),
+        ("I/O ports", checkPorts),
+        ("Process pool", lambda: checkPool(programs[:12] + [("fault", assemble(EDGE_SOURCES["fault between a pair"]))])),
+    ]
+
+    total = sum(runChecks(title, cases, check) for title, cases, check in sections)
+    total += sum(report(title, check()) for title, check in checks)
+
+    pairs = sum(fusedPairs(program) for _, program in fusedPrograms)
+    before = sum(steps(program) for _, program in optimized)
+    after = sum(steps(optimize(program)) for _, program in optimized)
+    print("{} superinstruction pairs fused, {} of {} guest instructions left after the optimizer".format(pairs, after, before))
+
+    try:
+        import batch
+    except ImportError:
+        print("Batch engine: skipped, NumPy is not installed")
+        return total
+
+    lanes = [("input loop", inputLoopProgram()), ("loop", loopProgram(50))]
+    lanes += [("random {}".format(seed), randomProgram(seed)) for seed in range(10)]
+    lanes += [("calls {}".format(seed), program) for seed, program in ((seed, callProgram(seed)) for seed in range(10)) if stops(program)]
+    lanes += [("fused {}".format(name), fuse(program)) for name, program in lanes[:6]]
+    lanes += [("fused branches {}".format(seed), fuse(branchProgram(seed))) for seed in range(4)]
+    return total + runChecks("Batch engine", lanes, compareBatch)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
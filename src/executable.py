@@ -0,0 +1,83 @@
+import mmap
+import struct
+
+# File layout, all integers big endian like the rest of the VM:
+#   header   magic "PYVM", version u16, word size u8, entry u32, symbol count u16, code offset u32, code length u32
+#   symbols  symbol count * (address u32, save mask u8, name length u8, name utf-8)
+#   code     raw program image, loaded into the program segment at address 0
+MAGIC = b"PYVM"
+VERSION = 3 # Version 2 had no save masks, version 1 no word size and 16-bit addresses
+HEADER = struct.Struct(">4sHBIHII")
+SYMBOL = struct.Struct(">IBB")
+
+
+def writeExecutable(path, image, entry, labels, word_size=16, saves=None) -> None:
+    saves = saves or {}
+    symbols = bytearray()
+    for name, address in labels.items():
+        encoded = name.encode("utf-8")
+        if len(encoded) > 0xFF:
+            raise Exception("Label \"{}\" is too long".format(name))
+        symbols += SYMBOL.pack(address, saves.get(name, 0), len(encoded)) + encoded
+
+    code_offset = HEADER.size + len(symbols)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, word_size, entry, len(labels), code_offset, len(image)))
+        f.write(symbols)
+        f.write(image)
+
+
+class Executable:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise Exception("{} is not a PYVM executable".format(path))
+
+        magic, version, self.word_size, self.entry, symbol_count, code_offset, code_length = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise Exception("{} is not a PYVM executable".format(path))
+        if version != VERSION:
+            self.close()
+            raise Exception("Unsupported executable version {}".format(version))
+        if code_offset + code_length > len(self.map):
+            self.close()
+            raise Exception("{} is truncated".format(path))
+
+        self.labels = {}
+        self.saves = {} # Label -> save mask, only labels that have one
+        offset = HEADER.size
+        for _ in range(symbol_count):
+            name = None
+            if offset + SYMBOL.size <= code_offset: # Symbols sit between the header and the code
+                address, mask, length = SYMBOL.unpack_from(self.map, offset)
+                offset += SYMBOL.size
+                if offset + length <= code_offset:
+                    try:
+                        name = self.map[offset:offset + length].decode("utf-8")
+                    except UnicodeDecodeError:
+                        pass
+            if name is None:
+                self.close()
+                raise Exception("{} has a corrupt symbol table".format(path))
+            self.labels[name] = address
+            if mask:
+                self.saves[name] = mask
+            offset += length
+
+        self.code = memoryview(self.map)[code_offset:code_offset + code_length] # Zero-copy view of the code section
+
+    def close(self) -> None:
+        if getattr(self, "code", None) is not None:
+            self.code.release()
+            self.code = None
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
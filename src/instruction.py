@@ -4,6 +4,8 @@ class Instruction(IntEnum):
     LW      = 0x10 # lw     rd, rs      # Loads word from memory address specified by register source into register destination
     SW      = 0x11 # sw     rs, rd      # Stores word from register source into memory address specified by register destination
     SWP     = 0x12 # swp    r1, r2      # Swap two registers values
+    LWA     = 0x13 # lwa    rd, rs      # Loads word from flat address (any segment) specified by register source into register destination
+    SWA     = 0x14 # swa    rs, rd      # Stores word from register source into flat address (any segment) specified by register destination
 
     PSH     = 0x30 # psh    rs          # Push contents of register source onto stack
     PSHI    = 0x31 # pshi   0x0000      # Push immediate value onto stack
@@ -12,6 +14,9 @@ class Instruction(IntEnum):
     JALI    = 0x40 # jali   0x0000      # Jump and link to immediate value, save state of CPU on stack
     JAL     = 0x41 # jal    rs          # Jump and link to value in register source, save state of CPU on stack
     RET     = 0x42 # ret                # Return from linked function
+    CALL    = 0x43 # call   0x0000      # Jump and link to immediate value, save only ip and the callee's save mask registers
+    CALLR   = 0x44 # callr  rs          # Jump and link to value in register source, save only ip and the callee's save mask registers
+    RTN     = 0x45 # rtn                # Return from a call or callr
 
     ADD     = 0x50 # add    r1, r2      # Add two registers
     SUB     = 0x51 # sub    r1, r2      # Subtract first register by second register
@@ -35,4 +40,99 @@ class Instruction(IntEnum):
     BGT     = 0x86 # bgt    0x0000      # Branch if ALU negative flag is False (don't care about the ALU negative flag)
     BGE     = 0x87 # bge    0x0000      # Branch if ALU negative flag is False or ALU Zero flag is True
 
-    HLT     = 0xFF # hlt                # Halt execution of program
\ No newline at end of file
+    IN      = 0x90 # in     rd, rs      # Loads word from io port address specified by register source into register destination
+    OUT     = 0x91 # out    rs, rd      # Stores word from register source into io port address specified by register destination
+
+    # Superinstructions, written by peephole.fuse over the first opcode byte of the sequence they replace
+    LI      = 0xA0 # pshi 0x0000, pop rd    # Load immediate into register destination
+    MOV     = 0xA1 # psh rs, pop rd         # Copy register source into register destination
+    CMPB    = 0xA2 # sub r1, r2, bxx 0x0000 # Compare two registers and branch on the result
+    TSTB    = 0xA3 # and r1, r2, bxx 0x0000 # Bitwise and two registers and branch on the result
+
+    HLT     = 0xFF # hlt                # Halt execution of program
+
+
+class Format(IntEnum):
+    NONE    = 0 # op
+    REG     = 1 # op     r1
+    REG_REG = 2 # op     r1, r2
+    WORD    = 3 # op     0x0000
+    WORD_THEN_REG       = 4 # op     0x0000 pop r1
+    REG_THEN_REG        = 5 # op     r1 pop r2
+    REG_REG_THEN_WORD   = 6 # op     r1, r2 bxx 0x0000
+
+FORMATS = {
+    Instruction.LW:     Format.REG_REG,
+    Instruction.SW:     Format.REG_REG,
+    Instruction.SWP:    Format.REG_REG,
+    Instruction.LWA:    Format.REG_REG,
+    Instruction.SWA:    Format.REG_REG,
+
+    Instruction.PSH:    Format.REG,
+    Instruction.PSHI:   Format.WORD,
+    Instruction.POP:    Format.REG,
+
+    Instruction.JALI:   Format.WORD,
+    Instruction.JAL:    Format.REG,
+    Instruction.RET:    Format.NONE,
+    Instruction.CALL:   Format.WORD,
+    Instruction.CALLR:  Format.REG,
+    Instruction.RTN:    Format.NONE,
+
+    Instruction.ADD:    Format.REG_REG,
+    Instruction.SUB:    Format.REG_REG,
+    Instruction.MULT:   Format.REG_REG,
+    Instruction.DIV:    Format.REG_REG,
+    Instruction.MOD:    Format.REG_REG,
+
+    Instruction.AND:    Format.REG_REG,
+    Instruction.OR:     Format.REG_REG,
+    Instruction.XOR:    Format.REG_REG,
+    Instruction.LSHFT:  Format.REG_REG,
+    Instruction.RSHFT:  Format.REG_REG,
+    Instruction.NOT:    Format.REG,
+
+    Instruction.JR:     Format.REG,
+    Instruction.JI:     Format.WORD,
+    Instruction.BEQ:    Format.WORD,
+    Instruction.BNE:    Format.WORD,
+    Instruction.BLT:    Format.WORD,
+    Instruction.BLE:    Format.WORD,
+    Instruction.BGT:    Format.WORD,
+    Instruction.BGE:    Format.WORD,
+
+    Instruction.IN:     Format.REG_REG,
+    Instruction.OUT:    Format.REG_REG,
+
+    Instruction.HLT:    Format.NONE,
+
+    Instruction.LI:     Format.WORD_THEN_REG,
+    Instruction.MOV:    Format.REG_THEN_REG,
+    Instruction.CMPB:   Format.REG_REG_THEN_WORD,
+    Instruction.TSTB:   Format.REG_REG_THEN_WORD,
+}
+
+BRANCHES = {Instruction.BEQ, Instruction.BNE, Instruction.BLT, Instruction.BLE, Instruction.BGT, Instruction.BGE}
+
+# Superinstruction -> (instruction its opcode byte replaced, instructions that may follow it)
+FUSED = {
+    Instruction.LI:     (Instruction.PSHI, {Instruction.POP}),
+    Instruction.MOV:    (Instruction.PSH, {Instruction.POP}),
+    Instruction.CMPB:   (Instruction.SUB, BRANCHES),
+    Instruction.TSTB:   (Instruction.AND, BRANCHES),
+}
+
+def lengths(word_bytes) -> dict: # Encoded length of each format, a WORD immediate is one machine word
+    return {
+        Format.NONE:    1,
+        Format.REG:     2,
+        Format.REG_REG: 3,
+        Format.WORD:    1 + word_bytes,
+        Format.WORD_THEN_REG:       3 + word_bytes,
+        Format.REG_THEN_REG:        4,
+        Format.REG_REG_THEN_WORD:   4 + word_bytes,
+    }
+
+LENGTHS = lengths(2) # 16-bit words
+
+MAX_LENGTH = max(LENGTHS.values())
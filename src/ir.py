@@ -0,0 +1,184 @@
+# Intermediate representation of a Program for optimizer.py. Each function label's code is split
+# into basic blocks of [opcode, operand1, operand2] ops, register operands are byte offsets as in
+# Program.instruction, and jump, branch and call targets are labels instead of addresses so the
+# code can be laid out again after ops are removed.
+#
+#   blocks = build(program)       # Every block in layout order, successors linked
+#   program = emit(blocks, program)
+#
+# Two pseudo ops stand for the stack idiom pairs, the same pairs peephole.py fuses:
+#   [LI, rd, value]   pshi value, pop rd
+#   [MOV, rd, rs]     psh rs, pop rd
+from instruction import Instruction, Format, FORMATS, FUSED, BRANCHES, lengths
+from program import Program
+from registers import REGISTER_NAMES, IP
+
+CALLS = {Instruction.JALI, Instruction.CALL}
+TERMINATORS = {Instruction.JI, Instruction.HLT, Instruction.RET, Instruction.RTN} # Never fall through
+ENDS_BLOCK = TERMINATORS | BRANCHES | CALLS
+JUMP_IMMEDIATES = BRANCHES | CALLS | {Instruction.JI}
+
+# Code addresses can end up in registers or memory through these, so the code can't move
+INDIRECT = {Instruction.JR, Instruction.JAL, Instruction.CALLR, Instruction.LWA, Instruction.SWA}
+
+
+class Block:
+    def __init__(self, function, label=None):
+        self.function = function # Function label the block is laid out in
+        self.label = label       # Set on the first block of a function
+        self.ops = []            # [opcode, operand1, operand2]
+        self.successors = []     # Blocks control can go to next, call targets included
+        self.fallthrough = None  # Next block in layout order, None after the last one
+
+
+def unsupported(program): # Why the program can't be optimized, None when it can
+    if "main" not in program.functions:
+        return "Program requires main function"
+
+    size = lengths(program.word_size // 8)
+    addresses = set(program.labels.values())
+    for func, code in program.functions.items():
+        offset = 0
+        while offset < len(code):
+            opcode = code[offset]
+            if opcode not in FORMATS or opcode in FUSED:
+                return "{}: unsupported opcode {}".format(func, opcode)
+            if opcode in INDIRECT:
+                return "{}: {} may use code addresses as data".format(func, Instruction(opcode).name.lower())
+
+            operandFormat = FORMATS[opcode]
+            end = offset + size[operandFormat]
+            if end > len(code):
+                return "{}: {} runs past the end of the function".format(func, Instruction(opcode).name.lower())
+
+            if operandFormat in (Format.REG, Format.REG_REG):
+                for register in code[offset + 1:end]:
+                    if register % 2 != 0 or not IP < register >> 1 < len(REGISTER_NAMES): # ip reads depend on the layout
+                        return "{}: unsupported register operand {}".format(func, register)
+            elif opcode in JUMP_IMMEDIATES and wordAt(code, offset + 1, end) not in addresses:
+                return "{}: {} target is not a label".format(func, Instruction(opcode).name.lower())
+            offset = end
+    return None
+
+
+def wordAt(code, start, end) -> int: # Big endian WORD immediate
+    value = 0
+    for byte in code[start:end]:
+        value = value << 8 | (int(byte) & 0xff)
+    return value
+
+
+def build(program) -> list: # Blocks of a supported program, see unsupported()
+    size = lengths(program.word_size // 8)
+
+    # Empty functions share their address with the next one, jumps resolve to the one holding code
+    names = {}
+    for func in program.functions:
+        if program.functions[func] or program.labels[func] not in names:
+            names[program.labels[func]] = func
+
+    blocks = []
+    for func, code in program.functions.items():
+        block = None
+        offset = 0
+        while offset < len(code):
+            if block is None:
+                block = Block(func, func if offset == 0 else None)
+                blocks.append(block)
+
+            opcode = Instruction(code[offset])
+            operandFormat = FORMATS[opcode]
+            end = offset + size[operandFormat]
+            if operandFormat == Format.WORD:
+                value = wordAt(code, offset + 1, end)
+                block.ops.append([opcode, names[value] if opcode in JUMP_IMMEDIATES else value, None])
+            elif operandFormat == Format.REG_REG:
+                block.ops.append([opcode, code[offset + 1], code[offset + 2]])
+            elif operandFormat == Format.REG:
+                block.ops.append([opcode, code[offset + 1], None])
+            else:
+                block.ops.append([opcode, None, None])
+
+            if opcode in ENDS_BLOCK:
+                block = None
+            offset = end
+        if not code:
+            blocks.append(Block(func, func)) # Keeps the label in layout order
+
+    link(blocks)
+    return blocks
+
+
+def entries(blocks) -> dict: # Label -> first block holding code at or after it
+    labels = {}
+    pending = []
+    for block in blocks:
+        if block.label is not None:
+            pending.append(block.label)
+        if block.ops:
+            for label in pending:
+                labels[label] = block
+            pending = []
+    for label in pending: # Labels past the last op run off the end of the program
+        labels[label] = None
+    return labels
+
+
+def link(blocks) -> None: # Recomputes fallthrough and successors, blocks without ops are skipped
+    labels = entries(blocks)
+    code = [block for block in blocks if block.ops]
+    for k, block in enumerate(code):
+        block.fallthrough = code[k + 1] if k + 1 < len(code) else None
+
+        opcode, target, _ = block.ops[-1]
+        block.successors = []
+        if opcode in JUMP_IMMEDIATES:
+            block.successors.append(labels[target])
+        if opcode not in TERMINATORS:
+            block.successors.append(block.fallthrough)
+    for block in blocks:
+        if not block.ops:
+            block.fallthrough = None
+            block.successors = []
+
+
+def opSize(op, size) -> int:
+    if op[0] == Instruction.LI:
+        return size[Format.WORD] + size[Format.REG]
+    if op[0] == Instruction.MOV:
+        return 2 * size[Format.REG]
+    return size[FORMATS[op[0]]]
+
+
+def emit(blocks, program) -> Program: # Lays the blocks out again, labels move with their functions
+    size = lengths(program.word_size // 8)
+
+    labels = {}
+    address = 0
+    for block in blocks:
+        if block.label is not None:
+            labels[block.label] = address
+        address += sum(opSize(op, size) for op in block.ops)
+
+    optimized = Program(program.word_size)
+    optimized.functions = {func: [] for func in program.functions}
+    optimized.labels = labels
+    optimized.saves = dict(program.saves)
+
+    for block in blocks:
+        func = block.function
+        for opcode, a, b in block.ops:
+            if opcode == Instruction.LI:
+                optimized.instruction(Instruction.PSHI, func=func, value=b)
+                optimized.instruction(Instruction.POP, a, func=func)
+            elif opcode == Instruction.MOV:
+                optimized.instruction(Instruction.PSH, b, func=func)
+                optimized.instruction(Instruction.POP, a, func=func)
+            elif FORMATS[opcode] == Format.WORD:
+                optimized.instruction(opcode, func=func, value=labels[a] if opcode in JUMP_IMMEDIATES else a)
+            else:
+                optimized.instruction(opcode, a, b, func=func)
+
+    if optimized.byte_count != address:
+        raise Exception("Optimized program is {} bytes, laid out as {}".format(optimized.byte_count, address))
+    return optimized
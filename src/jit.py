@@ -0,0 +1,254 @@
+from instruction import Instruction, Format, FORMATS, FUSED
+from registers import IP, AC, SP
+
+# Opcodes whose whole effect is registers, the stack, general memory and the ALU,
+# these are compiled inline. Everything else ends the block and runs through the CPU handler.
+INLINE = {
+    Instruction.LW, Instruction.SW, Instruction.SWP,
+    Instruction.PSH, Instruction.PSHI, Instruction.POP,
+    Instruction.ADD, Instruction.SUB, Instruction.MULT, Instruction.DIV, Instruction.MOD,
+    Instruction.AND, Instruction.OR, Instruction.XOR, Instruction.LSHFT, Instruction.RSHFT,
+    Instruction.NOT,
+}
+
+BINARY = {
+    Instruction.ADD:    "a + b",
+    Instruction.SUB:    "a - b",
+    Instruction.MULT:   "a * b",
+    Instruction.DIV:    "int(a / b)",
+    Instruction.MOD:    "a % b",
+    Instruction.AND:    "a & b",
+    Instruction.OR:     "a | b",
+    Instruction.XOR:    "a ^ b",
+    Instruction.LSHFT:  "a << b",
+    Instruction.RSHFT:  "a >> b",
+}
+
+
+class BlockCompiler:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.blocks = {} # Start address -> compiled block
+
+        # Word size constants are written into the generated source, 16-bit blocks are unchanged
+        self.wordBytes = cpu.wordBytes
+        self.mask = "0x{:X}".format(cpu.wordMask)
+        self.sign = "0x{:X}".format(1 << (cpu.wordBits - 1))
+
+        cpu.program.onWrite(self.invalidate)
+
+    def invalidate(self, address, length) -> None:
+        self.blocks.clear()
+
+    def run(self) -> None:
+        regs = self.cpu.regs
+        blocks = self.blocks
+
+        halt = 1
+        while halt != 0:
+            ip_value = regs[IP]
+            block = blocks.get(ip_value)
+            if block is None:
+                block = self.compile(ip_value)
+            halt = block()
+
+    def inlinable(self, instruction, a, b) -> bool:
+        if instruction not in INLINE:
+            return False
+
+        # Reading or writing ip needs the interpreter's view of it, leave those to the handler
+        operandFormat = FORMATS[instruction]
+        if operandFormat == Format.REG:
+            return a != IP
+        if operandFormat == Format.REG_REG:
+            return a != IP and b != IP
+        return True
+
+    def compile(self, address) -> object:
+        cpu = self.cpu
+        start = address
+
+        body = []
+        terminator = None
+        while terminator is None:
+            record = cpu.decoded[address] if address < len(cpu.decoded) else None
+            if record is None:
+                try:
+                    record = cpu.decode(address)
+                except Exception:
+                    if address == start:
+                        raise
+                    terminator = (None, 0, 0, address) # Ends the block before it, it faults when run() gets there
+                    break
+
+            parts = [record]
+            if record[0] in FUSED: # Compiled as the pair it stands for, so a superinstruction doesn't end the block
+                parts = cpu.decodeParts(address, record[0])
+
+            for instruction, a, b, next_ip in parts:
+                if not self.inlinable(instruction, a, b):
+                    terminator = (instruction, a, b, next_ip)
+                    break
+                body.append((instruction, a, b, next_ip))
+                address = next_ip
+
+        block = self.generate(start, body, terminator)
+        self.blocks[start] = block
+        return block
+
+    def generate(self, start, body, terminator) -> object:
+        used = set()
+        written = set()
+        usesStack = False
+        usesALU = False
+
+        for instruction, a, b, next_ip in body:
+            operandFormat = FORMATS[instruction]
+            if operandFormat in (Format.REG, Format.REG_REG):
+                used.add(a)
+            if operandFormat == Format.REG_REG:
+                used.add(b)
+
+            if instruction in (Instruction.SWP, Instruction.PSH, Instruction.PSHI, Instruction.POP):
+                usesStack = True
+            if instruction in BINARY or instruction == Instruction.NOT:
+                usesALU = True
+                written.add(AC)
+            elif instruction in (Instruction.LW, Instruction.POP):
+                written.add(a)
+            elif instruction == Instruction.SWP:
+                written.update((a, b))
+
+        if usesStack:
+            used.add(SP)
+            written.add(SP)
+        used.update(written)
+
+        lines = []
+        emit = lambda indent, line: lines.append("    " * indent + line)
+
+        for reg in sorted(used):
+            emit(1, "r{0} = regs[{0}]".format(reg))
+        if usesStack:
+            emit(1, "fs = cpu.stack_frame_size")
+        if usesALU:
+            emit(1, "res = alu.result")
+
+        faults = {} # Source line -> ip run() leaves when the instruction on that line faults
+        emit(1, "try:")
+        for instruction, a, b, next_ip in body:
+            first = len(lines)
+            self.emitInstruction(emit, instruction, a, b)
+            for line in range(first, len(lines)):
+                faults[line + 2] = next_ip # Line 1 is the def
+        if not body:
+            emit(2, "pass")
+        if usesStack: # Inline stack stores index the bytes directly, fault the way Memory does past the segment
+            emit(1, "except IndexError as e:")
+            emit(2, "regs[{}] = faults[e.__traceback__.tb_lineno]".format(IP))
+            emit(2, "raise Exception(\"Address out of bounds\")")
+        emit(1, "except Exception as e:")
+        emit(2, "regs[{}] = faults[e.__traceback__.tb_lineno]".format(IP))
+        emit(2, "raise")
+
+        emit(1, "finally:")
+        for reg in sorted(written):
+            emit(2, "regs[{0}] = r{0}".format(reg))
+        if usesStack:
+            emit(2, "cpu.stack_frame_size = fs")
+        if usesALU:
+            emit(2, "alu.result = res")
+        if not written and not usesStack and not usesALU:
+            emit(2, "pass")
+
+        instruction, a, b, next_ip = terminator
+        emit(1, "regs[{}] = {}".format(IP, next_ip))
+        if instruction is None:
+            emit(1, "return 1")
+        elif self.cpu.dispatch[instruction] is None:
+            emit(1, "raise Exception(\"Unknown instruction given: {}\")".format(instruction))
+        else:
+            emit(1, "return handler({}, {})".format(a, b))
+
+        source = "def block_{:04x}(cpu=cpu, regs=regs, stack=stack, general=general, alu=alu, handler=handler, faults=faults):\n".format(start)
+        source += "\n".join(lines) + "\n"
+
+        namespace = {
+            "cpu": self.cpu,
+            "regs": self.cpu.regs,
+            "stack": self.cpu.stack.memory,
+            "general": self.cpu.general,
+            "alu": self.cpu.alu,
+            "handler": None if instruction is None else self.cpu.dispatch[instruction],
+            "faults": faults,
+        }
+        exec(compile(source, "<block {:04x}>".format(start), "exec"), namespace)
+        return namespace["block_{:04x}".format(start)]
+
+    def emitPush(self, emit, value) -> None:
+        sp = "r{}".format(SP)
+        size = self.wordBytes
+        for k in reversed(range(size)): # Big endian, one byte store per byte of the word, the last first so a store past the segment writes nothing
+            shift = 8 * (size - 1 - k)
+            emit(2, "stack[{}] = {}".format(self.stackIndex(sp, k), "{} >> {} & 0xFF".format(value, shift) if shift else "{} & 0xFF".format(value)))
+        emit(2, "if {} > 0:".format(sp))
+        emit(3, "{0} = ({0} - {1}) & {2}".format(sp, size, self.mask))
+        emit(3, "fs += {}".format(size))
+
+    def emitPop(self, emit, target) -> None:
+        sp = "r{}".format(SP)
+        size = self.wordBytes
+        emit(2, "if {} < {}:".format(sp, self.cpu.SP_MAX))
+        emit(3, "{} += {}".format(sp, size))
+        emit(3, "fs -= {}".format(size))
+
+        parts = []
+        for k in range(size):
+            shift = 8 * (size - 1 - k)
+            parts.append("stack[{}] << {}".format(self.stackIndex(sp, k), shift) if shift else "stack[{}]".format(self.stackIndex(sp, k)))
+        emit(2, "{} = {}".format(target, " | ".join(parts)))
+
+    def stackIndex(self, sp, k) -> str:
+        return sp if k == 0 else "{} + {}".format(sp, k)
+
+    def emitOperand(self, emit, name, reg) -> None:
+        emit(2, "{} = r{}".format(name, reg))
+        emit(2, "if {0} >= {1}: {0} = -{0}".format(name, self.sign)) # Same conversion as ALU.convert2scompl
+
+    def emitInstruction(self, emit, instruction, a, b) -> None:
+        if instruction == Instruction.LW:
+            if self.wordBytes == 2:
+                emit(2, "r{} = general.getUint16(r{})".format(a, b))
+            else:
+                emit(2, "r{} = general.getUint(r{}, {})".format(a, b, self.wordBytes))
+        elif instruction == Instruction.SW:
+            if self.wordBytes == 2:
+                emit(2, "general.setUint16(r{}, r{})".format(b, a))
+            else:
+                emit(2, "general.setUint(r{}, r{}, {})".format(b, a, self.wordBytes))
+        elif instruction == Instruction.SWP:
+            self.emitPush(emit, "r{}".format(a))
+            self.emitPush(emit, "r{}".format(b))
+            self.emitPop(emit, "r{}".format(a))
+            self.emitPop(emit, "r{}".format(b))
+        elif instruction == Instruction.PSH:
+            self.emitPush(emit, "r{}".format(a))
+        elif instruction == Instruction.PSHI:
+            self.emitPush(emit, str(a))
+        elif instruction == Instruction.POP:
+            self.emitPop(emit, "r{}".format(a))
+        elif instruction == Instruction.NOT:
+            self.emitOperand(emit, "a", a)
+            emit(2, "res = ~a")
+            emit(2, "r{} = res & {}".format(AC, self.mask))
+        else:
+            self.emitOperand(emit, "a", a)
+            self.emitOperand(emit, "b", b)
+            if instruction == Instruction.DIV:
+                emit(2, "if b == 0: raise Exception(\"Divide by 0 Error\")")
+            elif instruction == Instruction.MOD:
+                emit(2, "if b == 0: raise Exception(\"Modulo by 0 Error\")")
+            if self.wordBytes != 2 and instruction in (Instruction.LSHFT, Instruction.RSHFT):
+                emit(2, "b = min(b, {})".format(self.cpu.wordBits)) # Same clamp as WideALU
+            emit(2, "res = {}".format(BINARY[instruction]))
+            emit(2, "r{} = res & {}".format(AC, self.mask))
@@ -1,9 +1,36 @@
+import mmap
+import os
+import struct
+
+WORDS = {} # Word count -> struct.Struct of that many big endian u16, shared by readWords and writeWords
+
+
+def wordStruct(count) -> struct.Struct:
+    packer = WORDS.get(count)
+    if packer is None:
+        packer = WORDS[count] = struct.Struct(">{}H".format(count))
+    return packer
+
+
 class Memory:
-    def __init__(self, size):
+    def __init__(self, size, buffer=None): # buffer is an existing writable buffer of size bytes, e.g. an mmap or a memoryview slice
         self.size = size
         if self.size <= 0:
             raise Exception("Memory must be greater than 0 bytes")
-        self.memory = bytearray(self.size)
+        if buffer is None:
+            self.memory = bytearray(self.size)
+        else:
+            if len(buffer) != self.size:
+                raise Exception("Memory buffer must be {} bytes".format(self.size))
+            self.memory = buffer
+        self.writeHooks = []
+        self.readHooks = []
+
+    def onRead(self, callback) -> None: # callback(address, length) runs before every read through this Memory, it may fill the bytes being read
+        self.readHooks.append(callback)
+
+    def onWrite(self, callback) -> None: # callback(address, length) runs after every write through this Memory
+        self.writeHooks.append(callback)
 
     def addressExists(self, address):
         if address > len(self.memory) or address < 0:
@@ -13,26 +40,89 @@ class Memory:
     def getUint8(self, address):
         if not self.addressExists(address):
             raise Exception("Address out of bounds")
+
+        if self.readHooks:
+            for hook in self.readHooks:
+                hook(address, 1)
         return int(self.memory[address])
 
     def getUint16(self, address):
-        if not self.addressExists(address):
+        if address < 0 or address + 1 >= self.size:
             raise Exception("Address out of bounds")
-        if not self.addressExists(address+1):
-            raise Exception("")
-        return int(self.memory[address:(address + 1) + 1].hex(), 16) # Add an additional 1 because python slicing is exclusive >:(
+
+        if self.readHooks:
+            for hook in self.readHooks:
+                hook(address, 2)
+        memory = self.memory
+        return memory[address] << 8 | memory[address + 1] # Big endian, no intermediate bytes or str objects
+
+    def getUint(self, address, size) -> int: # Big endian word of size bytes, for the 32 and 64-bit CPUs
+        if address < 0 or address + size > self.size:
+            raise Exception("Address out of bounds")
+
+        if self.readHooks:
+            for hook in self.readHooks:
+                hook(address, size)
+        return int.from_bytes(self.memory[address:address + size], "big")
+
+    def readWords(self, address, count) -> tuple:
+        if address < 0 or address + count * 2 > self.size:
+            raise Exception("Address out of bounds")
+
+        if self.readHooks:
+            for hook in self.readHooks:
+                hook(address, count * 2)
+        return wordStruct(count).unpack_from(self.memory, address)
 
     def setUint8(self, address, value):
         if not self.addressExists(address):
             raise Exception("Address out of bounds")
         self.memory[address] = value & 0xff
 
+        if self.writeHooks:
+            for hook in self.writeHooks:
+                hook(address, 1)
+
     def setUint16(self, address, value):
-        if not self.addressExists(address):
+        if address < 0 or address + 1 >= self.size:
+            raise Exception("Address out of bounds")
+
+        memory = self.memory
+        memory[address] = (value & 0xff00) >> 8 # Bit mask first byte of the value, then bit shift down to be 0-255
+        memory[address + 1] = (value & 0x00ff)
+
+        if self.writeHooks:
+            for hook in self.writeHooks:
+                hook(address, 2)
+
+    def setUint(self, address, value, size) -> None:
+        if address < 0 or address + size > self.size:
+            raise Exception("Address out of bounds")
+        self.memory[address:address + size] = (value & ((1 << (size * 8)) - 1)).to_bytes(size, "big")
+
+        if self.writeHooks:
+            for hook in self.writeHooks:
+                hook(address, size)
+
+    def writeWords(self, address, words) -> None:
+        if address < 0 or address + len(words) * 2 > self.size:
             raise Exception("Address out of bounds")
-        
-        self.memory[address] = (value & 0xff00) >> 8 # Bit mask first byte of the value, then bit shift down to be 0-255
-        self.memory[address + 1] = (value & 0x00ff)
+        wordStruct(len(words)).pack_into(self.memory, address, *[word & 0xFFFF for word in words])
+
+        if self.writeHooks:
+            for hook in self.writeHooks:
+                hook(address, len(words) * 2)
+
+    def writeBytes(self, address, data) -> None: # data is any buffer-protocol object: bytes, bytearray, memoryview, mmap
+        with memoryview(data) as view:
+            view = view.cast('B')
+            if address < 0 or address + view.nbytes > self.size:
+                raise Exception("Address out of bounds")
+            self.memory[address:address + view.nbytes] = view
+
+            if self.writeHooks:
+                for hook in self.writeHooks:
+                    hook(address, view.nbytes)
 
     def printChunk(self, address, chunkSize=16):
         if not self.addressExists(address):
@@ -43,3 +133,59 @@ class Memory:
         for i in range(0, chunkSize):
             print("{}".format(hex(self.getUint8(address + i))[2:].zfill(2)), end=" " if i%2 == 1 else "") # This is super ugly lol
         print("\n")
+
+
+MAP_MODES = {
+    "r+": mmap.ACCESS_WRITE, # Writes go back to the file, other processes mapping it see them
+    "c":  mmap.ACCESS_COPY,  # Copy-on-write, the file stays read-only and can be shared by many guests
+    "r":  mmap.ACCESS_READ,  # Any write raises
+}
+
+
+class MappedMemory(Memory): # Memory over a file mapping, the kernel pages it in as it is touched so it can exceed RAM
+    def __init__(self, path, size=None, mode="r+", offset=0): # offset must be a multiple of mmap.ALLOCATIONGRANULARITY
+        if mode not in MAP_MODES:
+            raise Exception("Unknown map mode: {}".format(mode))
+        self.path = path
+        self.mode = mode
+
+        flags = os.O_RDWR | os.O_CREAT if mode == "r+" else os.O_RDONLY
+        fd = os.open(path, flags, 0o644)
+        try:
+            length = os.fstat(fd).st_size - offset
+            if size is None:
+                size = length
+            elif size > length:
+                if mode != "r+":
+                    raise Exception("{} is smaller than {} bytes".format(path, size))
+                os.ftruncate(fd, offset + size) # Sparse, the new pages take no disk space until written
+            if size <= 0:
+                raise Exception("Memory must be greater than 0 bytes")
+            self.map = mmap.mmap(fd, size, access=MAP_MODES[mode], offset=offset)
+        finally:
+            os.close(fd) # The mapping keeps its own reference to the file
+
+        super().__init__(size, self.map)
+
+    def flush(self, address=0, length=None) -> None: # Writes dirty pages in the range back to the file and waits for them
+        if self.mode != "r+":
+            return
+        if length is None:
+            length = self.size - address
+        start = address - address % mmap.PAGESIZE # msync wants a page aligned start
+        self.map.flush(start, address + length - start)
+
+    def close(self) -> None:
+        if self.map.closed:
+            return
+        self.flush()
+        try:
+            self.map.close()
+        except BufferError: # A CPU still has segment views of it, the mapping goes when they do
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
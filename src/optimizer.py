@@ -0,0 +1,520 @@
+# Optimizing pass pipeline over the ir.py blocks of a Program, e.g.
+#
+#   program = optimize(assemble(source))
+#   program = fuse(program) # peephole.py, optionally
+#
+# Passes, repeated until none of them changes anything:
+#   propagate   constants and ALU flags forward through the CFG. A push popped later in the same
+#               block becomes an LI or MOV at the pop, a MOV of a known value becomes an LI, ALU ops
+#               on known values are folded and branches the flags decide become JI or go away
+#   swaps       a swp of two registers both just set by LI/MOV swaps the two definitions instead
+#   deadStores  LI, MOV and ALU ops whose results are overwritten before any read are removed
+#   cleanup     unreachable blocks, jumps to the next block and branches over a jump
+#
+# The optimized program ends in the same state as the original: registers other than ip, general
+# memory, the ALU result and the stack frame size, also when it faults. Code addresses move, and so
+# do the stale bytes below sp. A push popped later becomes one assignment at the pop, which only
+# holds while sp moves on both, so unlike the fused pairs, which fall back to push and pop at either
+# end of the stack, the pass leaves alone programs that may reach an end: ones that set sp
+# themselves, ones where a pop may run before its own function pushed anything (it would read the
+# clamped top of the stack or the caller's frame) and ones that may push, call frames included, more
+# words than the stack holds. Nothing is paired across an op that may fault, and a fault observes
+# every register. Programs that may hold code addresses as data come back unchanged too, see
+# ir.unsupported.
+from collections import deque
+
+from alu import ALU, WideALU
+from cpu import SAVED_REGISTERS, segmentSizes
+from instruction import Instruction, Format, FORMATS, BRANCHES
+from ir import CALLS, unsupported, build, entries, link, emit
+from program import Program
+from registers import AC, R8, SP, FP, MASK_REGISTERS
+
+MAX_ROUNDS = 16
+
+TRACKED = {index * 2 for index in range(AC, R8 + 1)} # Register offsets with known values tracked, sp and fp never are
+STACK_POINTERS = {SP * 2, FP * 2}
+RESULT = "result" # The ALU result, every flag is derived from it
+EVERYTHING = TRACKED | STACK_POINTERS | {RESULT}
+
+OPERATIONS = {
+    Instruction.ADD:    "add",
+    Instruction.SUB:    "sub",
+    Instruction.MULT:   "mult",
+    Instruction.DIV:    "div",
+    Instruction.MOD:    "mod",
+    Instruction.AND:    "bitAnd",
+    Instruction.OR:     "bitOr",
+    Instruction.XOR:    "bitXor",
+    Instruction.LSHFT:  "lshift",
+    Instruction.RSHFT:  "rshift",
+    Instruction.NOT:    "bitNot",
+}
+
+# Ops with no effect besides the registers they write, and that can't fault
+REMOVABLE = {
+    Instruction.LI, Instruction.MOV, Instruction.NOT,
+    Instruction.ADD, Instruction.SUB, Instruction.MULT, Instruction.AND, Instruction.OR, Instruction.XOR,
+}
+
+# Ops that may fault, the run ends there with every register as it is
+FAULTING = {Instruction.DIV, Instruction.MOD, Instruction.LW, Instruction.SW, Instruction.IN, Instruction.OUT}
+
+# Branch -> the branch taken exactly when it isn't, BLE and BGE have none
+INVERSE = {
+    Instruction.BEQ: Instruction.BNE, Instruction.BNE: Instruction.BEQ,
+    Instruction.BLT: Instruction.BGT, Instruction.BGT: Instruction.BLT,
+}
+
+
+def operands(op) -> set: # Register offsets an op names
+    opcode, a, b = op
+    if opcode == Instruction.LI:
+        return {a}
+    operandFormat = FORMATS[opcode]
+    if operandFormat in (Format.REG_REG, Format.REG_THEN_REG):
+        return {a, b}
+    return {a} if operandFormat == Format.REG else set()
+
+
+def effects(op) -> tuple: # (read, written) register offsets of an op, RESULT for the ALU result
+    opcode, a, b = op
+    sp = SP * 2
+    if opcode == Instruction.LI:
+        return set(), {a}
+    if opcode == Instruction.MOV:
+        return {b}, {a}
+    if opcode == Instruction.PSH:
+        return {a, sp}, {sp}
+    if opcode == Instruction.PSHI:
+        return {sp}, {sp}
+    if opcode == Instruction.POP:
+        return {sp}, {a, sp}
+    if opcode == Instruction.SWP:
+        return {a, b, sp}, {a, b}
+    if opcode in (Instruction.LW, Instruction.IN): # A fault reads everything, see FAULTING
+        return set(EVERYTHING), {a}
+    if opcode in (Instruction.SW, Instruction.OUT):
+        return set(EVERYTHING), set()
+    if opcode == Instruction.NOT:
+        return {a}, {AC * 2, RESULT}
+    if opcode in FAULTING:
+        return set(EVERYTHING), {AC * 2, RESULT}
+    if opcode in OPERATIONS:
+        return {a, b}, {AC * 2, RESULT}
+    if opcode in BRANCHES:
+        return {RESULT}, set()
+    if opcode == Instruction.JI:
+        return set(), set()
+    if opcode in CALLS:
+        return set(EVERYTHING), set(EVERYTHING)
+    return set(EVERYTHING), set() # ret, rtn and hlt hand every register to someone else
+
+
+def taken(opcode, zero, negative): # True or False when the flags decide the branch, None when they don't
+    if opcode == Instruction.BEQ:
+        return zero
+    if opcode == Instruction.BNE:
+        return None if zero is None else not zero
+    if opcode == Instruction.BLT:
+        return negative
+    if opcode == Instruction.BGT:
+        return None if negative is None else not negative
+    if opcode == Instruction.BLE:
+        if negative or zero:
+            return True
+        return False if negative is False and zero is False else None
+    if negative is False or zero: # BGE
+        return True
+    return False if negative and zero is False else None
+
+
+def flags(state) -> tuple: # (zero, negative), None where unknown
+    if RESULT in state:
+        return state[RESULT] == 0, state[RESULT] < 0
+    return state.get("zero"), state.get("negative")
+
+
+def refine(state, opcode, branch) -> dict: # state on the taken (branch True) or fallthrough side of a branch
+    state = dict(state)
+    if RESULT in state:
+        return state
+
+    if opcode == Instruction.BEQ:
+        state["zero"] = branch
+    elif opcode == Instruction.BNE:
+        state["zero"] = not branch
+    elif opcode == Instruction.BLT:
+        state["negative"] = branch
+    elif opcode == Instruction.BGT:
+        state["negative"] = not branch
+    elif not branch: # BLE and BGE only tell something when they fall through
+        state["zero"] = False
+        state["negative"] = opcode == Instruction.BGE
+
+    if state.get("zero"):
+        state[RESULT] = 0
+    return state
+
+
+def meet(state, incoming) -> dict: # What holds on every edge into a block
+    if state is None:
+        return dict(incoming)
+    return {key: value for key, value in state.items() if key in incoming and incoming[key] == value}
+
+
+class Optimizer:
+    def __init__(self, word_size=16):
+        self.mask = (1 << word_size) - 1
+        self.sign = 1 << (word_size - 1)
+        self.alu = ALU() if word_size == 16 else WideALU(word_size)
+
+    def signed(self, value) -> int: # The ALU's operand conversion
+        value &= self.mask
+        return -value if value >= self.sign else value
+
+    def walk(self, block, state, rewrite=False) -> tuple: # Runs state through block, returns (state at the end, changed)
+        state = dict(state)
+        stack = []    # [push op, known value, source register, source version] of pushes not popped yet
+        versions = {} # Register -> times written so far in this block
+        changed = False
+
+        def write(register, value=None):
+            versions[register] = versions.get(register, 0) + 1
+            state.pop(register, None)
+            if value is not None and register in TRACKED:
+                state[register] = value & self.mask
+
+        for op in block.ops:
+            opcode, a, b = op
+            if operands(op) & STACK_POINTERS or opcode in FAULTING:
+                stack = [] # Pushes before an explicit sp or fp operand, or an op that may stop the run with them pushed, stay where they are
+
+            if opcode == Instruction.PSHI:
+                stack.append([op, a & self.mask, None, 0])
+            elif opcode == Instruction.PSH:
+                stack.append([op, state.get(a), a if a in TRACKED else None, versions.get(a, 0)])
+            elif opcode == Instruction.POP:
+                value = source = None
+                if stack:
+                    push, value, source, version = stack.pop()
+                    if value is None and (source is None or versions.get(source, 0) != version):
+                        source = None
+                    elif rewrite: # The pair, however far apart, is one assignment at the pop
+                        push[0] = None
+                        op[:] = [Instruction.LI, a, value] if value is not None else [Instruction.MOV, a, source]
+                        changed = True
+                if value is None and source is not None:
+                    value = state.get(source)
+                write(a, value)
+            elif opcode == Instruction.LI:
+                if rewrite and a in TRACKED and state.get(a) == b & self.mask:
+                    op[0] = None # Already holds the value
+                    changed = True
+                    continue
+                write(a, b)
+            elif opcode == Instruction.MOV:
+                value = state.get(b)
+                if rewrite and (a == b or (value is not None and state.get(a) == value)):
+                    op[0] = None
+                    changed = True
+                    continue
+                if rewrite and value is not None:
+                    op[:] = [Instruction.LI, a, value]
+                    changed = True
+                write(a, value)
+            elif opcode == Instruction.SWP:
+                first, second = state.get(a), state.get(b)
+                write(a, second)
+                write(b, first)
+            elif opcode in OPERATIONS:
+                self.operate(state, opcode, a, b)
+                versions[AC * 2] = versions.get(AC * 2, 0) + 1
+            elif opcode in (Instruction.LW, Instruction.IN):
+                write(a)
+            elif opcode in BRANCHES:
+                decided = taken(opcode, *flags(state))
+                if rewrite and decided is not None:
+                    if decided:
+                        op[:] = [Instruction.JI, a, None]
+                    else:
+                        op[0] = None
+                    changed = True
+            elif opcode in CALLS:
+                state = {}
+
+        if changed:
+            block.ops = [op for op in block.ops if op[0] is not None]
+        return state, changed
+
+    def operate(self, state, opcode, a, b) -> None: # An ALU op on state, folded when its operands are known
+        values = [state.get(a)] if opcode == Instruction.NOT else [state.get(a), state.get(b)]
+        for key in (AC * 2, RESULT, "zero", "negative"):
+            state.pop(key, None)
+
+        if None not in values:
+            try:
+                result = getattr(self.alu, OPERATIONS[opcode])(*values)
+            except Exception: # Faults when it runs, nothing after it is known
+                return
+            state[RESULT] = result
+            state[AC * 2] = result & self.mask
+        elif opcode == Instruction.AND and any(value is not None and self.signed(value) >= 0 for value in values):
+            state["negative"] = False # Masked with a non-negative value
+
+    def propagate(self, blocks) -> bool:
+        labels = entries(blocks)
+        start = labels["main"]
+        states = {start: {}} if start is not None else {}
+        work = [start] if start is not None else []
+
+        while work:
+            block = work.pop()
+            state, _ = self.walk(block, states[block])
+            for successor, incoming in self.edges(block, state, labels):
+                if successor is None:
+                    continue
+                merged = meet(states.get(successor), incoming)
+                if merged != states.get(successor):
+                    states[successor] = merged
+                    work.append(successor)
+
+        changed = False
+        for block in blocks:
+            if block in states:
+                changed |= self.walk(block, states[block], rewrite=True)[1]
+        return changed
+
+    def edges(self, block, state, labels) -> list: # (successor, state on entry) for each edge out of block
+        opcode, target, _ = block.ops[-1]
+        if opcode in CALLS: # The callee starts from nothing known, and returns with nothing known
+            return [(labels[target], {}), (block.fallthrough, {})]
+        if opcode == Instruction.JI:
+            return [(labels[target], state)]
+        if opcode in BRANCHES:
+            decided = taken(opcode, *flags(state))
+            result = []
+            if decided is not False:
+                result.append((labels[target], refine(state, opcode, True)))
+            if decided is not True:
+                result.append((block.fallthrough, refine(state, opcode, False)))
+            return result
+        if opcode in (Instruction.HLT, Instruction.RET, Instruction.RTN):
+            return []
+        return [(block.fallthrough, state)]
+
+    def swaps(self, blocks) -> bool:
+        changed = False
+        for block in blocks:
+            ops = block.ops
+            for k, op in enumerate(ops):
+                if op[0] != Instruction.SWP or op[1] == op[2] or {op[1], op[2]} & STACK_POINTERS:
+                    continue
+                first = self.freshDefinition(ops, k, op[1])
+                second = self.freshDefinition(ops, k, op[2])
+                if first is None or second is None:
+                    continue
+
+                # Each register now gets the other one's definition, at the swp
+                ops[k] = [ops[second][0], op[1], ops[second][2]]
+                ops.insert(k + 1, [ops[first][0], op[2], ops[first][2]])
+                ops[first][0] = ops[second][0] = None
+                changed = True
+                break # One per block per round, indexes moved
+            if changed:
+                block.ops = [op for op in block.ops if op[0] is not None]
+        return changed
+
+    def freshDefinition(self, ops, end, register): # Index of the LI/MOV setting register that could move to end, or None
+        for k in range(end - 1, -1, -1):
+            opcode, a, b = ops[k]
+            read, written = effects(ops[k])
+            if a == register and opcode in (Instruction.LI, Instruction.MOV) and register in written:
+                if opcode == Instruction.MOV:
+                    for later in ops[k + 1:end]: # The source has to hold the same value at the swp
+                        if b in effects(later)[1]:
+                            return None
+                return k
+            if register in read or register in written:
+                return None
+        return None
+
+    def deadStores(self, blocks) -> bool:
+        link(blocks) # Branches propagate() removed may have emptied blocks
+        live = {block: set() for block in blocks if block.ops}
+
+        def liveOut(block):
+            result = set()
+            for successor in block.successors:
+                result |= EVERYTHING if successor is None else live[successor]
+            return result
+
+        stable = False
+        while not stable:
+            stable = True
+            for block in reversed([block for block in blocks if block.ops]):
+                current = liveOut(block)
+                for op in reversed(block.ops):
+                    read, written = effects(op)
+                    current = (current - written) | read
+                if current != live[block]:
+                    live[block] = current
+                    stable = False
+
+        changed = False
+        for block in live:
+            current = liveOut(block)
+            for op in reversed(block.ops):
+                read, written = effects(op)
+                if op[0] in REMOVABLE and not written & current:
+                    op[0] = None
+                    changed = True
+                    continue
+                current = (current - written) | read
+            block.ops = [op for op in block.ops if op[0] is not None]
+        return changed
+
+    def cleanup(self, blocks) -> bool:
+        changed = False
+        link(blocks)
+        labels = entries(blocks)
+
+        reachable = set()
+        work = [labels["main"]]
+        while work:
+            block = work.pop()
+            if block is None or block in reachable:
+                continue
+            reachable.add(block)
+            work.extend(block.successors)
+        for block in blocks:
+            if block.ops and block not in reachable:
+                block.ops = []
+                changed = True
+        if changed:
+            link(blocks)
+            labels = entries(blocks)
+
+        for block in blocks:
+            if not block.ops:
+                continue
+            op = block.ops[-1]
+            if op[0] == Instruction.JI and labels[op[1]] is block.fallthrough and block.fallthrough is not None:
+                block.ops.pop() # Jump to the next block
+                changed = True
+                continue
+
+            jump = block.fallthrough
+            if op[0] in INVERSE and jump is not None and jump.label is None and len(jump.ops) == 1 \
+                    and jump.ops[0][0] == Instruction.JI and labels[op[1]] is jump.fallthrough:
+                op[:] = [INVERSE[op[0]], jump.ops[0][1], None] # Branch over a jump, the unlabelled jump has no other way in
+                jump.ops = []
+                changed = True
+
+        blocks[:] = [block for block in blocks if block.ops or block.label is not None]
+        link(blocks)
+        return changed
+
+
+def setsStack(blocks) -> bool: # Whether any op names sp as its destination
+    for block in blocks:
+        for op in block.ops:
+            if op[0] != Instruction.PSH and SP * 2 in operands(op) & effects(op)[1]:
+                return True
+    return False
+
+
+def underflows(blocks) -> bool: # Whether a pop may run before its own function pushed anything for it
+    labels = entries(blocks)
+    depth = {} # Block -> fewest words its function may have pushed when it starts, calls start at 0
+    pending = []
+
+    def reach(block, words):
+        if block is not None and words < depth.get(block, words + 1):
+            depth[block] = words
+            pending.append(block)
+
+    reach(labels["main"], 0)
+    while pending:
+        block = pending.pop()
+        words = depth[block]
+        for opcode, _, _ in block.ops:
+            if opcode in (Instruction.PSH, Instruction.PSHI):
+                words += 1
+            elif opcode == Instruction.POP:
+                if words == 0: # Reads the caller's frame, or the clamped top of the stack in main
+                    return True
+                words -= 1
+
+        opcode, target, _ = block.ops[-1]
+        if opcode in CALLS: # Returns restore sp, the caller goes on at the depth it called from
+            reach(labels[target], 0)
+            reach(block.fallthrough, words)
+        else:
+            for successor in block.successors:
+                reach(successor, words)
+    return False
+
+
+def overflows(blocks, saves, limit) -> bool: # Whether more than limit words may be on the stack, past that a push stops moving sp
+    labels = entries(blocks)
+    depth = {}  # Block -> most words on the stack when it starts, call frames included
+    raises = {} # Block -> times its depth went up, more than there are blocks means a loop or a recursion keeps growing it
+    pending = deque()
+
+    def reach(block, words):
+        if block is not None and words > depth.get(block, -1):
+            depth[block] = words
+            raises[block] = raises.get(block, 0) + 1
+            pending.append(block)
+
+    reach(labels["main"], 0)
+    while pending:
+        block = pending.popleft()
+        if raises[block] > len(blocks) or depth[block] > limit:
+            return True
+        words = depth[block]
+        for opcode, _, _ in block.ops:
+            if opcode in (Instruction.PSH, Instruction.PSHI):
+                words += 1
+            elif opcode == Instruction.POP:
+                words -= 1
+            elif opcode == Instruction.SWP and words + 2 > limit: # Pushes both before popping them
+                return True
+            if words > limit:
+                return True
+
+        opcode, target, _ = block.ops[-1]
+        if opcode in CALLS:
+            frame = len(SAVED_REGISTERS) + 1 if opcode == Instruction.JALI else len(MASK_REGISTERS[saves.get(target, 0)]) + 3
+            reach(labels[target], words + frame)
+            reach(block.fallthrough, words)
+        else:
+            for successor in block.successors:
+                reach(successor, words)
+    return False
+
+
+def optimize(program, memory_size=8192) -> Program: # Returns an optimized copy for a CPU of memory_size, program is left as it is
+    blocks = build(program) if unsupported(program) is None else None
+    limit = segmentSizes(memory_size)[-1] // (program.word_size // 8) - 1 # Pushes that move sp from the top of the stack
+
+    # A program moving sp itself may park it at either end, one popping more than it pushed reads the clamped top
+    # and one pushing more than the stack holds writes the bottom word over and over
+    if blocks is None or setsStack(blocks) or underflows(blocks) or overflows(blocks, program.saves, limit):
+        unchanged = Program(program.word_size)
+        unchanged.byte_count = program.byte_count
+        unchanged.functions = {func: list(code) for func, code in program.functions.items()}
+        unchanged.labels = dict(program.labels)
+        unchanged.saves = dict(program.saves)
+        return unchanged
+
+    optimizer = Optimizer(program.word_size)
+    for _ in range(MAX_ROUNDS):
+        changed = optimizer.propagate(blocks)
+        changed |= optimizer.swaps(blocks)
+        changed |= optimizer.deadStores(blocks)
+        changed |= optimizer.cleanup(blocks)
+        if not changed:
+            break
+    return emit(blocks, program)
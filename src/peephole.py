@@ -0,0 +1,66 @@
+# Peephole pass fusing common instruction pairs into superinstructions, e.g.
+#
+#   program = fuse(assemble(source))
+#   cpu.loadProgram(program.functions, program.byte_count, program.saves)
+#
+#   pshi 0x0005, pop r1     ->  li    r1, 0x0005
+#   psh r2, pop r1          ->  mov   r1, r2
+#   sub r1, r2, blt 0x0040  ->  cmpb  (r1, r2), (blt, 0x0040)
+#   and r1, r2, beq 0x0040  ->  tstb  (r1, r2), (beq, 0x0040)
+#
+# Only the first opcode byte of a pair is rewritten, so the image keeps its size, labels and
+# return addresses, and a jump into the second instruction still lands on it. The CPU decodes
+# a superinstruction as one record and runs it with one dispatch, see CPU.decode.
+from instruction import Format, FORMATS, FUSED, lengths
+from program import Program
+from registers import REGISTER_NAMES, IP
+
+
+def operandRegister(offset) -> bool: # A valid register operand other than ip, which reads differently once fused
+    return offset % 2 == 0 and IP < offset >> 1 < len(REGISTER_NAMES)
+
+
+def superinstruction(code, address, length, word_bytes): # The opcode replacing code[address], or None
+    instruction = code[address]
+    following = address + length
+    if following >= len(code):
+        return None
+
+    for fused, (head, tails) in FUSED.items():
+        if instruction != head or code[following] not in tails:
+            continue
+        if following + lengths(word_bytes)[FORMATS[code[following]]] > len(code):
+            return None
+
+        operandFormat = FORMATS[head]
+        if operandFormat == Format.REG and not operandRegister(code[address + 1]):
+            return None
+        if operandFormat == Format.REG_REG and not (operandRegister(code[address + 1]) and operandRegister(code[address + 2])):
+            return None
+        if FORMATS[code[following]] == Format.REG and not operandRegister(code[following + 1]):
+            return None
+        return fused
+    return None
+
+
+def fuse(program) -> Program: # Returns a fused copy, program is left as it is
+    word_bytes = program.word_size // 8
+    size = lengths(word_bytes)
+
+    fused = Program(program.word_size)
+    fused.byte_count = program.byte_count
+    fused.labels = dict(program.labels)
+    fused.saves = dict(program.saves)
+
+    for func, code in program.functions.items():
+        code = [int(byte) & 0xff for byte in code]
+        address = 0
+        while address < len(code):
+            length = size[FORMATS.get(code[address], Format.NONE)]
+            replacement = superinstruction(code, address, length, word_bytes)
+            if replacement is not None:
+                length += size[FORMATS[code[address + length]]] # Skip the tail, it can't start another pair
+                code[address] = replacement
+            address += length
+        fused.functions[func] = code
+    return fused
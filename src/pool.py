@@ -0,0 +1,100 @@
+# Runs many independent programs across worker processes, one CPU per job
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from cpu import CPU, FAULT, STATUS_NAMES
+from program import Program, layout
+
+
+def jobPayload(job, word_size=16) -> tuple:
+    if isinstance(job, Program):
+        if job.word_size != word_size: # Its immediates would decode as garbage, reject it like CPU.load does
+            raise Exception("Program is built for a {}-bit CPU".format(job.word_size))
+        if "main" not in job.functions:
+            raise Exception("Program requires main function")
+        image, labels = layout(job.functions)
+        return ("image", bytes(image), labels["main"], labels, job.saves)
+    if isinstance(job, (str, os.PathLike)):
+        return ("path", os.fspath(job)) # Executable written by Program.save, each worker maps it
+    return ("image", bytes(job), 0, {}, {})
+
+
+def runJob(payload, memory_size, word_size, max_steps, timeout, shared_name, shared_offset) -> dict:
+    cpu = CPU(memory_size, word_size=word_size)
+    if payload[0] == "path":
+        cpu.load(payload[1])
+    else:
+        _, image, entry, labels, saves = payload
+        cpu.loadImage(image, entry, labels, saves)
+        cpu.verifyImage(len(image)) # As loadProgram and load do, a verified image runs through runVerified
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    status = cpu.run(max_steps, deadline)
+
+    result = {
+        "status": STATUS_NAMES[status],
+        "steps": cpu.steps,
+        "error": str(cpu.error) if status == FAULT else None,
+        "registers": {name: cpu.getRegisterValue(cpu.getRegisterIndex(name)) for name in cpu.registerNames},
+        "stack_frame_size": cpu.stack_frame_size,
+        "alu_result": cpu.alu.result,
+        "stack": bytes(cpu.stack.memory),
+        "general": None,
+    }
+
+    if shared_name is None:
+        result["general"] = bytes(cpu.general.memory)
+    else: # Large segments go back through shared memory instead of the result pickle
+        shared = shared_memory.SharedMemory(name=shared_name) # Workers share the parent's resource tracker, the parent unlinks it
+        shared.buf[shared_offset:shared_offset + cpu.general.size] = cpu.general.memory
+        shared.close()
+
+    return result
+
+
+def jobFault(error) -> dict: # Result of a job that raised instead of running, e.g. its image didn't load or its worker died
+    return {
+        "status": STATUS_NAMES[FAULT],
+        "steps": 0,
+        "error": str(error),
+        "registers": None,
+        "stack_frame_size": None,
+        "alu_result": None,
+        "stack": None,
+        "general": None,
+    }
+
+
+def runMany(jobs, workers=None, memory_size=8192, word_size=16, max_steps=None, timeout=None, shared_threshold=4096) -> list:
+    payloads = [jobPayload(job, word_size) for job in jobs]
+    general_size = CPU(memory_size, word_size=word_size).general.size
+
+    shared = None
+    if payloads and general_size >= shared_threshold:
+        shared = shared_memory.SharedMemory(create=True, size=general_size * len(payloads))
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(runJob, payload, memory_size, word_size, max_steps, timeout,
+                                shared.name if shared is not None else None, i * general_size)
+                for i, payload in enumerate(payloads)
+            ]
+
+            results = []
+            for i, future in enumerate(futures): # Workers stop themselves at max_steps and the deadline
+                try:
+                    result = future.result()
+                except Exception as e: # One bad job doesn't lose the others' results
+                    results.append(jobFault(e))
+                    continue
+                if shared is not None:
+                    result["general"] = bytes(shared.buf[i * general_size:(i + 1) * general_size])
+                results.append(result)
+            return results
+    finally:
+        if shared is not None:
+            shared.close()
+            shared.unlink()
@@ -0,0 +1,105 @@
+# Memory-mapped I/O ports on the io segment, serviced by asyncio streams, e.g.
+#
+#   pshi  0x0000
+#   pop   r2
+#   in    r1, r2        ; next input byte, the guest yields to the event loop while none are queued
+#   pshi  0x0002
+#   pop   r2
+#   out   r1, r2        ; low byte of r1 is queued for the output stream
+#
+# Many guests share one event loop, each under its own runAsync() task.
+import asyncio
+from collections import deque
+
+from cpu import WouldBlock, BUDGET, TIMEOUT, WAITING
+
+# Port addresses on a 16-bit CPU, wider CPUs keep them one word apart (OUTPUT is 0x04 at 32 bits)
+INPUT     = 0x00 # Read: next input byte, all ones once the input is closed
+OUTPUT    = 0x02 # Write: low byte goes to the output stream
+AVAILABLE = 0x04 # Read: number of queued input bytes, never blocks
+
+
+class AsyncPorts:
+    def __init__(self, cpu, reader=None, writer=None):
+        self.cpu = cpu
+        self.reader = reader # asyncio.StreamReader, None for no input
+        self.writer = writer # asyncio.StreamWriter, None to only collect output in self.written
+
+        self.input = deque()
+        self.closed = reader is None
+        self.output = asyncio.Queue()
+        self.written = bytearray()
+
+        self.wordBytes = cpu.wordBytes
+        scale = self.wordBytes // 2
+        self.inputAddress = INPUT * scale
+        self.outputAddress = OUTPUT * scale
+        self.availableAddress = AVAILABLE * scale
+
+        cpu.io.onRead(self.onRead)
+        cpu.io.onWrite(self.onWrite)
+
+    def feed(self, data) -> None: # Queue input without a reader
+        self.input.extend(data)
+
+    def onRead(self, address, length) -> None:
+        memory = self.cpu.io.memory
+        size = self.wordBytes
+
+        if address <= self.inputAddress < address + length:
+            if self.input:
+                value = self.input.popleft()
+            elif self.closed:
+                value = self.cpu.wordMask
+            else:
+                raise WouldBlock("Input port empty")
+            # Straight into the bytes, a setUint16 would run the write hooks
+            memory[self.inputAddress:self.inputAddress + size] = value.to_bytes(size, "big")
+
+        if address <= self.availableAddress < address + length:
+            count = min(len(self.input), self.cpu.wordMask)
+            memory[self.availableAddress:self.availableAddress + size] = count.to_bytes(size, "big")
+
+    def onWrite(self, address, length) -> None:
+        if address <= self.outputAddress < address + length:
+            self.output.put_nowait(self.cpu.io.memory[self.outputAddress + self.wordBytes - 1])
+
+    async def fill(self) -> None: # Waits for the reader to produce more input
+        data = await self.reader.read(4096)
+        if not data:
+            self.closed = True
+        self.input.extend(data)
+
+    async def drain(self) -> None: # Consumer task, batches queued output bytes into the writer
+        while True:
+            chunk = bytearray([await self.output.get()])
+            while not self.output.empty():
+                chunk.append(self.output.get_nowait())
+
+            self.written += chunk
+            if self.writer is not None:
+                self.writer.write(chunk)
+                await self.writer.drain()
+
+            for _ in chunk:
+                self.output.task_done()
+
+
+async def runAsync(cpu, ports=None, quantum=1000) -> int: # Runs cpu to completion, yielding to the loop every quantum instructions
+    consumer = asyncio.create_task(ports.drain()) if ports is not None else None
+    try:
+        while True:
+            status = cpu.run(quantum)
+            if status in (BUDGET, TIMEOUT):
+                await asyncio.sleep(0)
+            elif status == WAITING:
+                await ports.fill()
+            else:
+                break
+
+        if ports is not None:
+            await ports.output.join()
+    finally:
+        if consumer is not None:
+            consumer.cancel()
+    return status
@@ -0,0 +1,125 @@
+# Hot-path profiler, counts executions and handler wall time per ip under the guest call stack, e.g.
+#
+#   cpu.profiler = Profiler(cpu)
+#   cpu.run()
+#   cpu.profiler.printReport()
+#   cpu.profiler.writeFolded("vm.folded") # flamegraph.pl vm.folded > vm.svg
+#
+# Functions are the Program function labels (every assembler label), an ip belongs to the
+# closest label at or below it. The call stack is followed through the call and return opcodes.
+from bisect import bisect_right
+
+from instruction import Instruction
+from registers import IP
+
+CALLS = {Instruction.JAL, Instruction.JALI, Instruction.CALL, Instruction.CALLR}
+RETURNS = {Instruction.RET, Instruction.RTN}
+
+
+def opcodeName(instruction) -> str:
+    try:
+        return Instruction(instruction).name
+    except ValueError:
+        return hex(instruction)
+
+
+class Profiler:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.clear()
+
+    def clear(self) -> None:
+        self.samples = {}  # (caller path, ip, opcode) -> [executions, handler ns]
+        self.calls = {}    # Function label -> times called
+        self.path = ""     # Function labels of the active call sites, ";" terminated
+        self.paths = []    # Saved paths of the callers, one per active call
+        self.names = {}    # ip -> function label cache
+
+    def functionAt(self, ip) -> str:
+        name = self.names.get(ip)
+        if name is None:
+            labels = sorted(self.cpu.labels.items(), key=lambda item: item[1])
+            index = bisect_right([address for _, address in labels], ip) - 1
+            name = labels[index][0] if index >= 0 else hex(ip)
+            self.names[ip] = name
+        return name
+
+    def record(self, ip, instruction, elapsed) -> None: # Called by CPU.runProfiled after each handler returns
+        key = (self.path, ip, instruction)
+        entry = self.samples.get(key)
+        if entry is None:
+            self.samples[key] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+        if instruction in CALLS:
+            self.paths.append(self.path)
+            self.path += self.functionAt(ip) + ";"
+            callee = self.functionAt(self.cpu.regs[IP])
+            self.calls[callee] = self.calls.get(callee, 0) + 1
+        elif instruction in RETURNS and self.paths: # A RET with no call seen leaves the root alone
+            self.path = self.paths.pop()
+
+    def opcodes(self) -> dict: # Opcode name -> [executions, handler ns]
+        totals = {}
+        for (_, _, instruction), (count, elapsed) in self.samples.items():
+            total = totals.setdefault(opcodeName(instruction), [0, 0])
+            total[0] += count
+            total[1] += elapsed
+        return totals
+
+    def functions(self) -> dict: # Function label -> [instructions, self ns, inclusive ns, calls]
+        totals = {}
+        for (path, ip, _), (count, elapsed) in self.samples.items():
+            name = self.functionAt(ip)
+            total = totals.setdefault(name, [0, 0, 0, self.calls.get(name, 0)])
+            total[0] += count
+            total[1] += elapsed
+
+            # Inclusive time counts once per function however deep the recursion
+            for caller in set(path.split(";")[:-1]) - {name}:
+                totals.setdefault(caller, [0, 0, 0, self.calls.get(caller, 0)])[2] += elapsed
+            total[2] += elapsed
+        return totals
+
+    def heatMap(self) -> dict: # ip -> [executions, handler ns]
+        heat = {}
+        for (_, ip, _), (count, elapsed) in self.samples.items():
+            total = heat.setdefault(ip, [0, 0])
+            total[0] += count
+            total[1] += elapsed
+        return heat
+
+    def folded(self, weight="time", ips=False) -> list: # "caller;callee;leaf value" lines, weighted by ns or executions
+        stacks = {}
+        for (path, ip, instruction), (count, elapsed) in self.samples.items():
+            stack = path + self.functionAt(ip)
+            if ips: # One more frame per instruction, e.g. "main;rec;0x001a ADD"
+                stack += ";{} {}".format(hex(ip), opcodeName(instruction))
+            stacks[stack] = stacks.get(stack, 0) + (elapsed if weight == "time" else count)
+        return ["{} {}".format(stack, value) for stack, value in sorted(stacks.items())]
+
+    def writeFolded(self, path, weight="time", ips=False) -> None:
+        with open(path, "w") as f:
+            for line in self.folded(weight, ips):
+                f.write(line + "\n")
+
+    def printReport(self, top=10) -> None:
+        opcodes = sorted(self.opcodes().items(), key=lambda item: -item[1][1])
+        total = sum(elapsed for _, (_, elapsed) in opcodes) or 1
+
+        print("{:<10}{:>12}{:>12}{:>10}{:>8}".format("opcode", "count", "ms", "ns/op", "%"))
+        for name, (count, elapsed) in opcodes:
+            print("{:<10}{:>12}{:>12.2f}{:>10.0f}{:>8.1f}".format(name, count, elapsed / 1e6, elapsed / count, elapsed * 100 / total))
+
+        print()
+        print("{:<16}{:>12}{:>10}{:>12}{:>12}".format("function", "instrs", "calls", "self ms", "total ms"))
+        for name, (count, own, inclusive, calls) in sorted(self.functions().items(), key=lambda item: -item[1][2]):
+            print("{:<16}{:>12}{:>10}{:>12.2f}{:>12.2f}".format(name, count, calls, own / 1e6, inclusive / 1e6))
+
+        print()
+        print("{:<8}{:<16}{:<10}{:>12}{:>12}".format("ip", "function", "opcode", "count", "ms"))
+        opcodesAt = {ip: instruction for (_, ip, instruction) in self.samples}
+        for ip, (count, elapsed) in sorted(self.heatMap().items(), key=lambda item: -item[1][1])[:top]:
+            print("{:<8}{:<16}{:<10}{:>12}{:>12.2f}".format(hex(ip), self.functionAt(ip), opcodeName(opcodesAt[ip]), count, elapsed / 1e6))
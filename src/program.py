@@ -1,13 +1,36 @@
 from instruction import Instruction
+from executable import writeExecutable
+from registers import R1, R8
+
+
+def layout(functions) -> tuple: # Lay functions out back to back, returns (image, labels)
+    labels = {}
+    image = bytearray()
+    for func in functions:
+        labels[func] = len(image)
+        image.extend(int(byte) & 0xff for byte in functions[func])
+    return image, labels
+
+
+def saveMask(registers) -> int: # Register operand offsets -> save mask, see registers.MASK_REGISTERS
+    mask = 0
+    for offset in registers:
+        index = offset >> 1
+        if offset % 2 != 0 or index < R1 or index > R8:
+            raise Exception("Only r1-r8 can be preserved, got register {}".format(offset))
+        mask |= 1 << (index - R1)
+    return mask
 
 
 class Program:
-    def __init__(self) -> None:
+    def __init__(self, word_size=16) -> None:
+        self.word_size = word_size # Width of WORD immediates and label addresses
         self.byte_count = 0
         self.functions = {}
         self.labels = {}
+        self.saves = {} # Function -> save mask, the registers CALL/CALLR preserve across a call to it
 
-    def instruction(self, instruction=None, arg1=None, arg2=None, func="main", label=None) -> None:
+    def instruction(self, instruction=None, arg1=None, arg2=None, func="main", label=None, value=None) -> None: # value encodes a whole WORD immediate
         if func not in self.functions:
             self.functions[func] = []
             self.labels[func] = self.byte_count
@@ -18,12 +41,16 @@ class Program:
             if label != None and arg1 == None and arg2 == None:
                 if label not in self.labels:
                     raise Exception("Label \"{}\" not yet declared".format(label))
-                jump_address = self.labels[label]
-                arg1 = (jump_address & 0xff00) >> 8
-                arg2 = (jump_address & 0x00ff)
+                value = self.labels[label]
         else:
             return
 
+        if value != None:
+            size = self.word_size // 8
+            self.functions[func].extend((value >> (8 * (size - 1 - k))) & 0xff for k in range(size)) # Big endian
+            self.byte_count += size
+            return
+
         if arg1 != None:
             self.functions[func].append(arg1)
             self.byte_count += 1
@@ -31,3 +58,13 @@ class Program:
         if arg2 != None:
             self.functions[func].append(arg2)
             self.byte_count += 1
+
+    def preserve(self, func, registers) -> None: # registers are operand offsets of r1-r8, every other register is caller-saved
+        self.saves[func] = saveMask(registers)
+
+    def save(self, path) -> None:
+        if "main" not in self.functions:
+            raise Exception("Program requires main function")
+
+        image, labels = layout(self.functions)
+        writeExecutable(path, image, labels["main"], labels, self.word_size, self.saves)
@@ -0,0 +1,39 @@
+from array import array
+
+REGISTER_NAMES = [
+    'ip', 'ac',
+    'r1', 'r2', 'r3', 'r4',
+    'r5', 'r6', 'r7', 'r8',
+    'sp', 'fp',
+]
+
+# Register indices, instructions encode a register as its byte offset (index * 2)
+IP, AC, R1, R2, R3, R4, R5, R6, R7, R8, SP, FP = range(len(REGISTER_NAMES))
+
+# Save masks pick the registers a CALL preserves, bit k is register r(k + 1)
+MASK_REGISTERS = [tuple(R1 + k for k in range(8) if mask >> k & 1) for mask in range(256)]
+
+
+# array typecode holding one register of each word size
+TYPECODES = {16: 'H', 32: 'I', 64: 'Q'}
+
+
+class RegisterFile:
+    def __init__(self, names=REGISTER_NAMES, bits=16):
+        if bits not in TYPECODES:
+            raise Exception("Unsupported word size: {}".format(bits))
+        self.names = list(names)
+        self.values = array(TYPECODES[bits], [0] * len(self.names))
+        self.mask = (1 << bits) - 1
+        self.size = len(self.names) * 2 # Operands still encode a register as index * 2 whatever the word size
+
+    def index(self, offset) -> int:
+        if offset < 0 or offset >= self.size or offset % 2 != 0:
+            raise Exception("Register index: {} not found".format(offset))
+        return offset >> 1
+
+    def get(self, index) -> int:
+        return self.values[index]
+
+    def set(self, index, value) -> None:
+        self.values[index] = value & self.mask
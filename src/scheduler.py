@@ -0,0 +1,50 @@
+# Round-robin scheduler, time-slices many CPU instances in one process
+import time
+from collections import deque
+
+from cpu import BUDGET, TIMEOUT, WAITING
+
+
+class Scheduler:
+    def __init__(self, quantum=1000):
+        self.quantum = quantum # Instructions per slice
+        self.ready = deque()   # (cpu, instructions left or None)
+        self.finished = []     # CPUs that halted, faulted or used up their own budget
+        self.waiting = []      # (cpu, instructions left or None) blocked on an input port until wake()
+
+    def add(self, cpu, max_steps=None) -> None:
+        self.ready.append((cpu, max_steps))
+
+    def runSlice(self, deadline=None) -> bool: # Runs the next ready CPU for one quantum, False once none are left
+        if not self.ready:
+            return False
+
+        cpu, remaining = self.ready.popleft()
+        steps = self.quantum if remaining is None else min(self.quantum, remaining)
+        before = cpu.steps
+        status = cpu.run(steps, deadline)
+
+        if remaining is not None:
+            remaining -= cpu.steps - before
+        if status == TIMEOUT or (status == BUDGET and remaining != 0):
+            self.ready.append((cpu, remaining))
+        elif status == WAITING:
+            self.waiting.append((cpu, remaining))
+        else:
+            self.finished.append(cpu)
+        return True
+
+    def wake(self, cpu) -> None: # Requeues a waiting CPU once its input has arrived
+        for i, (waiter, remaining) in enumerate(self.waiting):
+            if waiter is cpu:
+                del self.waiting[i]
+                self.ready.append((cpu, remaining))
+                return
+        raise Exception("CPU is not waiting")
+
+    def run(self, deadline=None) -> list: # Returns the finished CPUs, any still ready when the deadline passes stay queued, blocked ones stay in waiting
+        while self.ready:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self.runSlice(deadline)
+        return self.finished
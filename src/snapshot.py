@@ -0,0 +1,77 @@
+# Point-in-time copies of a CPU. The flat address space is written once to an anonymous
+# file, fork() maps that file copy-on-write so every fork shares its pages until it
+# writes to them, and restore() copies them back into an existing CPU.
+import mmap
+import os
+import tempfile
+from array import array
+
+
+class Snapshot:
+    def __init__(self, cpu):
+        self.cpuClass = type(cpu)
+        self.memory_size = cpu.memory_size
+        self.word_size = cpu.wordBits
+        self.size = cpu.memory.size
+
+        if hasattr(os, "memfd_create"):
+            self.file = os.fdopen(os.memfd_create("pyvm-snapshot"), "w+b")
+        else:
+            self.file = tempfile.TemporaryFile()
+        self.file.write(cpu.memory.memory) # The flat address space holds every segment
+        self.file.flush()
+        self.image = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+
+        self.registers = array(cpu.regs.typecode, cpu.regs)
+        self.stack_frame_size = cpu.stack_frame_size
+        self.result = cpu.alu.result
+        self.labels = dict(cpu.labels)
+        self.saveMasks = dict(cpu.saveMasks)
+        self.decoded = list(cpu.decoded) # Decoded records, copied into every fork and restore
+        self.verified = cpu.verified
+        self.status = cpu.status
+        self.error = cpu.error
+        self.steps = cpu.steps
+
+    def fork(self): # New CPU whose segments share this snapshot's pages until written
+        buffer = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_COPY)
+        cpu = self.cpuClass(self.memory_size, buffer, self.word_size)
+        self.applyState(cpu)
+
+        # A private copy, a guest swa into its own code invalidates records in place and run() keeps reading the same list
+        cpu.decoded = list(self.decoded)
+        return cpu
+
+    def restore(self, cpu) -> None: # Copy this snapshot back into cpu, bypassing the write hooks
+        if cpu.memory_size != self.memory_size or cpu.wordBits != self.word_size:
+            raise Exception("Snapshot is for a {} byte {}-bit CPU".format(self.memory_size, self.word_size))
+
+        with memoryview(cpu.memory.memory) as view:
+            view[:] = self.image
+
+        if cpu.compiler is not None: # Blocks may have been compiled from code the restore replaced
+            cpu.compiler.blocks.clear()
+        cpu.decoded = list(self.decoded)
+        self.applyState(cpu)
+
+    def applyState(self, cpu) -> None:
+        cpu.regs[:] = self.registers
+        cpu.stack_frame_size = self.stack_frame_size
+        cpu.alu.result = self.result
+        cpu.labels = dict(self.labels)
+        cpu.saveMasks = dict(self.saveMasks)
+        cpu.verified = self.verified
+        cpu.bound = [] # Holds handlers bound to one CPU, runVerified rebinds on first use
+        cpu.status = self.status
+        cpu.error = self.error
+        cpu.steps = self.steps
+
+    def close(self) -> None: # Forks keep their own mappings and stay valid
+        self.image.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
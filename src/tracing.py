@@ -0,0 +1,46 @@
+from collections import deque
+
+from instruction import Instruction, Format, FORMATS, LENGTHS
+
+# Instructions that announce a taken jump with "Jumping to address"
+JUMPS = {
+    Instruction.JAL, Instruction.JALI, Instruction.CALL, Instruction.CALLR, Instruction.JR, Instruction.JI,
+    Instruction.BEQ, Instruction.BNE, Instruction.BLT, Instruction.BLE, Instruction.BGT, Instruction.BGE,
+    Instruction.CMPB, Instruction.TSTB,
+}
+
+# A tracer is any callable taking (ip, opcode, operand1, operand2), set it with cpu.tracer = ...
+
+
+class RingTracer:
+    def __init__(self, size=1024):
+        self.records = deque(maxlen=size) # Last `size` executed instructions
+
+    def __call__(self, ip, instruction, a, b) -> None:
+        self.records.append((ip, instruction, a, b))
+
+    def clear(self) -> None:
+        self.records.clear()
+
+    def printRecords(self) -> None:
+        for ip, instruction, a, b in self.records:
+            try:
+                name = Instruction(instruction).name
+            except ValueError:
+                name = hex(instruction)
+            print("{} : {} {} {}".format(hex(ip)[2:].zfill(4), name, a, b))
+
+
+class PrintTracer:
+    def __init__(self, lengths=LENGTHS): # cpu.lengths for a wider CPU
+        self.lengths = lengths
+        self.next_ip = None
+        self.jumping = False
+
+    def __call__(self, ip, instruction, a, b) -> None:
+        if self.jumping and ip != self.next_ip:
+            print("Jumping to address: {}".format(ip))
+        print("Executing instruction: {}".format(instruction))
+
+        self.next_ip = ip + self.lengths[FORMATS.get(instruction, Format.NONE)]
+        self.jumping = instruction in JUMPS
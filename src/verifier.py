@@ -0,0 +1,50 @@
+# Load-time verifier, run by CPU.loadProgram over the laid out image. A program verifies when
+#   every opcode has a handler and every instruction ends inside the image
+#   every register operand is a valid register offset
+#   every jump, branch and call immediate and every label lands on an instruction boundary
+# Verified programs run through CPU.runVerified, which skips the per-step checks of run().
+from instruction import Instruction, Format, FORMATS, FUSED
+
+# Instructions whose WORD operand is a code address
+JUMP_IMMEDIATES = {
+    Instruction.JI, Instruction.JALI, Instruction.CALL,
+    Instruction.BEQ, Instruction.BNE, Instruction.BLT, Instruction.BLE, Instruction.BGT, Instruction.BGE,
+}
+
+
+def verify(cpu, length) -> list: # Problems found in program[0:length], empty when it verified. Decodes the image as it goes
+    problems = []
+    boundaries = set()
+    targets = [] # (address of the jump, target)
+
+    address = 0
+    while address < length:
+        boundaries.add(address)
+        try:
+            instruction, a, b, next_ip = cpu.decode(address)
+        except Exception as e: # Bad register operand, step over it to keep finding boundaries
+            problems.append("{:#06x}: {}".format(address, e))
+            address += cpu.lengths[FORMATS.get(cpu.program.getUint8(address), Format.NONE)]
+            continue
+
+        if cpu.dispatch[instruction] is None:
+            problems.append("{:#06x}: unknown instruction {}".format(address, instruction))
+        if next_ip > length:
+            problems.append("{:#06x}: instruction runs past the end of the program".format(address))
+
+        if instruction in JUMP_IMMEDIATES:
+            targets.append((address, a))
+        elif instruction in FUSED: # Fused pairs, the second instruction stays a valid jump target
+            head = cpu.decodeOperands(address, FUSED[instruction][0])
+            boundaries.add(head[3])
+            if instruction in (Instruction.CMPB, Instruction.TSTB):
+                targets.append((address, b[1]))
+        address = next_ip
+
+    for address, target in targets:
+        if target not in boundaries:
+            problems.append("{:#06x}: jump target {:#06x} is not an instruction".format(address, target))
+    for name, address in sorted(cpu.labels.items(), key=lambda item: item[1]):
+        if address not in boundaries and address != length:
+            problems.append("Label \"{}\" at {:#06x} is not an instruction".format(name, address))
+    return problems
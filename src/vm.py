@@ -1,8 +1,10 @@
-from cpu import CPU
+from cpu import CPU, FAULT
 from instruction import Instruction
 from program import Program
+from tracing import PrintTracer
 
 cpu = CPU()
+cpu.tracer = PrintTracer()
 
 program = Program()
 
@@ -72,7 +74,8 @@ cpu.loadProgram(program.functions, program.byte_count)
 cpu.stack.printChunk(0xcd0, 0x30)
 cpu.printCPUState()
 
-cpu.run()
+if cpu.run() == FAULT:
+    print("Fault: {}".format(cpu.error))
 
 cpu.stack.printChunk(0xcd0, 0x30)
 cpu.printCPUState()